@@ -1,14 +1,27 @@
 import streamlit as st
-import tensorflow.keras
-from PIL import Image, ImageOps
+from PIL import Image
 import numpy as np
+import csv
 import io
 import os
-
-# --- Configuration ---
-MODEL_PATH = "keras_model.h5"
-LABELS_PATH = "labels.txt"
-IMAGE_SIZE = (224, 224)
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+import metrics
+import pipeline
+import tempfile
+import volume
+from pipeline import LABELS_PATH, iter_batches, predict_batch, preprocess_bytes, preprocess_image
+from metrics import RequestTrace
+from prediction_cache import PredictionCache, cache_key, data_digest, model_identity
+from result_store import model_version, open_store_from_env, perceptual_hash
+from mri_gate import MriGate, not_mri_index, rejection_probabilities
+from gradcam import GradCamService, gradcam_enabled, serving_keras_model
+from embeddings import open_index_from_env
+from audit_log import open_audit_log_from_env
+from live_screening import SOURCE_ENV as LIVE_SOURCE_ENV, LiveScreener, open_source
+from startup import ModelLoader, background_load_enabled
+from resource_profiles import Overloaded, admission_from_env
 
 # --- Internationalization (i18n) Messages ---
 MESSAGES = {
@@ -21,8 +34,34 @@ MESSAGES = {
         "input_mode_label": "Select Input Method",
         "mode_upload": "Upload Image",
         "mode_camera": "Live Camera",
+        "mode_batch": "Batch Analysis",
+        "mode_volume": "3D Volume (NIfTI)",
+        "volume_upload_help": "Upload an MRI volume (.nii or .nii.gz)",
+        "volume_results_header": "Volume Analysis Result",
+        "volume_verdict": "**Volume-level result:** {class_name} ({confidence:.2f}%)",
+        "volume_summary": "{scored} of {total} slices analyzed in {seconds:.1f}s ({rate:.0f} slices/s); {skipped} empty slices skipped.",
+        "volume_failed": "{count} slices could not be read and were left out (first: slice {index}, {error}).",
+        "volume_top_slices": "Most suspicious slices",
+        "volume_slice_caption": "Slice {index}: {probability:.1f}% tumor probability",
+        "volume_chart": "Tumor probability per slice",
+        "mode_live": "Live Screening",
+        "live_source": "Frame source: {source}",
+        "live_toggle": "Start continuous screening",
+        "live_status": "Frame {frame} | scored {processed} | unchanged {unchanged} | dropped {dropped} | {fps:.1f} scored/s | lag {lag:.0f} ms",
+        "live_ended": "The frame source has ended.",
         "upload_help": "Upload a brain MRI image (JPG, PNG, JPEG)",
         "camera_button": "Capture Image",
+        "batch_upload_help": "Upload several brain MRI images at once (JPG, PNG, JPEG)",
+        "batch_results_header": "Batch Results",
+        "batch_col_file": "File",
+        "batch_col_class": "Class",
+        "batch_col_confidence": "Confidence (%)",
+        "batch_col_status": "Status",
+        "batch_status_ok": "OK",
+        "batch_status_cached": "Cached",
+        "batch_status_error": "Error",
+        "batch_download": "Download results (CSV)",
+        "batch_summary": "Analyzed {count} images in {seconds:.2f}s ({per_image:.1f} ms per image)",
         "processing": "Processing image...",
         "result_header": "Analysis Result",
         "result_yes_title": "Anomaly Detected (Tumor Found)",
@@ -38,6 +77,24 @@ MESSAGES = {
         "how_to_use_text": "1. Select 'Upload' or 'Camera'.\n2. Provide a clear MRI image.\n3. Wait for the AI analysis.\n4. Review the confidence score and prediction.",
         "references_title": "Disclaimer",
         "references_text": "This is a prototype for educational and screening purposes. It is NOT a definitive medical diagnosis.",
+        "startup_title": "Model startup",
+        "near_duplicate_note": "Result reused from a near-identical image analyzed earlier (hash distance: {distance} bits).",
+        "gate_rejected_note": "Flagged by the fast pre-screening check ({reason}) before the full AI model ran.",
+        "overloaded": "The server is busy right now. Please try again in a few seconds.",
+        "batch_status_gated": "Pre-screened",
+        "heatmap_title": "Where the model is looking",
+        "heatmap_pending": "Generating the attention heatmap...",
+        "heatmap_caption": "Grad-CAM: warmer colours mark the regions that drove this result.",
+        "heatmap_failed": "The attention heatmap could not be generated",
+        "similar_title": "Similar previous scans",
+        "similar_empty": "No similar scans analyzed yet.",
+        "similar_verdict": "Verdict",
+        "similar_similarity": "Similarity",
+        "similar_confidence": "Confidence",
+        "similar_scanned": "Analyzed",
+        "similar_id": "Scan ID",
+        "debug_title": "Debug: recent requests",
+        "model_loading": "The AI model is loading in the background...",
         "developers_title": "Development Team",
     },
     "ar": {
@@ -49,8 +106,34 @@ MESSAGES = {
         "input_mode_label": "اختر طريقة الإدخال",
         "mode_upload": "تحميل صورة",
         "mode_camera": "الكاميرا المباشرة",
+        "mode_batch": "تحليل دفعة من الصور",
+        "mode_volume": "حجم ثلاثي الأبعاد (NIfTI)",
+        "volume_upload_help": "قم بتحميل حجم رنين مغناطيسي (.nii أو .nii.gz)",
+        "volume_results_header": "نتيجة تحليل الحجم",
+        "volume_verdict": "**النتيجة على مستوى الحجم:** {class_name} ({confidence:.2f}%)",
+        "volume_summary": "تم تحليل {scored} من {total} مقطعاً في {seconds:.1f} ثانية ({rate:.0f} مقطع/ثانية)؛ تم تخطي {skipped} مقطعاً فارغاً.",
+        "volume_failed": "تعذرت قراءة {count} مقطعاً وتم استبعادها (أولها: المقطع {index}، {error}).",
+        "volume_top_slices": "المقاطع الأكثر اشتباهاً",
+        "volume_slice_caption": "المقطع {index}: احتمال وجود ورم {probability:.1f}%",
+        "volume_chart": "احتمال وجود ورم لكل مقطع",
+        "mode_live": "فحص مباشر",
+        "live_source": "مصدر الإطارات: {source}",
+        "live_toggle": "بدء الفحص المستمر",
+        "live_status": "الإطار {frame} | تم تحليل {processed} | دون تغيير {unchanged} | تم تجاهل {dropped} | {fps:.1f} تحليل/ث | التأخير {lag:.0f} مللي ثانية",
+        "live_ended": "انتهى مصدر الإطارات.",
         "upload_help": "قم بتحميل صورة رنين مغناطيسي (MRI) للدماغ (JPG, PNG, JPEG)",
         "camera_button": "التقاط الصورة",
+        "batch_upload_help": "قم بتحميل عدة صور رنين مغناطيسي للدماغ دفعة واحدة (JPG, PNG, JPEG)",
+        "batch_results_header": "نتائج الدفعة",
+        "batch_col_file": "الملف",
+        "batch_col_class": "التصنيف",
+        "batch_col_confidence": "نسبة الثقة (%)",
+        "batch_col_status": "الحالة",
+        "batch_status_ok": "تم",
+        "batch_status_cached": "من الذاكرة المؤقتة",
+        "batch_status_error": "خطأ",
+        "batch_download": "تنزيل النتائج (CSV)",
+        "batch_summary": "تم تحليل {count} صورة في {seconds:.2f} ثانية ({per_image:.1f} مللي ثانية لكل صورة)",
         "processing": "جاري معالجة الصورة...",
         "result_header": "نتيجة التحليل",
         "result_yes_title": "تم الكشف عن شذوذ (وجود ورم)",
@@ -66,6 +149,24 @@ MESSAGES = {
         "how_to_use_text": "1. اختر 'تحميل صورة' أو 'الكاميرا'.\n2. ارفع صورة MRI واضحة للدماغ.\n3. انتظر معالجة الذكاء الاصطناعي.\n4. راجع النتيجة ونسبة الثقة الظاهرة.",
         "references_title": "تنبيه هام",
         "references_text": "هذا التطبيق هو نموذج أولي للأغراض التعليمية والفحص الأولي فقط، ولا يعتبر تشخيصاً طبياً نهائياً.",
+        "startup_title": "تشغيل النموذج",
+        "near_duplicate_note": "تم استخدام نتيجة صورة شبه مطابقة تم تحليلها سابقاً (مسافة التجزئة: {distance} بت).",
+        "gate_rejected_note": "تم رفض الصورة بواسطة الفحص المسبق السريع ({reason}) قبل تشغيل نموذج الذكاء الاصطناعي الكامل.",
+        "overloaded": "الخادم مشغول حاليًا. يرجى المحاولة مرة أخرى بعد بضع ثوانٍ.",
+        "batch_status_gated": "فحص مسبق",
+        "heatmap_title": "أين ينظر النموذج",
+        "heatmap_pending": "جاري إنشاء خريطة الانتباه...",
+        "heatmap_caption": "Grad-CAM: الألوان الدافئة تشير إلى المناطق التي أدت إلى هذه النتيجة.",
+        "heatmap_failed": "تعذر إنشاء خريطة الانتباه",
+        "similar_title": "فحوصات سابقة مشابهة",
+        "similar_empty": "لا توجد فحوصات مشابهة تم تحليلها بعد.",
+        "similar_verdict": "النتيجة",
+        "similar_similarity": "التشابه",
+        "similar_confidence": "الثقة",
+        "similar_scanned": "تاريخ التحليل",
+        "similar_id": "معرّف الفحص",
+        "debug_title": "تصحيح: الطلبات الأخيرة",
+        "model_loading": "يتم تحميل نموذج الذكاء الاصطناعي في الخلفية...",
         "developers_title": "فريق التطوير",
     }
 }
@@ -83,32 +184,407 @@ h1 { color: #007bff; text-align: center; font-weight: 700; font-size: 2.5em; }
 """
 
 @st.cache_resource
+def get_model_loader():
+    # Starts importing the runtime and loading/warming the model on first page render
+    return ModelLoader(LABELS_PATH, background=background_load_enabled())
+
 def load_model_and_labels():
     try:
-        model = tensorflow.keras.models.load_model(MODEL_PATH, compile=False)
-        class_names = []
-        if os.path.exists(LABELS_PATH):
-            with open(LABELS_PATH, "r", encoding="utf-8") as f:
-                for line in f:
-                    parts = line.strip().split(" ", 1)
-                    if len(parts) > 1:
-                        class_names.append(parts[1].strip())
-        if not class_names:
-            # Default fallback (should not be used if labels.txt exists)
-            class_names = ["Yes Have a Tumor in Brain Scan", "No Tumor in Brain Scan", "Not MRI Scan"] 
-        return model, class_names
+        return get_model_loader().result()
     except Exception as e:
         st.error(f"Error loading model: {e}")
         st.stop()
 
-def preprocess_image(image):
-    image = image.convert("RGB")
-    image = ImageOps.fit(image, IMAGE_SIZE, Image.Resampling.LANCZOS)
-    image_array = np.asarray(image)
-    normalized_image_array = (image_array.astype(np.float32) / 127.0) - 1
-    data = np.ndarray(shape=(1, 224, 224, 3), dtype=np.float32)
-    data[0] = normalized_image_array
-    return data
+@st.cache_resource
+def start_metrics_exporters():
+    # Prometheus /metrics endpoint and/or textfile, if configured via env
+    return metrics.start_exporters_from_env()
+
+def debug_panel_enabled():
+    return st.query_params.get("debug") == "1" or os.environ.get("NEUROSCAN_DEBUG_PANEL") == "1"
+
+@st.cache_resource
+def get_prediction_cache():
+    # One cache per process, shared by every session and rerun
+    return PredictionCache()
+
+@st.cache_resource
+def get_result_store():
+    # On-disk results that survive restarts; None when disabled or not writable
+    return open_store_from_env()
+
+@st.cache_resource
+def get_admission():
+    # Shared by every session: bounds concurrent decodes/inferences and sheds load past the RSS
+    # headroom over what the loaded model uses
+    loader = get_model_loader()
+    return admission_from_env(baseline=lambda: loader.rss_after_load)
+
+@st.cache_resource
+def get_audit_log():
+    # Background-written record of every rendered result; None when NEUROSCAN_AUDIT_LOG=off
+    return open_audit_log_from_env()
+
+# Inputs remembered per session so reruns do not audit the same result again
+AUDITED_PER_SESSION = 1024
+
+def audit_result(class_index, input_mode, probabilities, latency=None, note=None, digest=None):
+    # Only enqueues; the writer thread commits in batches
+    log = get_audit_log()
+    if log is None:
+        return
+    model_path = get_model_loader().model_path or load_model_and_labels()[0].model_path
+    version = model_version(model_path, LABELS_PATH)
+    if digest is not None:
+        # Every widget interaction (language toggle, Grad-CAM, ...) reruns the script and re-renders the result
+        audited = st.session_state.setdefault("audited", OrderedDict())
+        key = (digest, version, input_mode)
+        if key in audited:
+            audited.move_to_end(key)
+            return
+        audited[key] = None
+        if len(audited) > AUDITED_PER_SESSION:
+            audited.popitem(last=False)
+    log.record(class_index, get_class_names()[class_index], probabilities[class_index], version,
+               st.session_state.lang, input_mode, latency, note)
+
+@st.cache_resource
+def get_mri_gate():
+    # off / shadow / enforce via NEUROSCAN_MRI_GATE
+    return MriGate()
+
+@st.cache_resource
+def get_embedding_index(version):
+    # One memory-mapped index per model version; None when NEUROSCAN_EMBEDDING_INDEX=off
+    return open_index_from_env(version)
+
+@st.cache_resource
+def get_gradcam_service():
+    # Explains the serving Keras model (the registry's active version); keras_model.h5 only when forced on
+    loader = get_model_loader()
+    fallback = []
+    def keras_model():
+        model = serving_keras_model(loader.result()[0])
+        if model is None:
+            if not fallback:
+                fallback.append(pipeline.load_model())
+            model = fallback[0]
+        return model
+    return GradCamService(keras_model)
+
+@st.cache_data
+def get_class_names():
+    return pipeline.read_labels(LABELS_PATH)
+
+def analyze_image(image_bytes, trace):
+    """Return ``(probabilities, note)`` for one image.
+
+    Lookup order: in-memory cache and exact match in the result store (both
+    answered without waiting for the model), then a perceptual-hash match
+    after preprocessing, then the non-MRI gate; the model only runs after all
+    of them. ``note`` is ``("near_duplicate", distance)`` or ``("gate", reason)``
+    when the result did not come from this image's own forward pass.
+    """
+    cache = get_prediction_cache()
+    store = get_result_store()
+    model_path = get_model_loader().model_path
+    if model_path is None:
+        # Proxy backends only know their model file once connected
+        with trace.stage("model_wait"):
+            model_path = load_model_and_labels()[0].model_path
+    with trace.stage("cache_lookup"):
+        digest = data_digest(image_bytes)
+        key = cache_key(digest, model_identity(model_path, LABELS_PATH))
+        cached = cache.get(key)
+    trace.cache_hit = cached is not None
+    if cached is not None:
+        return cached.probabilities, None
+    version = model_version(model_path, LABELS_PATH)
+    if store is not None:
+        with trace.stage("store_lookup"):
+            stored = store.get(digest, version)
+        if stored is not None:
+            return cache.put(key, stored.probabilities).probabilities, None
+    with trace.stage("open"):
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = pipeline.draft_image(image)
+    admission = get_admission()
+    # Decoding and inference are bounded by the resource profile; cached answers above skip the queue
+    with trace.stage("admission"):
+        slot = admission.admit(width * height) if admission is not None else nullcontext()
+    with slot:
+        return run_model(image, trace, key, digest, version)
+
+def run_model(image, trace, key, digest, version):
+    """Preprocess, near-duplicate lookup, gate and inference for one opened image (inside admission)."""
+    cache = get_prediction_cache()
+    store = get_result_store()
+    with trace.stage("preprocess"):
+        data = preprocess_image(image)
+    if store is not None:
+        with trace.stage("store_lookup"):
+            phash = perceptual_hash(data)
+            stored = store.get_near(phash, version)
+        if stored is not None:
+            return cache.put(key, stored.probabilities).probabilities, ("near_duplicate", stored.distance)
+    gate, class_names = get_mri_gate(), get_class_names()
+    decision = None
+    if gate.enabled and not_mri_index(class_names) is not None:
+        with trace.stage("gate"):
+            decision = gate.check(data)
+        if decision.reject and gate.enforcing:
+            return rejection_probabilities(decision, class_names), ("gate", decision.reason)
+    with trace.stage("model_wait"):
+        model, _ = load_model_and_labels()
+    index = get_embedding_index(version) if getattr(model, "supports_embeddings", False) else None
+    with trace.stage("inference"):
+        if index is not None:
+            prediction, embedding = model.predict_with_embeddings(data)
+        else:
+            prediction = model.predict(data)
+    if decision is not None:
+        gate.record_outcome(decision, class_names[int(np.argmax(prediction[0]))])
+    timings = {stage: trace.stages[stage] for stage in ("open", "preprocess", "inference")}
+    if store is not None:
+        store.put(digest, version, phash, prediction[0])
+    if index is not None:
+        index.append(embedding, [digest], [int(np.argmax(prediction[0]))], [float(np.max(prediction[0]))])
+    return cache.put(key, prediction[0], timings).probabilities, None
+
+def render_similar_scans(image_bytes, class_names, msg, k=5):
+    """Nearest earlier scans by penultimate-layer embedding, with their verdicts."""
+    model_path = get_model_loader().model_path
+    index = get_embedding_index(model_version(model_path, LABELS_PATH)) if model_path else None
+    digest = data_digest(image_bytes)
+    vector = index.vector_for(digest) if index is not None else None
+    if vector is None:
+        # Only images that went through an embedding-capable forward pass are in the index
+        return
+    with st.expander(msg["similar_title"]):
+        matches = index.search(vector, k, exclude_digest=digest)
+        if not matches:
+            st.caption(msg["similar_empty"])
+            return
+        st.dataframe([{
+            msg["similar_verdict"]: class_names[m.class_index],
+            msg["similar_similarity"]: f"{m.score * 100:.1f}%",
+            msg["similar_confidence"]: f"{m.confidence * 100:.1f}%",
+            msg["similar_scanned"]: time.strftime("%Y-%m-%d %H:%M", time.localtime(m.time)),
+            msg["similar_id"]: m.digest[:12],
+        } for m in matches], use_container_width=True, hide_index=True)
+
+def render_heatmap(image_bytes, class_index, msg):
+    """Grad-CAM overlay under the result, filled in when the background pass finishes."""
+    service = get_gradcam_service()
+    identity = model_identity(get_model_loader().model_path or pipeline.MODEL_PATH, LABELS_PATH)
+    key = f"{cache_key(data_digest(image_bytes), identity)}:{class_index}"
+    st.subheader(msg["heatmap_title"])
+    slot = st.empty()
+    png = service.cached(key)
+    if png is None:
+        slot.caption(msg["heatmap_pending"])
+        try:
+            png = service.submit(key, image_bytes, class_index).result()
+        except Exception as e:
+            slot.warning(f"{msg['heatmap_failed']}: {e}")
+            return
+    slot.image(png, caption=msg["heatmap_caption"], use_column_width=True)
+
+def results_to_csv(rows):
+    buffer = io.StringIO()
+    if rows:
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    return buffer.getvalue()
+
+def run_batch_analysis(files, msg):
+    # Cached and stored results are listed without waiting for the model
+    model_path = get_model_loader().model_path or load_model_and_labels()[0].model_path
+    class_names = get_class_names()
+    cache = get_prediction_cache()
+    store = get_result_store()
+    identity = model_identity(model_path, LABELS_PATH)
+    version = model_version(model_path, LABELS_PATH)
+
+    def make_row(name, probabilities, status, digest):
+        index = int(np.argmax(probabilities))
+        audit_result(index, "batch", probabilities, note=status, digest=digest)
+        return {
+            msg["batch_col_file"]: name,
+            msg["batch_col_class"]: class_names[index],
+            msg["batch_col_confidence"]: round(float(probabilities[index]) * 100, 2),
+            msg["batch_col_status"]: status,
+        }
+
+    def error_row(name, error):
+        return {
+            msg["batch_col_file"]: name,
+            msg["batch_col_class"]: str(error),
+            msg["batch_col_confidence"]: None,
+            msg["batch_col_status"]: msg["batch_status_error"],
+        }
+
+    start = time.perf_counter()
+    trace = RequestTrace("batch")
+    rows, misses = [], []
+    with trace.stage("cache_lookup"):
+        for uploaded in files:
+            image_bytes = uploaded.getvalue()
+            digest = data_digest(image_bytes)
+            key = cache_key(digest, identity)
+            cached = cache.get(key)
+            if cached is None and store is not None:
+                stored = store.get(digest, version)
+                if stored is not None:
+                    cached = cache.put(key, stored.probabilities)
+            if cached is None:
+                misses.append((uploaded.name, key, image_bytes, digest))
+            else:
+                rows.append(make_row(uploaded.name, cached.probabilities, msg["batch_status_cached"], digest))
+    trace.input_bytes = sum(len(item[2]) for item in misses)
+    trace.cache_hit = not misses
+
+    st.header(msg["batch_results_header"])
+    progress = st.progress(0.0)
+    table = st.empty()
+    table.dataframe(rows, use_container_width=True)
+    done = len(rows)
+    admission = get_admission()
+    buffers = np.empty((2, pipeline.BATCH_SIZE, *pipeline.IMAGE_SIZE[::-1], 3), dtype=np.float32)
+
+    def admitted_batches():
+        # Each batch is admitted for the pixels its decode will touch (after JPEG draft) and holds
+        # its slot through inference; decoding runs in a thread pool, one batch at a time
+        for i in range(0, len(misses), pipeline.BATCH_SIZE):
+            chunk = misses[i:i + pipeline.BATCH_SIZE]
+            with trace.stage("admission"):
+                pixels = sum(pipeline.decoded_pixels(item[2]) for item in chunk)
+                slot = admission.admit(pixels) if admission is not None else nullcontext()
+            with slot:
+                yield from iter_batches(chunk, lambda item, out: preprocess_bytes(item[2], out), prefetch=0, buffers=buffers)
+
+    for ok_items, batch, failed in admitted_batches():
+        if batch is not None:
+            pending = list(range(len(ok_items)))
+            if store is not None:
+                # Near-duplicates of stored images skip the model
+                with trace.stage("store_lookup"):
+                    hashes = [perceptual_hash(image) for image in batch]
+                    pending = []
+                    for i, (name, key, _, digest) in enumerate(ok_items):
+                        stored = store.get_near(hashes[i], version)
+                        if stored is None:
+                            pending.append(i)
+                        else:
+                            cache.put(key, stored.probabilities)
+                            rows.append(make_row(name, stored.probabilities, msg["batch_status_cached"], digest))
+            gate = get_mri_gate()
+            decisions = {}
+            if pending and gate.enabled and not_mri_index(class_names) is not None:
+                with trace.stage("gate"):
+                    decisions = {i: gate.check(batch[i]) for i in pending}
+                if gate.enforcing:
+                    for i in [i for i in pending if decisions[i].reject]:
+                        rows.append(make_row(ok_items[i][0], rejection_probabilities(decisions[i], class_names), msg["batch_status_gated"],
+                                             ok_items[i][3]))
+                    pending = [i for i in pending if not decisions[i].reject]
+            if pending:
+                with trace.stage("model_wait"):
+                    model, _ = load_model_and_labels()
+                batch_start = time.perf_counter()
+                with trace.stage("inference"):
+                    predictions = predict_batch(model, batch[pending] if len(pending) < len(batch) else batch)
+                per_image = (time.perf_counter() - batch_start) / len(pending)
+                for i, probabilities in zip(pending, predictions):
+                    name, key, _, digest = ok_items[i]
+                    if i in decisions:
+                        gate.record_outcome(decisions[i], class_names[int(np.argmax(probabilities))])
+                    cache.put(key, probabilities, {"inference": per_image})
+                    if store is not None:
+                        store.put(digest, version, hashes[i], probabilities)
+                    rows.append(make_row(name, probabilities, msg["batch_status_ok"], digest))
+        for (name, _, _, _), error in failed:
+            rows.append(error_row(name, error))
+        done += len(ok_items) + len(failed)
+        with trace.stage("render"):
+            progress.progress(done / len(files))
+            table.dataframe(rows, use_container_width=True)
+    progress.progress(1.0)
+    trace.finish()
+
+    elapsed = time.perf_counter() - start
+    st.caption(msg["batch_summary"].format(count=len(files), seconds=elapsed, per_image=elapsed * 1000 / len(files)))
+    st.download_button(msg["batch_download"], results_to_csv(rows), file_name="neuroscan_batch_results.csv", mime="text/csv")
+
+def run_volume_analysis(uploaded, msg):
+    model, class_names = load_model_and_labels()
+    trace = RequestTrace("volume", uploaded.size)
+    with tempfile.TemporaryDirectory() as tmp:
+        # The upload is spooled to disk so the voxels can be memory-mapped
+        path = os.path.join(tmp, os.path.basename(uploaded.name))
+        with trace.stage("open"):
+            with open(path, "wb") as f:
+                f.write(uploaded.getbuffer())
+            digest = data_digest(uploaded.getbuffer())
+            if path.endswith(".gz"):
+                compressed, path = path, volume.decompress_to(path, tmp)
+                os.remove(compressed)
+            vol = volume.open_volume(path)
+        admission = get_admission()
+        # Slices are decoded and scored one batch at a time
+        with trace.stage("admission"):
+            pixels = vol.data.shape[0] * vol.data.shape[1] * pipeline.BATCH_SIZE
+            slot = admission.admit(pixels) if admission is not None else nullcontext()
+        progress = st.progress(0.0)
+        with slot, trace.stage("inference"):
+            result = volume.score_volume(vol, model, class_names, progress=lambda done, total: progress.progress(done / total))
+        latency = trace.finish()
+
+        st.header(msg["volume_results_header"])
+        if result.class_index is None:
+            st.warning(msg["invalid_image_details"])
+            return
+        audit_result(result.class_index, "volume", result.volume_probabilities, latency, digest=digest)
+        st.markdown(msg["volume_verdict"].format(class_name=class_names[result.class_index],
+                                                 confidence=result.volume_probabilities[result.class_index] * 100))
+        scored = len(result.slice_indices)
+        st.caption(msg["volume_summary"].format(scored=scored, total=result.total_slices, seconds=result.seconds,
+                                                rate=scored / result.seconds if result.seconds else 0, skipped=len(result.skipped)))
+        if result.failed:
+            st.warning(msg["volume_failed"].format(count=len(result.failed), index=result.failed[0][0], error=result.failed[0][1]))
+        tumor = next((i for i, name in enumerate(class_names) if volume.TUMOR_LABEL in name), None)
+        if tumor is not None:
+            st.subheader(msg["volume_chart"])
+            st.line_chart({msg["volume_chart"]: dict(zip(result.slice_indices, result.slice_probabilities[:, tumor].tolist()))})
+        if result.top_slices:
+            st.subheader(msg["volume_top_slices"])
+            window = volume.auto_window(vol)
+            for column, (index, probability) in zip(st.columns(len(result.top_slices)), result.top_slices):
+                column.image(volume.slice_image(vol, index, window), use_column_width=True,
+                             caption=msg["volume_slice_caption"].format(index=index, probability=probability * 100))
+        del vol
+
+def run_live_screening(source, msg):
+    """Score a server-side camera or video continuously until toggled off or the source ends."""
+    st.caption(msg["live_source"].format(source=source))
+    if not st.toggle(msg["live_toggle"], key="live_running"):
+        return
+    model, class_names = load_model_and_labels()
+    frame_slot, verdict_slot, status_slot = st.empty(), st.empty(), st.empty()
+    # Turning the toggle off reruns the script, which unwinds this loop through the with block
+    with LiveScreener(model, open_source(source)) as screener:
+        for result in screener.results():
+            frame_slot.image(result.frame, use_column_width=True)
+            verdict_slot.markdown(f"**{class_names[result.class_index]}** ({result.probabilities[result.class_index] * 100:.1f}%)")
+            if result.cut:
+                # One audit record per new view, not per frame
+                audit_result(result.class_index, "live", result.probabilities, result.lag)
+            stats = screener.stats()
+            status_slot.caption(msg["live_status"].format(
+                frame=result.frame_number, processed=stats["processed"], unchanged=stats["skipped_unchanged"],
+                dropped=stats["dropped_stale"], fps=stats["processed_fps"], lag=result.lag * 1000))
+    st.info(msg["live_ended"])
 
 def main():
     if 'lang' not in st.session_state: st.session_state.lang = 'en'
@@ -116,6 +592,8 @@ def main():
 
     lang = st.session_state.lang
     msg = MESSAGES[lang]
+    loader = get_model_loader()
+    start_metrics_exporters()
     st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
     with st.sidebar:
@@ -126,8 +604,12 @@ def main():
             st.session_state.lang = new_lang
             st.rerun()
 
-        input_mode = st.radio(msg["input_mode_label"], [msg["mode_upload"], msg["mode_camera"]])
-        st.session_state.input_mode_key = 'upload' if input_mode == msg["mode_upload"] else 'camera'
+        input_modes = {msg["mode_upload"]: 'upload', msg["mode_camera"]: 'camera', msg["mode_batch"]: 'batch', msg["mode_volume"]: 'volume'}
+        if os.environ.get(LIVE_SOURCE_ENV):
+            # Only for kiosk deployments with a camera or recording attached to the server
+            input_modes[msg["mode_live"]] = 'live'
+        input_mode = st.radio(msg["input_mode_label"], list(input_modes))
+        st.session_state.input_mode_key = input_modes[input_mode]
 
         st.markdown("---")
         st.subheader(msg["how_to_use_title"])
@@ -139,6 +621,12 @@ def main():
         st.subheader(msg["references_title"])
         st.warning(msg["references_text"])
 
+        with st.expander(msg["startup_title"]):
+            if loader.ready:
+                st.caption(" | ".join(f"{phase}: {seconds:.2f}s" for phase, seconds in loader.timings.items()))
+            else:
+                st.caption(msg["model_loading"])
+
         # --- Developers Section with Supervision ---
         st.markdown("---")
         st.subheader(msg["developers_title"])
@@ -185,64 +673,138 @@ def main():
     if lang == 'ar': st.markdown('<div class="rtl-text">', unsafe_allow_html=True)
 
     uploaded_file = None
-    if st.session_state.input_mode_key == 'upload':
-        uploaded_file = st.file_uploader(msg["upload_help"], type=["jpg", "png", "jpeg"])
+    if st.session_state.input_mode_key == 'batch':
+        batch_files = st.file_uploader(msg["batch_upload_help"], type=["jpg", "png", "jpeg"], accept_multiple_files=True, key="batch_input")
+        if batch_files:
+            with st.spinner(msg["processing"]):
+                try:
+                    run_batch_analysis(batch_files, msg)
+                except Overloaded:
+                    st.warning(msg["overloaded"])
+                except Exception as e:
+                    st.error(f"Error during analysis: {e}")
+    elif st.session_state.input_mode_key == 'volume':
+        volume_file = st.file_uploader(msg["volume_upload_help"], type=["nii", "gz"], key="volume_input")
+        if volume_file:
+            with st.spinner(msg["processing"]):
+                try:
+                    run_volume_analysis(volume_file, msg)
+                except Overloaded:
+                    st.warning(msg["overloaded"])
+                except Exception as e:
+                    st.error(f"Error during analysis: {e}")
+    elif st.session_state.input_mode_key == 'live':
+        try:
+            run_live_screening(os.environ[LIVE_SOURCE_ENV], msg)
+        except Exception as e:
+            st.error(f"Error during analysis: {e}")
+    elif st.session_state.input_mode_key == 'upload':
+        uploaded_file = st.file_uploader(msg["upload_help"], type=["jpg", "png", "jpeg"], key="upload_input")
     else:
-        uploaded_file = st.camera_input(msg["camera_button"])
+        uploaded_file = st.camera_input(msg["camera_button"], key="camera_input")
 
     if uploaded_file:
-        image = Image.open(uploaded_file)
-        st.image(image, use_column_width=True)
+        image_bytes = uploaded_file.getvalue()
+        trace = RequestTrace(st.session_state.input_mode_key, len(image_bytes))
+        with trace.stage("render"):
+            st.image(image_bytes, use_column_width=True)
 
+        result_class = audited = None
         with st.spinner(msg["processing"]):
             try:
-                model, class_names = load_model_and_labels()
-                data = preprocess_image(image)
-                prediction = model.predict(data)
+                # Reruns (e.g. language toggle) and repeat uploads are served from the caches
+                prediction, note = analyze_image(image_bytes, trace)
+                class_names = get_class_names()
                 index = np.argmax(prediction)
                 class_name = class_names[index]
-                confidence = prediction[0][index]
+                confidence = prediction[index]
+                audited = (int(index), prediction, note[0] if note else None, data_digest(image_bytes))
 
-                st.header(msg["result_header"])
+                with trace.stage("render"):
+                    st.header(msg["result_header"])
+                    if note and note[0] == "near_duplicate":
+                        st.caption(msg["near_duplicate_note"].format(distance=note[1]))
+                    elif note and note[0] == "gate":
+                        st.caption(msg["gate_rejected_note"].format(reason=note[1]))
 
-                # --- 3 Classes Classification Logic ---
+                    # --- 3 Classes Classification Logic ---
                 
-                # Case 1: Tumor Detected
-                if "Yes Have a Tumor in Brain Scan" in class_name:
-                    st.markdown(f'<h3 style="color: #dc3545;">{msg["result_yes_title"]}</h3>', unsafe_allow_html=True)
-                    st.write(msg["result_yes_text"])
-                    st.write(f"**Confidence Score:** {confidence*100:.2f}%")
+                    # Case 1: Tumor Detected
+                    if "Yes Have a Tumor in Brain Scan" in class_name:
+                        st.markdown(f'<h3 style="color: #dc3545;">{msg["result_yes_title"]}</h3>', unsafe_allow_html=True)
+                        st.write(msg["result_yes_text"])
+                        st.write(f"**Confidence Score:** {confidence*100:.2f}%")
                 
-                # Case 2: No Tumor Detected
-                elif "No Tumor in Brain Scan" in class_name:
-                    st.markdown(f'<h3 style="color: #28a745;">{msg["result_no_title"]}</h3>', unsafe_allow_html=True)
-                    st.write(msg["result_no_text"])
-                    st.write(f"**Confidence Score:** {confidence*100:.2f}%")
+                    # Case 2: No Tumor Detected
+                    elif "No Tumor in Brain Scan" in class_name:
+                        st.markdown(f'<h3 style="color: #28a745;">{msg["result_no_title"]}</h3>', unsafe_allow_html=True)
+                        st.write(msg["result_no_text"])
+                        st.write(f"**Confidence Score:** {confidence*100:.2f}%")
                 
-                # Case 3: Not MRI Scan - Warning Message
-                elif "Not MRI Scan" in class_name:
-                    st.markdown(f'<h3 style="color: #ff9800;">{msg["invalid_image_msg"]}</h3>', unsafe_allow_html=True)
-                    st.warning(msg["invalid_image_details"])
-                    st.info(f"**Detected Class:** {class_name} | **Confidence:** {confidence*100:.2f}%")
-                    st.markdown("""
-                    **Please note:**
-                    - ✅ Upload a clear **MRI Brain Scan** image
-                    - ✅ Ensure good image quality and resolution
-                    - ✅ The image should show brain tissue clearly
-                    - ❌ Do not upload photos of people, landscapes, or other random images
-                    """)
+                    # Case 3: Not MRI Scan - Warning Message
+                    elif "Not MRI Scan" in class_name:
+                        st.markdown(f'<h3 style="color: #ff9800;">{msg["invalid_image_msg"]}</h3>', unsafe_allow_html=True)
+                        st.warning(msg["invalid_image_details"])
+                        st.info(f"**Detected Class:** {class_name} | **Confidence:** {confidence*100:.2f}%")
+                        st.markdown("""
+                        **Please note:**
+                        - ✅ Upload a clear **MRI Brain Scan** image
+                        - ✅ Ensure good image quality and resolution
+                        - ✅ The image should show brain tissue clearly
+                        - ❌ Do not upload photos of people, landscapes, or other random images
+                        """)
                 
-                # Case 4: Unexpected classification (safety fallback)
-                else:
-                    st.error(msg["invalid_image_msg"])
-                    st.warning(msg["invalid_image_details"])
-                    st.info(f"**Detected Class:** {class_name} | **Confidence:** {confidence*100:.2f}%")
-                # ----------------------------------------
+                    # Case 4: Unexpected classification (safety fallback)
+                    else:
+                        st.error(msg["invalid_image_msg"])
+                        st.warning(msg["invalid_image_details"])
+                        st.info(f"**Detected Class:** {class_name} | **Confidence:** {confidence*100:.2f}%")
+                    # ----------------------------------------
 
+                if not (note and note[0] == "gate") and index != not_mri_index(class_names):
+                    result_class = int(index)
+            except Overloaded:
+                st.warning(msg["overloaded"])
             except Exception as e:
                 st.error(f"Error during analysis: {e}")
+            finally:
+                latency = trace.finish()
+                if audited is not None:
+                    audit_result(audited[0], st.session_state.input_mode_key, audited[1], latency, audited[2], audited[3])
+
+        # Outside the spinner and the request trace: the result above is already on screen
+        if result_class is not None:
+            render_similar_scans(image_bytes, get_class_names(), msg)
+            if gradcam_enabled(load_model_and_labels()[0]):
+                render_heatmap(image_bytes, result_class, msg)
 
     if lang == 'ar': st.markdown('</div>', unsafe_allow_html=True)
+
+    if debug_panel_enabled():
+        with st.sidebar.expander(msg["debug_title"], expanded=True):
+            st.caption(f"RSS: {metrics.process_rss_bytes() / 1e6:.0f} MB")
+            st.caption(f"MRI gate: {get_mri_gate().mode}")
+            registry = getattr(loader.result()[0], "registry", None) if loader.ready else None
+            if registry is not None:
+                shadow = registry.shadow.version_id if registry.shadow else "none"
+                st.caption(f"Model version: {registry.active.version_id} | shadow: {shadow}")
+                st.json({**loader.result()[0].shadow_stats.summary(), "dropped": loader.result()[0].shadow_dropped})
+            store = get_result_store()
+            if store is not None:
+                stats = store.stats()
+                st.caption(f"Result store: {stats['entries']} entries, hit rate {stats['hit_rate']:.0%} "
+                           f"({stats['exact_hits']} exact, {stats['near_hits']} near, {stats['misses']} misses)")
+            admission = get_admission()
+            if admission is not None:
+                stats = admission.stats()
+                st.caption(f"Profile: {stats['profile']} | in flight {stats['in_flight']}, waiting {stats['waiting']}, "
+                           f"shed {stats['shed']} | RSS limits {stats['soft_limit_mb']}/{stats['hard_limit_mb']} MB")
+            audit = get_audit_log()
+            if audit is not None:
+                stats = audit.stats()
+                st.caption(f"Audit log: {stats['written']} written, {stats['pending']} pending, {stats['dropped']} dropped")
+            st.dataframe(metrics.recent_requests()[::-1], use_container_width=True)
+
     st.markdown(f'<div class="footer">{msg["developer_credit"]}</div>', unsafe_allow_html=True)
 
 if __name__ == "__main__":
@@ -0,0 +1,273 @@
+"""Append-only audit log of rendered predictions with background bulk writes.
+
+``record()`` only puts a tuple on an in-memory queue, so the request path
+never waits for disk. A writer thread drains the queue in batches (up to
+``batch_size`` records, or whatever arrived within ``flush_interval``) and
+commits each batch as one transaction into a SQLite WAL file with
+``synchronous=FULL``, so one fsync covers the whole batch and a committed
+record survives a process crash or power loss. ``flush()`` blocks until
+everything recorded before it is written, and returns True only if all of
+it was committed; that is the acknowledgement.
+Records still queued when the process is killed are lost, and a full queue
+drops new records (counted) rather than blocking a request. UPDATE and
+DELETE on the table are rejected by triggers.
+
+Aggregates read only a covering index on ``(time, class, confidence,
+latency)``, so time-range queries do not touch the table rows:
+
+    python audit_log.py summary [--since-hours 24] [--bucket hour] [--path audit.sqlite3]
+
+    NEUROSCAN_AUDIT_LOG=path.sqlite3   log location ("off" disables it)
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from metrics import Counter, Histogram, REGISTRY
+
+AUDIT_LOG_ENV = "NEUROSCAN_AUDIT_LOG"
+DEFAULT_AUDIT_PATH = "audit.sqlite3"
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_FLUSH_INTERVAL = 0.25
+DEFAULT_MAX_QUEUE = 10_000
+BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+COLUMNS = ("time", "class_index", "class_name", "confidence", "model", "language", "input_mode", "latency_ms", "note")
+
+AUDIT_RECORDS = REGISTRY.register(Counter("neuroscan_audit_records_total", "Audit log records by outcome.", ("outcome",)))
+AUDIT_COMMIT = REGISTRY.register(Histogram("neuroscan_audit_commit_seconds", "Audit log batch commit time.",
+                                           buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5)))
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS audit ("
+    " id INTEGER PRIMARY KEY, time REAL NOT NULL, class_index INTEGER NOT NULL, class_name TEXT NOT NULL,"
+    " confidence REAL NOT NULL, model TEXT, language TEXT, input_mode TEXT, latency_ms REAL, note TEXT)",
+    "CREATE INDEX IF NOT EXISTS audit_time ON audit (time, class_index, confidence, latency_ms)",
+    "CREATE TRIGGER IF NOT EXISTS audit_no_update BEFORE UPDATE ON audit"
+    " BEGIN SELECT RAISE(ABORT, 'audit log is append-only'); END",
+    "CREATE TRIGGER IF NOT EXISTS audit_no_delete BEFORE DELETE ON audit"
+    " BEGIN SELECT RAISE(ABORT, 'audit log is append-only'); END",
+)
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+class AuditLog:
+    """Non-blocking writer plus read-side aggregates; one instance per process."""
+
+    def __init__(self, path=None, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_queue=DEFAULT_MAX_QUEUE):
+        self.path = path or os.environ.get(AUDIT_LOG_ENV) or DEFAULT_AUDIT_PATH
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._writer_conn = _connect(self.path)
+        # Readers get their own connection so queries never wait behind a commit
+        self._reader_conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue(max_queue)
+        self._committed = threading.Condition()
+        self._enqueued = self._written = 0
+        # (first, last) sequence numbers of batches whose commit failed
+        self._failed = []
+        self._sequence_lock = threading.Lock()
+        self.dropped = 0
+        self.batches = 0
+        self.error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._write_loop, name="audit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, class_index, class_name, confidence, model=None, language=None, input_mode=None,
+               latency=None, note=None, timestamp=None):
+        """Queue one rendered result; returns its sequence number, or None if it was dropped."""
+        row = (time.time() if timestamp is None else timestamp, int(class_index), class_name, float(confidence),
+               model, language, input_mode, None if latency is None else latency * 1000, note)
+        with self._sequence_lock:
+            if self._closed:
+                return None
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                self.dropped += 1
+                AUDIT_RECORDS.inc(outcome="dropped")
+                return None
+            self._enqueued += 1
+            sequence = self._enqueued
+        AUDIT_RECORDS.inc(outcome="queued")
+        return sequence
+
+    def _next_batch(self):
+        try:
+            rows = [self._queue.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(rows) < self.batch_size and rows[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                rows.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_loop(self):
+        while True:
+            rows = self._next_batch()
+            stop = bool(rows) and rows[-1] is None
+            rows = [row for row in rows if row is not None]
+            if rows:
+                start = time.perf_counter()
+                failed = False
+                try:
+                    with self._writer_conn:
+                        self._writer_conn.execute("BEGIN")
+                        self._writer_conn.executemany(f"INSERT INTO audit ({', '.join(COLUMNS)}) "
+                                                      f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+                except sqlite3.Error as e:
+                    # Keep draining so flush() callers are released; they see the failure in its return value
+                    self.error = e
+                    failed = True
+                    AUDIT_RECORDS.inc(len(rows), outcome="failed")
+                    print(f"audit log write failed: {e}", file=sys.stderr)
+                else:
+                    AUDIT_RECORDS.inc(len(rows), outcome="written")
+                AUDIT_COMMIT.observe(time.perf_counter() - start)
+                with self._committed:
+                    if failed:
+                        self._failed.append((self._written + 1, self._written + len(rows)))
+                    self._written += len(rows)
+                    self.batches += 1
+                    self._committed.notify_all()
+            if stop:
+                return
+
+    def flush(self, timeout=None, since=0):
+        """Wait until every record queued so far is written; False on timeout or if any after ``since`` failed.
+
+        ``since`` is a sequence number from ``record()``; only records after it are checked.
+        """
+        with self._sequence_lock:
+            target = self._enqueued
+        with self._committed:
+            if not self._committed.wait_for(lambda: self._written >= target, timeout):
+                return False
+            return not any(last > since and first <= target for first, last in self._failed)
+
+    def close(self):
+        with self._sequence_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._writer_conn.close()
+        with self._read_lock:
+            self._reader_conn.close()
+
+    def _query(self, sql, params):
+        with self._read_lock:
+            return self._reader_conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _range(since, until):
+        return since if since is not None else 0.0, until if until is not None else float("inf")
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM audit", ())[0][0]
+
+    def class_distribution(self, bucket="hour", since=None, until=None):
+        """``{bucket_start: {class_index: count}}`` with buckets in seconds or minute/hour/day (UTC)."""
+        seconds = BUCKETS.get(bucket, bucket)
+        rows = self._query("SELECT CAST(time / ? AS INTEGER) AS b, class_index, COUNT(*) FROM audit"
+                           " WHERE time >= ? AND time < ? GROUP BY b, class_index ORDER BY b",
+                           (seconds, *self._range(since, until)))
+        distribution = {}
+        for b, class_index, count in rows:
+            distribution.setdefault(b * seconds, {})[class_index] = count
+        return distribution
+
+    def confidence_histogram(self, bins=10, since=None, until=None, class_index=None):
+        """Counts of confidence in ``bins`` equal-width bins over [0, 1]."""
+        sql = ("SELECT MIN(CAST(confidence * ? AS INTEGER), ? - 1) AS b, COUNT(*) FROM audit"
+               " WHERE time >= ? AND time < ?")
+        params = [bins, bins, *self._range(since, until)]
+        if class_index is not None:
+            sql += " AND class_index = ?"
+            params.append(class_index)
+        counts = np.zeros(bins, dtype=np.int64)
+        for b, count in self._query(sql + " GROUP BY b", params):
+            counts[max(b, 0)] += count
+        return counts
+
+    def latency_percentiles(self, percentiles=(50, 95, 99), since=None, until=None):
+        """Request latency percentiles in milliseconds, or None when nothing is recorded."""
+        rows = self._query("SELECT latency_ms FROM audit WHERE time >= ? AND time < ? AND latency_ms IS NOT NULL",
+                           self._range(since, until))
+        if not rows:
+            return None
+        latencies = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+        return {f"p{p:g}": round(float(value), 2) for p, value in zip(percentiles, np.percentile(latencies, percentiles))}
+
+    def stats(self):
+        with self._committed:
+            written, batches = self._written, self.batches
+            failed = sum(last - first + 1 for first, last in self._failed)
+        return {"queued": self._enqueued, "written": written - failed, "failed": failed, "pending": self._enqueued - written,
+                "dropped": self.dropped, "batches": batches, "error": str(self.error) if self.error else None}
+
+
+def open_audit_log_from_env():
+    """The configured log, or None when ``NEUROSCAN_AUDIT_LOG=off``."""
+    if os.environ.get(AUDIT_LOG_ENV, "").lower() in ("off", "0", "false"):
+        return None
+    try:
+        return AuditLog()
+    except (sqlite3.Error, OSError) as e:
+        print(f"audit log disabled: {e}", file=sys.stderr)
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="Class distribution, confidence histogram and latency percentiles")
+    summary.add_argument("--path", default=os.environ.get(AUDIT_LOG_ENV) or DEFAULT_AUDIT_PATH)
+    summary.add_argument("--since-hours", type=float, default=24.0)
+    summary.add_argument("--bucket", default="hour", help="minute, hour, day or a number of seconds")
+    summary.add_argument("--bins", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        raise SystemExit(f"No audit log at {args.path}")
+    log = AuditLog(args.path)
+    bucket = args.bucket if args.bucket in BUCKETS else float(args.bucket)
+    since = time.time() - args.since_hours * 3600
+    report = {
+        "records": len(log),
+        "class_distribution": {time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start)): counts
+                               for start, counts in log.class_distribution(bucket, since).items()},
+        "confidence_histogram": log.confidence_histogram(args.bins, since).tolist(),
+        "latency_ms": log.latency_percentiles(since=since),
+    }
+    log.close()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
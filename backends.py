@@ -0,0 +1,193 @@
+"""Pluggable inference backends.
+
+Every backend exposes ``predict(batch) -> np.ndarray`` on a float32
+``(n, 224, 224, 3)`` batch, plus ``name`` and ``model_path``. Only the
+selected backend's runtime is imported, so the TFLite and ONNX backends can
+serve without TensorFlow installed. Pick one with ``NEUROSCAN_BACKEND``
+(keras, tflite, onnx, server for the local inference server, pool for the
+multi-process worker pool, registry for model_registry.py, or cascade for
+the distilled student in front of the full model, see distill.py) and
+optionally ``NEUROSCAN_MODEL_PATH``, or pick a quantized TFLite variant
+built by quantize_model.py with ``NEUROSCAN_MODEL_VARIANT`` (float16,
+int8).
+"""
+import os
+import threading
+
+import numpy as np
+
+import pipeline
+
+BACKEND_ENV = "NEUROSCAN_BACKEND"
+MODEL_PATH_ENV = "NEUROSCAN_MODEL_PATH"
+VARIANT_ENV = "NEUROSCAN_MODEL_VARIANT"
+MODEL_VARIANTS = ("float16", "int8")
+DEFAULT_BACKEND = "keras"
+CONVERTED_MODEL_DIR = "models"
+
+
+def converted_model_path(fmt, model_path=pipeline.MODEL_PATH, out_dir=CONVERTED_MODEL_DIR, suffix=""):
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(out_dir, f"{stem}{suffix}.{fmt}")
+
+
+class KerasBackend:
+    name = "keras"
+
+    @staticmethod
+    def import_runtime():
+        import tensorflow
+        return tensorflow
+
+    def __init__(self, model_path=pipeline.MODEL_PATH, jit_compile=None):
+        from inference_engine import CompiledEngine
+        self.model_path = model_path
+        self.model = pipeline.load_model(model_path)
+        self.engine = CompiledEngine(self.model, jit_compile=jit_compile)
+        self.supports_embeddings = self.engine.embeddings
+
+    def predict(self, batch):
+        return self.engine.predict(batch)
+
+    def predict_with_embeddings(self, batch):
+        return self.engine.predict_with_embeddings(batch)
+
+
+def _tflite_interpreter_class():
+    # Prefer the standalone runtimes; full TensorFlow is only a last resort
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLiteBackend:
+    name = "tflite"
+
+    @staticmethod
+    def import_runtime():
+        return _tflite_interpreter_class()
+
+    def __init__(self, model_path=None, num_threads=None):
+        self.model_path = model_path or converted_model_path("tflite")
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"{self.model_path} not found; build it with convert_model.py or quantize_model.py")
+        self.interpreter = _tflite_interpreter_class()(model_path=self.model_path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+        # A TFLite interpreter must not be invoked from two threads at once
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        self.interpreter.resize_tensor_input(self._input["index"], [batch_size, *self._input["shape"][1:]])
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(batch):
+                self._resize(len(batch))
+            dtype = self._input["dtype"]
+            if dtype != np.float32:
+                scale, zero_point = self._input["quantization"]
+                info = np.iinfo(dtype)
+                batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+            if output.dtype != np.float32:
+                scale, zero_point = self._output["quantization"]
+                return (output.astype(np.float32) - zero_point) * scale
+            return output.copy()
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    @staticmethod
+    def import_runtime():
+        import onnxruntime
+        return onnxruntime
+
+    def __init__(self, model_path=None, num_threads=None):
+        import onnxruntime
+        self.model_path = model_path or converted_model_path("onnx")
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"{self.model_path} not found; run convert_model.py first")
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+}
+# Backends whose modules import this one are resolved lazily
+LAZY_BACKENDS = {
+    "server": ("inference_client", "ServerBackend"),
+    "pool": ("worker_pool", "PoolBackend"),
+    "registry": ("model_registry", "RegistryBackend"),
+    "cascade": ("distill", "CascadeBackend"),
+}
+
+
+def backend_class(name):
+    if name in BACKENDS:
+        return BACKENDS[name]
+    if name in LAZY_BACKENDS:
+        import importlib
+        module, attr = LAZY_BACKENDS[name]
+        return getattr(importlib.import_module(module), attr)
+    raise ValueError(f"Unknown backend {name!r}; expected one of {', '.join([*BACKENDS, *LAZY_BACKENDS])}")
+
+
+def resolve_backend_name(name=None, variant=None):
+    variant = variant or os.environ.get(VARIANT_ENV)
+    # Quantized variants only exist as TFLite files
+    default = "tflite" if variant else DEFAULT_BACKEND
+    return (name or os.environ.get(BACKEND_ENV) or default).lower()
+
+
+def expected_model_path(name=None, variant=None):
+    """Model file create_backend would load, without loading it; None for proxy backends."""
+    variant = variant or os.environ.get(VARIANT_ENV)
+    name = resolve_backend_name(name, variant)
+    if name in LAZY_BACKENDS:
+        return None
+    if variant:
+        return converted_model_path("tflite", suffix=f"_{variant}")
+    return os.environ.get(MODEL_PATH_ENV) or (pipeline.MODEL_PATH if name == "keras" else converted_model_path(name))
+
+
+def create_backend(name=None, model_path=None, variant=None, **kwargs):
+    variant = variant or os.environ.get(VARIANT_ENV)
+    name = resolve_backend_name(name, variant)
+    cls = backend_class(name)
+    # Proxy backends leave variant selection to the processes that run the model
+    if variant and name not in LAZY_BACKENDS:
+        if variant not in MODEL_VARIANTS or name != "tflite":
+            raise ValueError(f"Model variant {variant!r} needs the tflite backend and one of {', '.join(MODEL_VARIANTS)}")
+        model_path = model_path or converted_model_path("tflite", suffix=f"_{variant}")
+    model_path = model_path or os.environ.get(MODEL_PATH_ENV)
+    if model_path:
+        kwargs["model_path"] = model_path
+    return cls(**kwargs)
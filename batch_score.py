@@ -0,0 +1,176 @@
+"""Headless batch scorer: walk a directory of scans and write one JSON line per image.
+
+Usage:
+    python batch_score.py SCANS_DIR -o results.jsonl [--resume]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+import pipeline
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def iter_image_paths(root, extensions=IMAGE_EXTENSIONS):
+    """Lazily yield image paths under ``root`` in a stable (sorted) order."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"warning: cannot read {directory}: {e}", file=sys.stderr)
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.lower().endswith(extensions):
+                yield entry.path
+        stack.extend(reversed(subdirs))
+
+
+def path_digest(path):
+    # 8-byte digests keep the resume set small even for millions of paths
+    return int.from_bytes(hashlib.blake2b(path.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def load_done_paths(output_path):
+    """Return digests of paths already recorded in ``output_path``.
+
+    A partially written last line (e.g. after a crash) is truncated away so
+    appending resumes on a clean line boundary. Complete lines that are
+    blank or unreadable are skipped and kept; their images are scored again.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    good_offset = 0
+    skipped = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Only the last line can lack its newline
+                break
+            good_offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                done.add(path_digest(json.loads(line)["path"]))
+            except (ValueError, KeyError, TypeError):
+                skipped += 1
+    if skipped:
+        print(f"{output_path}: skipped {skipped} unreadable lines", file=sys.stderr)
+    if good_offset != os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(good_offset)
+    return done
+
+
+def decode_path(path, out=None):
+    with Image.open(path) as image:
+        if out is None:
+            return pipeline.preprocess_image(image)[0]
+        return pipeline.preprocess_image(image, out)
+
+
+def result_record(path, probabilities, class_names):
+    index = int(np.argmax(probabilities))
+    return {
+        "path": path,
+        "class": class_names[index],
+        "confidence": round(float(probabilities[index]), 6),
+        "probabilities": {name: round(float(p), 6) for name, p in zip(class_names, probabilities)},
+    }
+
+
+def write_chunk(out, ok_paths, probabilities, errors, class_names):
+    for path, p in zip(ok_paths, probabilities):
+        out.write(json.dumps(result_record(path, p, class_names)) + "\n")
+    for path, error in errors:
+        out.write(json.dumps({"path": path, "error": f"{type(error).__name__}: {error}"}) + "\n")
+    # Flush per batch so a crash loses at most the batches in flight
+    out.flush()
+
+
+def score(paths, model, class_names, out, batch_size=pipeline.BATCH_SIZE, workers=pipeline.DECODE_WORKERS, prefetch=pipeline.PREFETCH_BATCHES):
+    pool = getattr(model, "pool", None)
+    if pool is not None and pool.num_slots >= prefetch + 3:
+        return score_pool(paths, pool, class_names, out, min(batch_size, pool.slot_size), workers, prefetch)
+    scored = failed = 0
+    for ok_paths, batch, errors in pipeline.iter_batches(paths, decode_path, batch_size, workers, prefetch):
+        probabilities = pipeline.predict_batch(model, batch, batch_size) if batch is not None else ()
+        write_chunk(out, ok_paths, probabilities, errors, class_names)
+        scored += len(ok_paths)
+        failed += len(errors)
+    return scored, failed
+
+
+def score_pool(paths, pool, class_names, out, batch_size, workers, prefetch):
+    """Like ``score``, but images are decoded straight into the worker pool's shared-memory slots.
+
+    The decode ring is a set of reserved slots, so no batch is ever copied;
+    up to one batch per worker is in flight while the next ones decode.
+    """
+    in_flight = min(pool.num_workers, pool.num_slots - prefetch - 2)
+    pending = deque()
+    scored = failed = 0
+
+    def drain(keep):
+        while len(pending) > keep:
+            ok_paths, future, errors = pending.popleft()
+            write_chunk(out, ok_paths, pool.result(future) if future is not None else (), errors, class_names)
+
+    with pool.reserve(prefetch + 2 + in_flight) as slots:
+        buffers = [slot.array[:batch_size] for slot in slots]
+        chunks = pipeline.iter_batches(paths, decode_path, batch_size, workers, prefetch, buffers)
+        for i, (ok_paths, batch, errors) in enumerate(chunks):
+            future = slots[i % len(slots)].submit(len(batch)) if batch is not None else None
+            pending.append((ok_paths, future, errors))
+            scored += len(ok_paths)
+            failed += len(errors)
+            # A slot is decoded into again in_flight + 1 chunks later, so its result must be in by then
+            drain(in_flight)
+        drain(0)
+    return scored, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input_dir", help="Directory tree of images to score")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to write results to")
+    parser.add_argument("--resume", action="store_true", help="Skip images already present in the output file")
+    parser.add_argument("--backend", help="Inference backend (keras, tflite, onnx, server, pool); defaults to $NEUROSCAN_BACKEND or keras")
+    parser.add_argument("--model", help="Model file for the chosen backend")
+    parser.add_argument("--labels", default=pipeline.LABELS_PATH)
+    parser.add_argument("--batch-size", type=int, default=pipeline.BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=pipeline.DECODE_WORKERS, help="Decode threads")
+    parser.add_argument("--prefetch", type=int, default=pipeline.PREFETCH_BATCHES, help="Batches decoded ahead of inference")
+    args = parser.parse_args(argv)
+
+    done = load_done_paths(args.output) if args.resume else set()
+    paths = iter_image_paths(args.input_dir)
+    if done:
+        paths = (p for p in paths if path_digest(p) not in done)
+
+    model, class_names = pipeline.load_model_and_labels(args.model, args.labels, args.backend)
+    start = time.perf_counter()
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as out:
+        scored, failed = score(paths, model, class_names, out, args.batch_size, args.workers, args.prefetch)
+    elapsed = time.perf_counter() - start
+    rate = scored / elapsed if elapsed else 0.0
+    print(f"scored {scored} images ({failed} failed, {len(done)} skipped) in {elapsed:.1f}s, {rate:.1f} images/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
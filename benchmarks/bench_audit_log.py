@@ -0,0 +1,99 @@
+"""Request-path cost of the audit log, and aggregate query time as it grows.
+
+Times, per record:
+  enqueue      - audit_log.AuditLog.record with the background writer running
+  synchronous  - one INSERT + durable commit per record on the same schema,
+                 what writing inline from the request would cost
+Then reports writer throughput, the wait for a flush acknowledgement, and
+class-distribution / confidence-histogram / latency-percentile query times
+over the last 24 hours of a log pre-filled with ``--rows`` records spread
+over a month.
+
+Usage:
+    python benchmarks/bench_audit_log.py [--records 20000] [--rows 1000000] [--json audit.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import summarize, time_calls
+
+DAY = 86400
+
+
+def synthetic_rows(count, rng, now):
+    classes = rng.choice(3, size=count, p=[0.3, 0.5, 0.2])
+    times = np.sort(now - rng.uniform(0, 30 * DAY, count))
+    confidence = rng.beta(8, 1.5, count)
+    latency = rng.lognormal(np.log(120), 0.5, count)
+    return zip(times.tolist(), classes.tolist(), confidence.tolist(), (latency / 1000).tolist())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20_000, help="Records timed on the request path")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Pre-filled rows for the query timings")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    import audit_log
+    rng = np.random.default_rng(0)
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        log = audit_log.AuditLog(os.path.join(tmp, "audit.sqlite3"))
+        samples = []
+        start = time.perf_counter()
+        for i in range(args.records):
+            begin = time.perf_counter()
+            log.record(i % 3, "class", 0.9, "0123456789abcdef", "en", "upload", 0.12)
+            samples.append(time.perf_counter() - begin)
+        begin = time.perf_counter()
+        log.flush()
+        report["flush_wait_ms"] = round((time.perf_counter() - begin) * 1000, 2)
+        report["writer_records_per_second"] = round(args.records / (time.perf_counter() - start))
+        report["enqueue"] = summarize(samples)
+        report["writer"] = log.stats()
+        log.close()
+
+        conn = audit_log._connect(os.path.join(tmp, "sync.sqlite3"))
+        insert = f"INSERT INTO audit ({', '.join(audit_log.COLUMNS)}) VALUES ({', '.join('?' * len(audit_log.COLUMNS))})"
+        row = (time.time(), 0, "class", 0.9, "0123456789abcdef", "en", "upload", 120.0, None)
+        report["synchronous"] = summarize(time_calls(lambda: conn.execute(insert, row), min(args.records, 2000)))
+        conn.close()
+
+        path = os.path.join(tmp, "filled.sqlite3")
+        now = time.time()
+        # Unbounded queue: the fill should not drop records
+        log = audit_log.AuditLog(path, max_queue=0)
+        for offset in range(0, args.rows, 100_000):
+            for t, c, p, seconds in synthetic_rows(min(100_000, args.rows - offset), rng, now):
+                log.record(c, f"class {c}", p, "0123456789abcdef", "en", "upload", seconds, timestamp=t)
+        log.flush()
+        since = now - DAY
+        report["rows"] = len(log)
+        report["index_mb"] = round(os.path.getsize(path) / 1e6, 1)
+        report["class_distribution"] = summarize(time_calls(lambda: log.class_distribution("hour", since), args.repeat))
+        report["class_distribution_30d"] = summarize(time_calls(lambda: log.class_distribution("day"), args.repeat))
+        report["confidence_histogram"] = summarize(time_calls(lambda: log.confidence_histogram(10, since), args.repeat))
+        report["latency_percentiles"] = summarize(time_calls(lambda: log.latency_percentiles(since=since), args.repeat))
+        log.close()
+
+    print(f"enqueue p50 {report['enqueue']['p50_ms'] * 1000:.1f}us p99 {report['enqueue']['p99_ms'] * 1000:.1f}us | "
+          f"synchronous commit p50 {report['synchronous']['p50_ms']:.2f}ms | writer {report['writer_records_per_second']}/s "
+          f"in {report['writer']['batches']} batches")
+    for name in ("class_distribution", "class_distribution_30d", "confidence_histogram", "latency_percentiles"):
+        print(f"{name:<24} over {report['rows']} rows: p50 {report[name]['p50_ms']:.2f}ms p99 {report[name]['p99_ms']:.2f}ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Query latency and recall of the embedding index as it grows.
+
+Fills an embeddings.EmbeddingIndex with synthetic clustered, non-negative
+(ReLU-like) 100-d vectors, then times exhaustive search and IVF search at a
+few ``nprobe`` settings. Recall@k is measured against the exhaustive result
+on the same float16 data.
+
+Usage:
+    python benchmarks/bench_embeddings.py [--sizes 10000 100000 1000000] [--queries 100]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import summarize
+
+DIM = 100
+CLUSTERS = 200
+APPEND_CHUNK = 100_000
+
+
+def synthetic_embeddings(count, rng, centers):
+    labels = rng.integers(len(centers), size=count)
+    return np.maximum(centers[labels] + rng.normal(0, 0.35, (count, DIM)).astype(np.float32), 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    from embeddings import EmbeddingIndex
+    rng = np.random.default_rng(0)
+    centers = np.abs(rng.normal(0, 1, (CLUSTERS, DIM))).astype(np.float32)
+    queries = synthetic_embeddings(args.queries, rng, centers)
+    digest = "00" * 32
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = EmbeddingIndex(tmp)
+            start = time.perf_counter()
+            for offset in range(0, size, APPEND_CHUNK):
+                chunk = synthetic_embeddings(min(APPEND_CHUNK, size - offset), rng, centers)
+                index.append(chunk, [digest] * len(chunk), np.zeros(len(chunk)), np.ones(len(chunk)))
+            append_seconds = time.perf_counter() - start
+            row = {"vectors": size, "index_mb": round(sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)) / 1e6, 1),
+                   "append_per_second": round(size / append_seconds)}
+
+            def timed_search(nprobe):
+                samples, found = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    matches = index.search(query, args.k, nprobe)
+                    samples.append(time.perf_counter() - start)
+                    found.append({m.row for m in matches})
+                return summarize(samples), found
+
+            row["exact"], truth = timed_search(0)
+            start = time.perf_counter()
+            index.partition()
+            row["partition_seconds"] = round(time.perf_counter() - start, 2)
+            row["nlist"] = len(index.centroids)
+            for nprobe in args.nprobe:
+                stats, found = timed_search(nprobe)
+                stats["recall"] = round(float(np.mean([len(f & t) / args.k for f, t in zip(found, truth)])), 4)
+                row[f"ivf_nprobe{nprobe}"] = stats
+            results.append(row)
+            print(f"n={size:<8} {row['index_mb']:7.1f}MB exact p50 {row['exact']['p50_ms']:8.2f}ms "
+                  f"p99 {row['exact']['p99_ms']:8.2f}ms | nlist={row['nlist']}"
+                  + "".join(f" | nprobe={n} p50 {row[f'ivf_nprobe{n}']['p50_ms']:6.2f}ms "
+                            f"recall@{args.k} {row[f'ivf_nprobe{n}']['recall']:.3f}" for n in args.nprobe))
+            del index
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
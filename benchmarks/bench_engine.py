@@ -0,0 +1,50 @@
+"""Latency of model.predict vs the compiled inference engine (with and without XLA).
+
+Usage:
+    python benchmarks/bench_engine.py [--repeat 200] [--batch-sizes 1 8 32] [--no-xla]
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from common import reference_batch, summarize, time_calls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--no-xla", action="store_true", help="Skip the XLA JIT variant")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    import pipeline
+    from inference_engine import CompiledEngine
+    model = pipeline.load_model()
+    data = reference_batch(max(args.batch_sizes))
+
+    runners = {"model.predict": lambda x: model.predict(x, verbose=0)}
+    runners["engine"] = CompiledEngine(model, jit_compile=False).predict
+    if not args.no_xla:
+        runners["engine+xla"] = CompiledEngine(model, jit_compile=True).predict
+
+    reference = model.predict(data, verbose=0)
+    results = []
+    for batch_size in args.batch_sizes:
+        batch = data[:batch_size]
+        for name, run in runners.items():
+            diff = float(np.abs(run(batch) - reference[:batch_size]).max())
+            row = {"runner": name, "batch_size": batch_size, "max_abs_diff": diff,
+                   **summarize(time_calls(lambda: run(batch), repeat=args.repeat, warmup=5))}
+            results.append(row)
+            print(f"{name:14} batch={batch_size:<3} p50={row['p50_ms']:8.2f}ms p99={row['p99_ms']:8.2f}ms max|diff|={diff:.1e}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
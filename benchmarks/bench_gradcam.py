@@ -0,0 +1,82 @@
+"""Cost of a Grad-CAM overlay relative to plain single-image inference.
+
+Times, on the same preprocessed synthetic scans:
+  plain      - KerasBackend.predict (the classification the user waits for)
+  combined   - gradcam.GradCamExplainer: probabilities + heatmap in one pass
+  two_pass   - a separate forward pass followed by a gradient pass, for reference
+  overlay    - fit, explain, blend and PNG-encode, as GradCamService does
+
+Usage:
+    python benchmarks/bench_gradcam.py [--repeat 30] [--json gradcam.json]
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from common import encode, summarize, synthetic_images, time_calls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    import tensorflow as tf
+    import gradcam
+    import pipeline
+    from backends import KerasBackend
+    backend = KerasBackend()
+    explainer = gradcam.GradCamExplainer(backend.model)
+    images = synthetic_images(8, seed=3)
+    inputs = [pipeline.preprocess_image(image) for image in images]
+    encoded = [encode(image) for image in images]
+    features, head = gradcam.split_at_last_feature_map(backend.model)
+
+    @tf.function
+    def gradient_pass(x):
+        with tf.GradientTape() as tape:
+            feature_map = x
+            for layer in features:
+                feature_map = layer(feature_map, training=False)
+            tape.watch(feature_map)
+            probabilities = feature_map
+            for layer in head:
+                probabilities = layer(probabilities, training=False)
+            score = tf.reduce_max(probabilities[0])
+        return tape.gradient(score, feature_map)
+
+    service = gradcam.GradCamService(lambda: backend.model, max_entries=0)
+    cycle = {"plain": 0, "combined": 0, "two_pass": 0, "overlay": 0}
+
+    def nth(name, items):
+        cycle[name] += 1
+        return items[cycle[name] % len(items)]
+
+    def two_pass():
+        x = nth("two_pass", inputs)
+        backend.predict(x)
+        gradient_pass(x).numpy()
+
+    timings = {
+        "plain": time_calls(lambda: backend.predict(nth("plain", inputs)), args.repeat),
+        "combined": time_calls(lambda: explainer.explain(nth("combined", inputs)), args.repeat),
+        "two_pass": time_calls(two_pass, args.repeat),
+        "overlay": time_calls(lambda: service._compute(None, nth("overlay", encoded), None), args.repeat),
+    }
+    plain = np.percentile(timings["plain"], 50)
+    results = {}
+    for name, samples in timings.items():
+        results[name] = dict(summarize(samples), overhead_x=round(float(np.percentile(samples, 50) / plain), 2))
+        print(f"{name:<9} p50 {results[name]['p50_ms']:8.2f}ms p99 {results[name]['p99_ms']:8.2f}ms "
+              f"{results[name]['overhead_x']:5.2f}x plain")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
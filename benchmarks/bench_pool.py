@@ -0,0 +1,109 @@
+"""Throughput scaling of the multi-process worker pool against one in-process backend.
+
+For each worker count the pool is started fresh (threads per worker default to
+cores // workers) and fed ``--images`` images from ``--clients`` threads in
+chunks of ``--chunk``. Speedup and efficiency are relative to one worker.
+
+Each pool then scores ``--files`` JPEGs with batch_score twice: once copying
+every decoded batch into a slot (``pool.predict``) and once decoding straight
+into reserved shared-memory slots (the path batch_score takes for
+``--backend pool``), so the cost of the copy shows up end to end.
+
+Usage:
+    python benchmarks/bench_pool.py [--backend keras] [--workers 1 2 4 8 16 32] [--images 512] [--chunk 8] [--files 256]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from common import REPO_ROOT, encode, reference_batch, synthetic_images
+
+
+def run_load(predict, data, images, chunk, clients):
+    batches = [data[i % len(data):i % len(data) + chunk] for i in range(0, images, chunk)]
+    predict(batches[0])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for _ in executor.map(predict, batches):
+            pass
+    elapsed = time.perf_counter() - start
+    return round(sum(len(b) for b in batches) / elapsed, 1)
+
+
+def run_scoring(pool, paths, zero_copy):
+    import pipeline
+    from batch_score import score
+    # batch_score only takes the shared-memory path when the backend exposes its pool
+    model = SimpleNamespace(predict=pool.predict, pool=pool) if zero_copy else SimpleNamespace(predict=pool.predict)
+    with open(os.devnull, "w") as out:
+        start = time.perf_counter()
+        scored, _ = score(paths, model, pipeline.read_labels(os.path.join(REPO_ROOT, pipeline.LABELS_PATH)), out)
+    return round(scored / (time.perf_counter() - start), 1)
+
+
+def write_files(directory, count):
+    images = synthetic_images(min(count, 32))
+    paths = []
+    for i in range(count):
+        paths.append(os.path.join(directory, f"{i:05d}.jpg"))
+        with open(paths[-1], "wb") as f:
+            f.write(encode(images[i % len(images)]))
+    return paths
+
+
+def main(argv=None):
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="keras", help="Backend each worker runs")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[n for n in (1, 2, 4, 8, 16, 32) if n <= max(cores, 2)])
+    parser.add_argument("--threads", type=int, help="Threads per worker (default: cores // workers)")
+    parser.add_argument("--images", type=int, default=512)
+    parser.add_argument("--chunk", type=int, default=8, help="Images per request")
+    parser.add_argument("--clients", type=int, help="Submitting threads (default: 2 x workers)")
+    parser.add_argument("--files", type=int, default=256, help="JPEGs scored through batch_score (0 to skip)")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    from backends import create_backend
+    from worker_pool import WorkerPool
+    data = reference_batch(32)
+    results = {"cores": cores, "backend": args.backend}
+
+    # Baseline: a single process using every core
+    backend = create_backend(args.backend)
+    results["single_process_ips"] = run_load(backend.predict, data, args.images, args.chunk, 1)
+    print(f"single process          {results['single_process_ips']:8.1f} img/s")
+    del backend
+
+    rows, base = [], None
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_files(tmp, args.files)
+        for workers in args.workers:
+            pool = WorkerPool(workers, args.backend, threads_per_worker=args.threads, slot_size=args.chunk)
+            try:
+                ips = run_load(pool.predict, data, args.images, args.chunk, args.clients or 2 * workers)
+                scoring = {"copy_ips": run_scoring(pool, paths, False), "zero_copy_ips": run_scoring(pool, paths, True)} if paths else {}
+            finally:
+                pool.close()
+            base = base or ips
+            row = {"workers": workers, "threads_per_worker": pool.threads_per_worker, "throughput_ips": ips,
+                   "speedup": round(ips / base, 2), "efficiency": round(ips / base / workers, 2), **scoring}
+            rows.append(row)
+            print(f"workers={workers:<3} threads={row['threads_per_worker']:<3} {ips:8.1f} img/s "
+                  f"speedup={row['speedup']:5.2f}x efficiency={row['efficiency']:.0%}"
+                  + (f"  batch_score copy={scoring['copy_ips']:.1f} zero-copy={scoring['zero_copy_ips']:.1f} img/s" if scoring else ""))
+    results["pool"] = rows
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
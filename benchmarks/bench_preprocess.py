@@ -0,0 +1,90 @@
+"""Decode + preprocess cost per megapixel: legacy full-frame path vs pipeline.preprocess_image.
+
+Each (size, format, path) combination runs in a fresh subprocess so the peak
+RSS growth it reports belongs to that decode alone.
+
+Usage:
+    python benchmarks/bench_preprocess.py [--megapixels 1 4 12 20] [--formats JPEG PNG]
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from common import current_rss_bytes, encode, peak_rss_bytes, synthetic_mri
+
+
+def legacy_preprocess(image):
+    # The pre-optimization path: full decode, RGB convert, LANCZOS over the whole frame
+    image = image.convert("RGB")
+    image = ImageOps.fit(image, (224, 224), Image.Resampling.LANCZOS)
+    image_array = np.asarray(image)
+    normalized_image_array = (image_array.astype(np.float32) / 127.5) - 1
+    data = np.ndarray(shape=(1, 224, 224, 3), dtype=np.float32)
+    data[0] = normalized_image_array
+    return data
+
+
+def run_worker(path, mode, repeat):
+    import pipeline
+    with open(path, "rb") as f:
+        data = f.read()
+    buffer = np.empty((*pipeline.IMAGE_SIZE[::-1], 3), dtype=np.float32)
+    if mode == "legacy":
+        run = lambda: legacy_preprocess(Image.open(io.BytesIO(data)))
+    else:
+        run = lambda: pipeline.preprocess_bytes(data, buffer)
+    baseline = current_rss_bytes()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return {"median_ms": float(np.median(samples)) * 1000, "peak_rss_growth_mb": max(0, peak_rss_bytes() - baseline) / 1e6}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 4, 12, 20])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--worker", nargs=2, metavar=("PATH", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        print(json.dumps(run_worker(*args.worker, args.repeat)))
+        return 0
+
+    rng = np.random.default_rng(0)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for megapixels in args.megapixels:
+            width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+            image = synthetic_mri((width, width * 3 // 4), rng)
+            for fmt in args.formats:
+                path = os.path.join(tmp, f"{megapixels}.{fmt.lower()}")
+                with open(path, "wb") as f:
+                    f.write(encode(image, fmt))
+                for mode in ("legacy", "fast"):
+                    command = [sys.executable, os.path.abspath(__file__), "--worker", path, mode, "--repeat", str(args.repeat)]
+                    row = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)
+                    row.update(megapixels=megapixels, format=fmt, mode=mode,
+                               ms_per_mp=row["median_ms"] / megapixels, mb_per_mp=row["peak_rss_growth_mb"] / megapixels)
+                    results.append(row)
+                    print(f"{megapixels:5.1f} MP {fmt:4} {mode:6} {row['median_ms']:8.1f} ms ({row['ms_per_mp']:6.2f} ms/MP)"
+                          f"  peak +{row['peak_rss_growth_mb']:6.1f} MB ({row['mb_per_mp']:5.2f} MB/MP)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
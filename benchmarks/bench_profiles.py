@@ -0,0 +1,138 @@
+"""Throughput, latency and peak memory of the app's scoring path under each resource profile.
+
+Each profile runs in its own subprocess, because TensorFlow fixes its thread
+pools when its runtime starts. The subprocess loads the model through
+startup.ModelLoader, as the app does, then ``--clients`` threads score a
+mix of camera-sized JPEGs through resource_profiles.AdmissionController:
+header-only open and draft, admit the decoded pixels, decode and
+preprocess, predict. That is the
+uncached path of app.analyze_image. ``off`` is the
+TensorFlow-defaults baseline without admission control.
+
+Usage:
+    python benchmarks/bench_profiles.py [--profiles off tiny standard many-core] [--clients 8] [--memory-mb 1024]
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from common import REPO_ROOT, current_rss_bytes, encode, peak_rss_bytes, summarize, synthetic_mri
+
+SIZES = ((1024, 1024), (2048, 2048), (4032, 3024), (6000, 4000))
+
+
+def run_worker(args):
+    import pipeline
+    from PIL import Image
+    from resource_profiles import Overloaded, admission_from_env
+    from startup import ModelLoader
+    rng = np.random.default_rng(0)
+    images = [encode(synthetic_mri(size, rng), quality=90) for size in SIZES for _ in range(2)]
+    start = time.perf_counter()
+    loader = ModelLoader(background=False)
+    model, _ = loader.result()
+    load_seconds = time.perf_counter() - start
+    rss_loaded = current_rss_bytes()
+    admission = admission_from_env(baseline=lambda: loader.rss_after_load)
+    latencies, outcomes, lock = [], {"ok": 0, "shed": 0, "too_large": 0}, threading.Lock()
+
+    def client(offset):
+        for i in range(args.requests):
+            data = images[(offset + i) % len(images)]
+            begin = time.perf_counter()
+            try:
+                with Image.open(io.BytesIO(data)) as image:
+                    width, height = pipeline.draft_image(image)
+                    slot = admission.admit(width * height) if admission is not None else nullcontext()
+                    with slot:
+                        model.predict(pipeline.preprocess_image(image))
+                outcome = "ok"
+            except Overloaded:
+                outcome = "shed"
+            except pipeline.ImageTooLargeError:
+                outcome = "too_large"
+            with lock:
+                outcomes[outcome] += 1
+                if outcome == "ok":
+                    latencies.append(time.perf_counter() - begin)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    profile = loader.profile
+    stats = {
+        "profile": profile.name if profile else "off",
+        "threads": f"{profile.intra_op_threads}/{profile.inter_op_threads}" if profile else "default",
+        "max_concurrent": profile.max_concurrent if profile else None,
+        "load_s": round(load_seconds, 2),
+        "rss_after_load_mb": round(rss_loaded / 1e6, 1),
+        "peak_rss_mb": round(peak_rss_bytes() / 1e6, 1),
+        "images_per_second": round(outcomes["ok"] / elapsed, 2),
+        "latency": summarize(latencies) if latencies else None,
+        **outcomes,
+    }
+    if admission is not None:
+        stats["admission"] = admission.stats()
+    with open(args.stats, "w") as f:
+        json.dump(stats, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=["off", "tiny", "standard", "many-core"])
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent requests")
+    parser.add_argument("--requests", type=int, default=6, help="Requests per client")
+    parser.add_argument("--memory-mb", type=float, help="Memory limit the RSS ceiling applies to (default: detected)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--stats", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.profiles:
+            stats_path = os.path.join(tmp, f"{name}.json")
+            env = {**os.environ, "NEUROSCAN_RESOURCE_PROFILE": name}
+            for var in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS", "NEUROSCAN_MAX_DECODE_PIXELS"):
+                env.pop(var, None)
+            if args.memory_mb:
+                env["NEUROSCAN_MEMORY_LIMIT_MB"] = str(args.memory_mb)
+            command = [sys.executable, os.path.abspath(__file__), "--worker", "--stats", stats_path,
+                       "--clients", str(args.clients), "--requests", str(args.requests)]
+            result = subprocess.run(command, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                results.append({"profile": name, "error": result.stderr.strip().splitlines()[-1]})
+                print(f"{name:10} failed: {results[-1]['error']}")
+                continue
+            with open(stats_path) as f:
+                row = json.load(f)
+            results.append(row)
+            latency = row["latency"] or {"p50_ms": float("nan"), "p99_ms": float("nan")}
+            print(f"{name:10} threads {row['threads']:>7} | {row['images_per_second']:6.2f} img/s | "
+                  f"p50 {latency['p50_ms']:8.1f}ms p99 {latency['p99_ms']:8.1f}ms | "
+                  f"peak RSS {row['peak_rss_mb']:7.1f}MB (loaded {row['rss_after_load_mb']:.1f}MB) | "
+                  f"ok {row['ok']} shed {row['shed']} too large {row['too_large']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
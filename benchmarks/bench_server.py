@@ -0,0 +1,119 @@
+"""Latency and throughput of the micro-batching inference server under 1-64 concurrent clients.
+
+Starts inference_server.py on a temporary Unix socket, then drives it with N
+client threads each sending single-image requests. With --direct, the same
+load is also run against one in-process backend shared by all threads (what
+each Streamlit process does without the server) for comparison.
+
+Usage:
+    python benchmarks/bench_server.py [--backend tflite] [--clients 1 4 16 64] [--requests 50] [--direct]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from common import REPO_ROOT, reference_batch, summarize
+
+CLIENT_COUNTS = [1, 2, 4, 8, 16, 32, 64]
+
+
+def drive(predict_factory, clients, requests_per_client, inputs):
+    latencies = [[] for _ in range(clients)]
+    errors = []
+    barrier = threading.Barrier(clients + 1)
+
+    def worker(index):
+        predict = predict_factory()
+        barrier.wait()
+        for i in range(requests_per_client):
+            sample = inputs[(index + i) % len(inputs)][np.newaxis]
+            start = time.perf_counter()
+            try:
+                predict(sample)
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    samples = np.concatenate([np.asarray(l) for l in latencies if l]) if any(latencies) else np.zeros(1)
+    return {"clients": clients, **summarize(samples), "throughput_ips": round(len(samples) / elapsed, 1), "errors": len(errors)}
+
+
+def wait_for_socket(path, process, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(path):
+            return
+        if process.poll() is not None:
+            raise RuntimeError("inference server exited during startup")
+        time.sleep(0.1)
+    raise TimeoutError("inference server did not start")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default=os.environ.get("NEUROSCAN_BACKEND", "keras"))
+    parser.add_argument("--clients", type=int, nargs="+", default=CLIENT_COUNTS)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per client")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--direct", action="store_true", help="Also benchmark a shared in-process backend")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    from inference_client import InferenceClient
+    inputs = reference_batch(16)
+    results = {"server": [], "direct": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "inference.sock")
+        command = [sys.executable, os.path.join(REPO_ROOT, "inference_server.py"), "--socket", socket_path,
+                   "--backend", args.backend, "--max-batch-size", str(args.max_batch_size), "--max-wait-ms", str(args.max_wait_ms)]
+        server = subprocess.Popen(command, cwd=REPO_ROOT, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_socket(socket_path, server)
+            client = InferenceClient(f"unix:{socket_path}")
+            for clients in args.clients:
+                row = drive(lambda: client.predict, clients, args.requests, inputs)
+                results["server"].append(row)
+                print(f"server  clients={clients:<3} p50={row['p50_ms']:8.2f}ms p99={row['p99_ms']:8.2f}ms {row['throughput_ips']:8.1f} img/s errors={row['errors']}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.direct:
+        from backends import create_backend
+        backend = create_backend(args.backend)
+        lock = threading.Lock()
+
+        def serialized(batch):
+            with lock:
+                return backend.predict(batch)
+
+        for clients in args.clients:
+            row = drive(lambda: serialized, clients, args.requests, inputs)
+            results["direct"].append(row)
+            print(f"direct  clients={clients:<3} p50={row['p50_ms']:8.2f}ms p99={row['p99_ms']:8.2f}ms {row['throughput_ips']:8.1f} img/s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Slice throughput and memory of volume screening as volumes grow.
+
+Writes synthetic int16 NIfTI phantoms of increasing depth, then scores each
+with volume.score_volume. Anonymous RSS (which excludes the memory-mapped
+file pages) is sampled throughout and should stay flat across sizes.
+
+Usage:
+    python benchmarks/bench_volume.py [--depths 64 256 1024] [--size 256] [--backend tflite]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+
+from common import anon_rss_bytes, write_synthetic_nifti
+
+
+class PeakSampler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = anon_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, anon_rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depths", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--size", type=int, default=256, help="In-plane size (voxels)")
+    parser.add_argument("--backend", help="Inference backend; defaults to $NEUROSCAN_BACKEND or keras")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    import pipeline
+    import volume
+    model, class_names = pipeline.load_model_and_labels(backend=args.backend)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for depth in args.depths:
+            path = write_synthetic_nifti(os.path.join(tmp, f"phantom_{depth}.nii"), (args.size, args.size, depth))
+            vol = volume.open_volume(path)
+            baseline = anon_rss_bytes()
+            with PeakSampler() as sampler:
+                result = volume.score_volume(vol, model, class_names)
+            scored = len(result.slice_indices)
+            row = {
+                "depth": depth,
+                "file_mb": round(os.path.getsize(path) / 1e6, 1),
+                "scored_slices": scored,
+                "slices_per_second": round(scored / result.seconds, 1),
+                "anon_rss_growth_mb": round((sampler.peak - baseline) / 1e6, 1),
+                "verdict": class_names[result.class_index] if result.class_index is not None else None,
+            }
+            results.append(row)
+            print(f"depth={depth:<5} file={row['file_mb']:7.1f}MB {row['slices_per_second']:7.1f} slices/s "
+                  f"anon RSS +{row['anon_rss_growth_mb']:.1f}MB verdict={row['verdict']}")
+            del vol
+            os.remove(path)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Shared helpers for the benchmark scripts: synthetic inputs, timing and memory."""
+import io
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def synthetic_mri(size, rng, lesion=None):
+    """Grayscale axial-slice lookalike: dark background, bright skull ring, textured brain."""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy = width / 2, height / 2
+    r = np.sqrt(((x - cx) / (0.42 * width)) ** 2 + ((y - cy) / (0.47 * height)) ** 2)
+    image = np.zeros((height, width), dtype=np.float32)
+    image[r < 1.0] = 200
+    brain = r < 0.92
+    image[brain] = 90 + 25 * np.sin(x[brain] / 9.0) * np.cos(y[brain] / 11.0)
+    if lesion is None:
+        lesion = rng.random() < 0.5
+    if lesion:
+        lx = cx + rng.uniform(-0.2, 0.2) * width
+        ly = cy + rng.uniform(-0.2, 0.2) * height
+        lr = rng.uniform(0.05, 0.12) * min(width, height)
+        image[(x - lx) ** 2 + (y - ly) ** 2 < lr ** 2] = 235
+    image += rng.normal(0, 6, image.shape)
+    gray = np.clip(image, 0, 255).astype(np.uint8)
+    return Image.fromarray(gray, "L").convert("RGB")
+
+
+def synthetic_photo(size, rng):
+    """Colourful non-MRI image: smooth colour gradients plus noise."""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    phase = rng.uniform(0, 2 * np.pi, 3)
+    channels = [127 + 100 * np.sin(x / width * 6 + phase[c]) * np.cos(y / height * 4 + phase[c]) for c in range(3)]
+    image = np.stack(channels, axis=-1) + rng.normal(0, 12, (height, width, 3))
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8), "RGB")
+
+
+def synthetic_images(count, size=(512, 512), seed=0, mri_fraction=0.5):
+    rng = np.random.default_rng(seed)
+    return [synthetic_mri(size, rng) if rng.random() < mri_fraction else synthetic_photo(size, rng) for _ in range(count)]
+
+
+def encode(image, fmt="JPEG", **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def reference_batch(count=32, seed=0):
+    """Preprocessed float32 batch of synthetic images, for parity and latency checks."""
+    import pipeline
+    return np.concatenate([pipeline.preprocess_image(image) for image in synthetic_images(count, seed=seed)])
+
+
+def time_calls(fn, repeat, warmup=2):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return np.asarray(samples)
+
+
+def summarize(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "mean_ms": round(float(samples.mean()), 3),
+    }
+
+
+def peak_rss_bytes():
+    # VmHWM is per address space; ru_maxrss survives exec and would include the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss_bytes()
+
+
+def anon_rss_bytes():
+    # Excludes file-backed pages such as a memory-mapped volume, which the kernel can drop at will
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return current_rss_bytes()
+
+
+def write_synthetic_nifti(path, shape=(256, 256, 160), seed=0, lesion=True):
+    """Write an int16 NIfTI-1 head phantom slice by slice, so the volume is never held in memory."""
+    import struct
+    rng = np.random.default_rng(seed)
+    nx, ny, nz = shape
+    header = bytearray(348)
+    struct.pack_into("<i", header, 0, 348)
+    struct.pack_into("<8h", header, 40, 3, nx, ny, nz, 1, 1, 1, 1)
+    struct.pack_into("<hh", header, 70, 4, 16)
+    struct.pack_into("<8f", header, 76, 1.0, 1.0, 1.0, 1.0, 0, 0, 0, 0)
+    struct.pack_into("<3f", header, 108, 352.0, 1.0, 0.0)
+    header[344:348] = b"n+1\0"
+    y, x = np.mgrid[0:ny, 0:nx].astype(np.float32)
+    centre = np.array([nx / 2, ny / 2, nz / 2])
+    spot = centre + rng.uniform(-0.15, 0.15, 3) * np.array(shape)
+    spot_radius = 0.08 * min(shape)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(b"\0" * 4)
+        for z in range(nz):
+            dz = (z - centre[2]) / (0.45 * nz)
+            r = np.sqrt(((x - centre[0]) / (0.42 * nx)) ** 2 + ((y - centre[1]) / (0.47 * ny)) ** 2 + dz ** 2)
+            slab = np.zeros((ny, nx), dtype=np.float32)
+            slab[r < 1.0] = 800
+            brain = r < 0.92
+            slab[brain] = 400 + 120 * np.sin(x[brain] / 9.0) * np.cos(y[brain] / 11.0 + z / 7.0)
+            if lesion:
+                slab[(x - spot[0]) ** 2 + (y - spot[1]) ** 2 + (z - spot[2]) ** 2 < spot_radius ** 2] = 1000
+            slab += rng.normal(0, 25, slab.shape)
+            # NIfTI is x-fastest, so a (y, x) C-order slab is already in file order
+            f.write(slab.astype("<i2").tobytes())
+    return path
@@ -0,0 +1,124 @@
+"""Parity and resource report for the inference backends.
+
+Each backend runs in its own subprocess so startup time and RSS reflect only
+the runtime it imports. Outputs are compared against the Keras backend.
+
+Usage:
+    python benchmarks/compare_backends.py [--backends keras tflite onnx] [--images DIR] [--atol 1e-4]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import REPO_ROOT, current_rss_bytes, peak_rss_bytes, reference_batch, summarize, time_calls
+
+
+def run_worker(args):
+    start = time.perf_counter()
+    from backends import create_backend
+    backend = create_backend(args.worker)
+    startup = time.perf_counter() - start
+    rss_loaded = current_rss_bytes()
+
+    batch = np.load(args.input)
+    start = time.perf_counter()
+    backend.predict(batch[:1])
+    first_call = time.perf_counter() - start
+    outputs = np.concatenate([backend.predict(batch[i:i + 1]) for i in range(len(batch))])
+    np.save(args.output, outputs)
+
+    latency = time_calls(lambda: backend.predict(batch[:1]), repeat=args.repeat)
+    batch_latency = time_calls(lambda: backend.predict(batch), repeat=max(3, args.repeat // 10))
+    stats = {
+        "backend": args.worker,
+        "model_path": backend.model_path,
+        "model_mb": round(os.path.getsize(backend.model_path) / 1e6, 2),
+        "startup_s": round(startup, 3),
+        "first_call_s": round(first_call, 3),
+        "rss_after_load_mb": round(rss_loaded / 1e6, 1),
+        "peak_rss_mb": round(peak_rss_bytes() / 1e6, 1),
+        "batch1": summarize(latency),
+        f"batch{len(batch)}_per_image_ms": round(float(np.median(batch_latency)) * 1000 / len(batch), 3),
+    }
+    with open(args.stats, "w") as f:
+        json.dump(stats, f)
+
+
+def load_reference(images_dir, count):
+    if not images_dir:
+        return reference_batch(count)
+    import pipeline
+    from PIL import Image
+    names = sorted(n for n in os.listdir(images_dir) if n.lower().endswith((".jpg", ".jpeg", ".png")))[:count]
+    return np.concatenate([pipeline.preprocess_image(Image.open(os.path.join(images_dir, n))) for n in names])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["keras", "tflite", "onnx"])
+    parser.add_argument("--images", help="Directory of reference images (default: synthetic set)")
+    parser.add_argument("--count", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--atol", type=float, default=1e-4, help="Max absolute probability difference vs keras")
+    parser.add_argument("--json", help="Write the full report to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    parser.add_argument("--stats", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    backends = ["keras"] + [b for b in args.backends if b != "keras"]
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "reference.npy")
+        np.save(input_path, load_reference(args.images, args.count))
+        outputs = {}
+        for name in backends:
+            out_path, stats_path = os.path.join(tmp, f"{name}.npy"), os.path.join(tmp, f"{name}.json")
+            command = [sys.executable, os.path.abspath(__file__), "--worker", name, "--input", input_path,
+                       "--output", out_path, "--stats", stats_path, "--repeat", str(args.repeat)]
+            result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+            if result.returncode != 0:
+                report[name] = {"backend": name, "error": result.stderr.strip().splitlines()[-1]}
+                continue
+            with open(stats_path) as f:
+                report[name] = json.load(f)
+            outputs[name] = np.load(out_path)
+
+    ok = True
+    reference = outputs.get("keras")
+    for name, probs in outputs.items():
+        if reference is None:
+            break
+        diff = float(np.abs(probs - reference).max())
+        agreement = float((probs.argmax(1) == reference.argmax(1)).mean())
+        report[name]["max_abs_diff"] = diff
+        report[name]["top1_agreement"] = agreement
+        report[name]["parity"] = diff <= args.atol
+        ok = ok and diff <= args.atol
+
+    header = f"{'backend':8} {'parity':>6} {'max|diff|':>10} {'startup s':>9} {'rss MB':>7} {'p50 ms':>7} {'p99 ms':>7}"
+    print(header)
+    for name, row in report.items():
+        if "error" in row:
+            print(f"{name:8} error: {row['error']}")
+            continue
+        print(f"{name:8} {str(row.get('parity', '-')):>6} {row.get('max_abs_diff', float('nan')):10.2e} "
+              f"{row['startup_s']:9.2f} {row['rss_after_load_mb']:7.0f} {row['batch1']['p50_ms']:7.2f} {row['batch1']['p99_ms']:7.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,424 @@
+"""Concurrent-session load test of the Streamlit app over its real websocket protocol.
+
+Starts ``streamlit run app.py`` headless (or targets ``--url``), then ramps
+through ``--sessions`` levels of simulated users. Each user opens its own
+session like a browser tab (websocket + file upload endpoint) and loops over
+a weighted mix of actions with a random think time:
+
+    upload_small   512x512 JPEG through the upload widget
+    upload_large   4032x3024 phone-camera JPEG through the upload widget
+    camera         640x480 JPEG through st.camera_input
+    language       toggle English/Arabic with the current result on screen
+
+Uploads carry random trailing bytes so every image misses the prediction
+caches unless ``--repeat-fraction`` asks for repeats. Time-to-result runs
+from the start of the upload to the first delta carrying the verdict;
+server RSS is sampled throughout. The capacity report gives the largest
+level within the p95 SLO and error budget, memory per session and the
+instances needed for ``--target-users``.
+
+Requires the ``websockets`` package. Usage:
+    python benchmarks/load_test.py --sessions 1 2 4 8 --duration 60
+    python benchmarks/load_test.py --mix upload_small=6,camera=3,language=1 --slo-p95 3 --json load.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+
+from common import REPO_ROOT, encode, synthetic_mri
+
+DEFAULT_MIX = "upload_small=5,upload_large=2,camera=2,language=1"
+IMAGE_SIZES = {"upload_small": (512, 512), "upload_large": (4032, 3024), "camera": (640, 480)}
+# Several distinct scans per size; uniqueness per request comes from the trailer
+IMAGES_PER_SIZE = 4
+RESULT_MARKER = "<h3 style="
+MODE_UPLOAD, MODE_CAMERA = 0, 1
+RSS_INTERVAL = 0.5
+# Earlier uploads kept for --repeat-fraction; once full, new uploads replace random ones
+MAX_REPEAT_POOL = 256
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in IMAGE_SIZES and name != "language":
+            raise SystemExit(f"Unknown action {name!r}; expected {', '.join([*IMAGE_SIZES, 'language'])}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def process_rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50_s": None, "p95_s": None, "p99_s": None}
+    values = np.asarray(samples)
+    return {f"p{q}_s": round(float(np.percentile(values, q)), 3) for q in (50, 95, 99)}
+
+
+def radio_takes_label():
+    # Newer Streamlit versions keep the selected option's label as the radio widget value
+    from streamlit.proto.Radio_pb2 import Radio
+    return "raw_value" in Radio.DESCRIPTOR.fields_by_name
+
+
+class AppSession:
+    """One browser-like session: a websocket for script runs plus the HTTP upload endpoint."""
+
+    def __init__(self, base_url, cookie=None, timeout=120):
+        self.base_url = base_url.rstrip("/")
+        self.cookie = cookie
+        self.timeout = timeout
+        self.session_id = None
+        self.page_hash = ""
+        self.widgets = {}
+        self.language = 0
+        self.mode = MODE_UPLOAD
+        self.files = {}
+        self.options = {}
+
+    async def connect(self):
+        try:
+            from websockets.asyncio.client import connect
+        except ImportError as e:
+            raise SystemExit("The load test needs the websockets package: pip install websockets") from e
+        headers = {"Cookie": f"_streamlit_xsrf={self.cookie}"} if self.cookie else None
+        ws_url = self.base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.ws = await connect(ws_url, subprotocols=["streamlit"], additional_headers=headers, max_size=None)
+
+    async def close(self):
+        await self.ws.close()
+
+    def _widget_states(self):
+        from streamlit.proto.WidgetStates_pb2 import WidgetStates
+        states = WidgetStates()
+        for role, value in (("language", self.language), ("mode", self.mode)):
+            if role in self.widgets:
+                state = states.widgets.add()
+                state.id = self.widgets[role]
+                if radio_takes_label():
+                    state.string_value = self.options[role][value]
+                else:
+                    state.int_value = value
+        for role, info in self.files.items():
+            if role in self.widgets:
+                state = states.widgets.add()
+                state.id = self.widgets[role]
+                state.file_uploader_state_value.uploaded_file_info.add().CopyFrom(info)
+        return states
+
+    async def run(self):
+        """Rerun the script with the current widget states; ``(seconds_to_result, seconds, error)``."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        message = BackMsg()
+        message.rerun_script.page_script_hash = self.page_hash
+        message.rerun_script.widget_states.CopyFrom(self._widget_states())
+        start = time.perf_counter()
+        await self.ws.send(message.SerializeToString())
+        to_result, error, widgets, radios = None, None, {}, []
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self.ws.recv(), self.timeout))
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                self.session_id = forward.new_session.initialize.session_id
+                self.page_hash = forward.new_session.page_script_hash
+                widgets, radios = {}, []
+            elif kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                etype = element.WhichOneof("type")
+                if etype == "radio":
+                    radios.append((element.radio.id, list(element.radio.options)))
+                elif etype in ("file_uploader", "camera_input"):
+                    widgets[etype] = getattr(element, etype).id
+                elif etype == "markdown" and RESULT_MARKER in element.markdown.body and to_result is None:
+                    to_result = time.perf_counter() - start
+                elif etype == "exception":
+                    error = error or element.exception.message or "exception"
+                elif etype == "alert" and element.alert.format == element.alert.ERROR:
+                    error = error or element.alert.body
+            elif kind == "script_finished":
+                if forward.script_finished == forward.FINISHED_EARLY_FOR_RERUN:
+                    # st.rerun (language switch): a fresh run with new widget ids follows
+                    widgets, radios = {}, []
+                    continue
+                break
+        # Sidebar order: language radio, then input-mode radio
+        self.widgets = dict(widgets)
+        for role, (widget_id, options) in zip(("language", "mode"), radios):
+            self.widgets[role] = widget_id
+            self.options[role] = options
+        return to_result, time.perf_counter() - start, error
+
+    def _upload(self, data, name):
+        from streamlit.proto.Common_pb2 import UploadedFileInfo
+        file_id = uuid.uuid4().hex
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+                f"Content-Type: image/jpeg\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        url = f"{self.base_url}/_stcore/upload_file/{self.session_id}/{file_id}"
+        request = urllib.request.Request(url, body, method="PUT",
+                                         headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        if self.cookie:
+            request.add_header("Cookie", f"_streamlit_xsrf={self.cookie}")
+            request.add_header("X-Xsrftoken", self.cookie)
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+        info = UploadedFileInfo(file_id=file_id, name=name, size=len(data))
+        info.file_urls.file_id = file_id
+        info.file_urls.upload_url = url
+        info.file_urls.delete_url = url
+        return info
+
+    async def submit_image(self, data, camera=False):
+        mode = MODE_CAMERA if camera else MODE_UPLOAD
+        role = "camera_input" if camera else "file_uploader"
+        start = time.perf_counter()
+        if self.mode != mode or role not in self.widgets:
+            self.mode = mode
+            self.files = {}
+            await self.run()
+        self.files = {role: await asyncio.to_thread(self._upload, data, f"{uuid.uuid4().hex[:8]}.jpg")}
+        upload_seconds = time.perf_counter() - start
+        to_result, seconds, error = await self.run()
+        if error is None and to_result is None:
+            error = "no result rendered"
+        return (upload_seconds + to_result if to_result is not None else None), upload_seconds + seconds, error
+
+    async def toggle_language(self):
+        self.language = 1 - self.language
+        return await self.run()
+
+
+class LoadTest:
+    def __init__(self, base_url, mix, think, repeat_fraction, cookie=None, seed=0):
+        self.base_url = base_url
+        self.mix = mix
+        self.think = think
+        self.repeat_fraction = repeat_fraction
+        self.cookie = cookie
+        self.rng = random.Random(seed)
+        image_rng = np.random.default_rng(seed)
+        self.images = {action: [encode(synthetic_mri(size, image_rng), quality=90) for _ in range(IMAGES_PER_SIZE)]
+                       for action, size in IMAGE_SIZES.items()}
+        self.sent = []
+
+    def image_for(self, action):
+        if self.sent and self.rng.random() < self.repeat_fraction:
+            return self.rng.choice(self.sent)
+        # JPEG decoders stop at the end-of-image marker, so a random trailer only changes the digest
+        data = self.rng.choice(self.images[action]) + os.urandom(16)
+        if self.repeat_fraction > 0:
+            if len(self.sent) < MAX_REPEAT_POOL:
+                self.sent.append(data)
+            else:
+                self.sent[self.rng.randrange(MAX_REPEAT_POOL)] = data
+        return data
+
+    async def user(self, deadline, records):
+        session = AppSession(self.base_url, self.cookie)
+        try:
+            await session.connect()
+            await session.run()
+            actions, weights = zip(*self.mix.items())
+            while time.perf_counter() < deadline:
+                action = self.rng.choices(actions, weights)[0]
+                started = time.time()
+                try:
+                    if action == "language":
+                        to_result, seconds, error = await session.toggle_language()
+                        to_result = seconds
+                    else:
+                        to_result, seconds, error = await session.submit_image(self.image_for(action), action == "camera")
+                except Exception as e:
+                    to_result, seconds, error = None, None, f"{type(e).__name__}: {e}"
+                records.append({"action": action, "time": started, "to_result": to_result, "seconds": seconds, "error": error})
+                await asyncio.sleep(self.rng.expovariate(1 / self.think) if self.think else 0)
+        except Exception as e:
+            records.append({"action": "connect", "time": time.time(), "to_result": None, "seconds": None,
+                            "error": f"{type(e).__name__}: {e}"})
+        finally:
+            if getattr(session, "ws", None) is not None:
+                await session.close()
+
+    async def level(self, sessions, duration):
+        records = []
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(self.user(deadline, records) for _ in range(sessions)))
+        return records
+
+
+def start_server(port):
+    command = [sys.executable, "-m", "streamlit", "run", os.path.join(REPO_ROOT, "app.py"), "--server.headless", "true",
+               "--server.port", str(port), "--browser.gatherUsageStats", "false", "--server.enableXsrfProtection", "false"]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            with urllib.request.urlopen(url + "/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return process, url
+        except OSError:
+            time.sleep(0.2)
+        if process.poll() is not None:
+            break
+    process.kill()
+    raise SystemExit("streamlit did not start")
+
+
+def xsrf_cookie(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        for header in response.headers.get_all("Set-Cookie") or []:
+            name, _, rest = header.partition("=")
+            if name.strip() == "_streamlit_xsrf":
+                return rest.split(";")[0]
+    return None
+
+
+async def sample_rss(pid, stop, timeline, state):
+    start = time.time()
+    while not stop.is_set():
+        rss = process_rss_bytes(pid)
+        if rss is not None:
+            timeline.append({"t": round(time.time() - start, 2), "sessions": state["sessions"], "rss_mb": round(rss / 1e6, 1)})
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def summarize_level(sessions, duration, records, rss):
+    results = [r for r in records if r["action"] != "language" and r["to_result"] is not None and r["error"] is None]
+    toggles = [r["seconds"] for r in records if r["action"] == "language" and r["error"] is None]
+    errors = [r for r in records if r["error"] is not None]
+    return {
+        "sessions": sessions,
+        "requests": len(records),
+        "results": len(results),
+        "results_per_second": round(len(results) / duration, 2),
+        "time_to_result": percentiles([r["to_result"] for r in results]),
+        "by_action": {action: percentiles([r["to_result"] for r in results if r["action"] == action])
+                      for action in sorted({r["action"] for r in results})},
+        "language_toggle": percentiles(toggles),
+        "error_rate": round(len(errors) / len(records), 4) if records else None,
+        "errors": sorted({str(r["error"])[:120] for r in errors})[:5],
+        "rss_start_mb": rss[0] if rss else None,
+        "rss_end_mb": rss[-1] if rss else None,
+        "rss_peak_mb": max(rss) if rss else None,
+        "rss_median_mb": round(float(np.median(rss)), 1) if rss else None,
+    }
+
+
+def capacity_report(levels, slo_p95, max_error_rate, target_users):
+    ok = [level for level in levels if level["time_to_result"]["p95_s"] is not None
+          and level["time_to_result"]["p95_s"] <= slo_p95 and (level["error_rate"] or 0) <= max_error_rate]
+    capacity = max((level["sessions"] for level in ok), default=0)
+    # Steady-state (median) RSS per level: peaks catch transient decode buffers and allocator noise
+    steady = [(level["sessions"], level["rss_median_mb"]) for level in levels if level["rss_median_mb"] is not None]
+    per_session = note = None
+    if len(steady) > 1:
+        x, y = np.array(steady, dtype=np.float64).T
+        slope = float(np.polyfit(x, y, 1)[0]) if len(set(x)) > 1 else 0.0
+        per_session = round(max(slope, 0.0), 1)
+        if slope <= 0:
+            note = f"fitted slope {slope:.1f} MB/session: per-session memory is below the RSS noise at these levels"
+    report = {
+        "slo_p95_s": slo_p95,
+        "max_error_rate": max_error_rate,
+        "sessions_per_instance": capacity,
+        "peak_throughput_results_per_second": max((level["results_per_second"] for level in ok), default=0.0),
+        "rss_mb_per_session": per_session,
+        "rss_peak_mb": max((level["rss_peak_mb"] for level in levels if level["rss_peak_mb"] is not None), default=None),
+    }
+    if note:
+        report["rss_mb_per_session_note"] = note
+    if target_users:
+        report["target_users"] = target_users
+        report["instances_needed"] = math.ceil(target_users / capacity) if capacity else None
+    return report
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    process = None
+    if args.url:
+        url, pid = args.url, args.pid
+    else:
+        process, url = start_server(args.port)
+        pid = process.pid
+    try:
+        test = LoadTest(url, mix, args.think, args.repeat_fraction, xsrf_cookie(url))
+        # Load the model and warm every code path before measuring
+        await test.level(1, args.warmup)
+        stop, timeline, state = asyncio.Event(), [], {"sessions": 0}
+        sampler = asyncio.create_task(sample_rss(pid, stop, timeline, state)) if pid else None
+        levels = []
+        for sessions in args.sessions:
+            state["sessions"] = sessions
+            mark = len(timeline)
+            records = await test.level(sessions, args.duration)
+            level = summarize_level(sessions, args.duration, records, [s["rss_mb"] for s in timeline[mark:]])
+            levels.append(level)
+            ttr = level["time_to_result"]
+            print(f"sessions={sessions:<3} results={level['results']:<4} {level['results_per_second']:6.2f}/s "
+                  f"p50 {ttr['p50_s']}s p95 {ttr['p95_s']}s p99 {ttr['p99_s']}s errors {level['error_rate']} "
+                  f"RSS peak {level['rss_peak_mb']}MB", file=sys.stderr)
+        stop.set()
+        if sampler is not None:
+            await sampler
+        report = {"levels": levels, "capacity": capacity_report(levels, args.slo_p95, args.max_error_rate, args.target_users),
+                  "rss_timeline": timeline, "mix": mix, "duration_per_level_s": args.duration}
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="Concurrency levels to ramp through")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds per level")
+    parser.add_argument("--warmup", type=float, default=15, help="Seconds of single-session warmup")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted actions, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--think", type=float, default=1.0, help="Mean think time between actions (s)")
+    parser.add_argument("--repeat-fraction", type=float, default=0.0, help="Share of uploads that repeat an earlier image")
+    parser.add_argument("--url", help="Target a running instance instead of starting one")
+    parser.add_argument("--pid", type=int, help="Server PID for RSS sampling when using --url")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--slo-p95", type=float, default=5.0, help="Time-to-result p95 objective (s)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--target-users", type=int, help="Concurrent users to size for")
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report["capacity"], indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
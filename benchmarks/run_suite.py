@@ -0,0 +1,195 @@
+"""Reproducible benchmark suite for decode -> preprocess -> inference -> app render.
+
+Inputs are synthetic MRI-like and non-MRI images generated from a fixed seed
+at several resolutions and formats. Results go to a JSON file; baselines can
+be saved and compared against with a regression threshold, e.g. before a
+deploy:
+
+    python benchmarks/run_suite.py --save-baseline main
+    python benchmarks/run_suite.py --compare main --threshold 0.15
+
+Only p50 latencies are compared; a metric regresses when it is more than
+``threshold`` (fractional) slower than the baseline.
+
+No baseline is committed: latencies only compare on the same hardware,
+backend and load. The first run on a machine (or CI runner) must save one,
+e.g. from the main branch, before ``--compare`` can be used there; a
+comparison against a baseline taken on a different platform, CPU count or
+backend prints a warning.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from common import REPO_ROOT, encode, summarize, synthetic_mri, synthetic_photo, time_calls
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+RESOLUTIONS = [(256, 256), (1024, 1024), (4032, 3024)]
+FORMATS = ["JPEG", "PNG"]
+BATCH_SIZES = [1, 8, 32, 128]
+
+
+def make_inputs(seed):
+    rng = np.random.default_rng(seed)
+    inputs = {}
+    for width, height in RESOLUTIONS:
+        for kind, make in (("mri", synthetic_mri), ("photo", synthetic_photo)):
+            image = make((width, height), rng)
+            for fmt in FORMATS:
+                inputs[f"{kind}_{width}x{height}_{fmt.lower()}"] = encode(image, fmt)
+    return inputs
+
+
+def bench_decode_preprocess(inputs, repeat):
+    import io
+    from PIL import Image
+    import pipeline
+    buffer = np.empty((*pipeline.IMAGE_SIZE[::-1], 3), dtype=np.float32)
+    results = {}
+    for name, data in inputs.items():
+        def decode():
+            with Image.open(io.BytesIO(data)) as image:
+                image.load()
+        results[f"decode/{name}"] = summarize(time_calls(decode, repeat))
+        results[f"preprocess/{name}"] = summarize(time_calls(lambda: pipeline.preprocess_bytes(data, buffer), repeat))
+    return results
+
+
+def bench_inference(backend, repeat):
+    import pipeline
+    rng = np.random.default_rng(1)
+    results = {}
+    for batch_size in BATCH_SIZES:
+        batch = rng.uniform(-1, 1, (batch_size, *pipeline.IMAGE_SIZE[::-1], 3)).astype(np.float32)
+        samples = time_calls(lambda: backend.predict(batch), max(3, repeat // max(1, batch_size // 8)))
+        results[f"inference/{backend.name}/batch{batch_size}"] = summarize(samples)
+        results[f"inference/{backend.name}/batch{batch_size}_per_image"] = summarize(samples / batch_size)
+    return results
+
+
+def bench_app(repeat, seed):
+    """Time from upload to rendered result through a headless run of app.py."""
+    from streamlit.testing.v1 import AppTest
+    rng = np.random.default_rng(seed)
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=600)
+    app.run()
+
+    def upload_and_run(index):
+        # A fresh image every time so the prediction cache never answers
+        data = encode(synthetic_mri((1024, 1024), rng), "JPEG")
+        app.file_uploader[0].upload(f"scan{index}.jpg", data, "image/jpeg")
+        start = time.perf_counter()
+        app.run()
+        elapsed = time.perf_counter() - start
+        if app.exception or not any(h.value for h in app.header):
+            raise RuntimeError(f"app run failed: {app.exception}")
+        return elapsed
+
+    upload_and_run(-1)
+    samples = [upload_and_run(i) for i in range(repeat)]
+    rerun_samples = time_calls(app.run, repeat)
+    return {
+        "app/upload_to_result": summarize(samples),
+        "app/rerun_cached": summarize(rerun_samples),
+    }
+
+
+def metadata(backend_name):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "backend": backend_name,
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, stats in baseline["results"].items():
+        current = results.get(name)
+        if current is None:
+            continue
+        before, after = stats["p50_ms"], current["p50_ms"]
+        if before > 0 and after > before * (1 + threshold):
+            regressions.append((name, before, after))
+    return regressions
+
+
+def load_baseline(name):
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    if not os.path.exists(path):
+        raise SystemExit(f"No baseline {name!r} at {path}; save one on this machine first with --save-baseline {name}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--backend", help="Inference backend to benchmark (default: $NEUROSCAN_BACKEND or keras)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["preprocess", "inference", "app"])
+    parser.add_argument("--output", default="bench_output.json", help="Where to write this run's results")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Also store the results as benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare against benchmarks/baselines/NAME.json")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed fractional p50 slowdown vs the baseline")
+    args = parser.parse_args(argv)
+
+    # Fail before the run, not after it
+    baseline = load_baseline(args.compare) if args.compare else None
+    os.chdir(REPO_ROOT)
+    if args.backend:
+        os.environ["NEUROSCAN_BACKEND"] = args.backend
+    from backends import create_backend, resolve_backend_name
+
+    results = {}
+    if "preprocess" not in args.skip:
+        results.update(bench_decode_preprocess(make_inputs(args.seed), args.repeat))
+    if "inference" not in args.skip:
+        results.update(bench_inference(create_backend(args.backend), args.repeat))
+    if "app" not in args.skip:
+        results.update(bench_app(args.repeat, args.seed))
+
+    report = {"meta": metadata(resolve_backend_name(args.backend)), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for name, stats in results.items():
+        print(f"{name:55} p50={stats['p50_ms']:9.2f}ms p99={stats['p99_ms']:9.2f}ms")
+    print(f"results written to {args.output}", file=sys.stderr)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {path}", file=sys.stderr)
+
+    if baseline is not None:
+        differs = [key for key in ("platform", "cpu_count", "backend") if baseline["meta"].get(key) != report["meta"][key]]
+        if differs:
+            print(f"warning: baseline {args.compare!r} was recorded with a different {', '.join(differs)}; "
+                  f"latencies may not be comparable", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.2f}ms -> {after:.2f}ms (+{(after / before - 1) * 100:.0f}%)")
+        if regressions:
+            return 1
+        print(f"no regressions above {args.threshold:.0%} vs baseline {args.compare!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
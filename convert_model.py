@@ -0,0 +1,54 @@
+"""One-time conversion of keras_model.h5 to TFLite and ONNX for the lightweight backends.
+
+Usage:
+    python convert_model.py [--model keras_model.h5] [--out-dir models] [--formats tflite onnx]
+
+Needs full TensorFlow (and tf2onnx for ONNX) at conversion time only; the
+converted files are then served by backends.TFLiteBackend / OnnxBackend.
+"""
+import argparse
+import os
+import sys
+
+import pipeline
+from backends import CONVERTED_MODEL_DIR, converted_model_path
+
+
+def convert_tflite(model, out_path):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(out_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def convert_onnx(model, out_path, opset=13):
+    import tensorflow as tf
+    import tf2onnx
+    spec = (tf.TensorSpec((None, *pipeline.IMAGE_SIZE, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=out_path)
+
+
+CONVERTERS = {
+    "tflite": convert_tflite,
+    "onnx": convert_onnx,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=pipeline.MODEL_PATH)
+    parser.add_argument("--out-dir", default=CONVERTED_MODEL_DIR)
+    parser.add_argument("--formats", nargs="+", choices=sorted(CONVERTERS), default=sorted(CONVERTERS))
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    model = pipeline.load_model(args.model)
+    for fmt in args.formats:
+        out_path = converted_model_path(fmt, args.model, args.out_dir)
+        CONVERTERS[fmt](model, out_path)
+        print(f"wrote {out_path} ({os.path.getsize(out_path) / 1e6:.2f} MB)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""Distilled student model served as a cascade in front of keras_model.h5.
+
+``train`` scores image directories with the teacher, fits a small CNN's
+logits, divided by the temperature, to the teacher's temperature-softened
+probabilities over the labels.txt classes, serves the student at
+temperature 1 so its confidences are on the teacher's scale, and calibrates
+the student's confidence threshold on a held-out split. The threshold is
+the lowest one at which the cascade (student when its confidence is at or
+above the threshold, teacher otherwise) still agrees with the teacher on at
+least ``--target-agreement`` of the held-out images. ``evaluate`` re-runs
+the cascade against the teacher on any images and reports escalation rate,
+agreement, throughput gain and the disagreement cases:
+
+    python distill.py train IMAGE_DIR [IMAGE_DIR ...] [--target-agreement 0.99]
+    python distill.py evaluate IMAGE_DIR [IMAGE_DIR ...] [--json report.json]
+
+Serve with ``NEUROSCAN_BACKEND=cascade``; ``NEUROSCAN_CASCADE_CONFIG``
+(default models/cascade.json) names the student and threshold and
+``NEUROSCAN_CASCADE_TEACHER`` the teacher backend (default keras).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import pipeline
+from backends import CONVERTED_MODEL_DIR, KerasBackend, TFLiteBackend, create_backend
+from metrics import Counter, REGISTRY
+from prediction_cache import model_files
+
+CONFIG_ENV = "NEUROSCAN_CASCADE_CONFIG"
+TEACHER_ENV = "NEUROSCAN_CASCADE_TEACHER"
+DEFAULT_CONFIG_PATH = os.path.join(CONVERTED_MODEL_DIR, "cascade.json")
+STUDENT_KERAS_PATH = os.path.join(CONVERTED_MODEL_DIR, "student.h5")
+STUDENT_TFLITE_PATH = os.path.join(CONVERTED_MODEL_DIR, "student.tflite")
+DEFAULT_TEACHER = "keras"
+DEFAULT_TARGET_AGREEMENT = 0.99
+TEMPERATURE = 2.0
+HOLDOUT_FRACTION = 0.2
+# The student sees the shared 224x224 input average-pooled by this factor
+STUDENT_POOL = 2
+STUDENT_WIDTH = 16
+# Distillation sets are small; the Keras default (0.99) leaves inference statistics far from the training ones
+BN_MOMENTUM = 0.9
+MAX_REPORTED_DISAGREEMENTS = 50
+
+CASCADE_ROUTES = REGISTRY.register(Counter("neuroscan_cascade_routes_total", "Images answered by the student vs escalated to the teacher.", ("stage",)))
+
+
+def build_student_core(num_classes, width=STUDENT_WIDTH):
+    """Trainable part of the student, on pooled ``(112, 112, 3)`` inputs; outputs logits."""
+    import tensorflow as tf
+    layers = tf.keras.layers
+    size = (pipeline.IMAGE_SIZE[1] // STUDENT_POOL, pipeline.IMAGE_SIZE[0] // STUDENT_POOL, 3)
+    model = tf.keras.Sequential([layers.Input(size), layers.Conv2D(width, 3, strides=2, padding="same", use_bias=False),
+                                 layers.BatchNormalization(momentum=BN_MOMENTUM), layers.ReLU()], name="student_core")
+    for multiplier in (2, 4, 8):
+        model.add(layers.SeparableConv2D(width * multiplier, 3, strides=2, padding="same", use_bias=False))
+        model.add(layers.BatchNormalization(momentum=BN_MOMENTUM))
+        model.add(layers.ReLU())
+    model.add(layers.GlobalAveragePooling2D())
+    model.add(layers.Dropout(0.2))
+    model.add(layers.Dense(num_classes))
+    return model
+
+
+def build_student(core):
+    """Servable student: takes the same ``(224, 224, 3)`` input as the teacher, softmax at temperature 1."""
+    import tensorflow as tf
+    layers = tf.keras.layers
+    return tf.keras.Sequential([layers.Input((*pipeline.IMAGE_SIZE[::-1], 3)), layers.AveragePooling2D(STUDENT_POOL), core,
+                                layers.Softmax()], name="student")
+
+
+def softmax(logits):
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+def soften(probabilities, temperature=TEMPERATURE):
+    # The teacher only exposes probabilities: p ** (1/T), renormalized, is softmax(logits / T)
+    softened = np.power(np.clip(probabilities, 1e-8, 1.0), 1.0 / temperature)
+    return softened / softened.sum(axis=1, keepdims=True)
+
+
+def pool_inputs(batch):
+    height, width = batch.shape[1] // STUDENT_POOL, batch.shape[2] // STUDENT_POOL
+    return batch.reshape(len(batch), height, STUDENT_POOL, width, STUDENT_POOL, 3).mean(axis=(2, 4))
+
+
+def collect(directories, teacher):
+    """Pooled float16 inputs, teacher probabilities and paths for every readable image."""
+    from batch_score import decode_path, iter_image_paths
+    paths = (path for directory in directories for path in iter_image_paths(directory))
+    inputs, targets, names = [], [], []
+    for ok, batch, _ in pipeline.iter_batches(paths, decode_path):
+        if batch is None:
+            continue
+        targets.append(pipeline.predict_batch(teacher, batch))
+        inputs.append(pool_inputs(batch).astype(np.float16))
+        names.extend(ok)
+    if not names:
+        raise SystemExit("No readable images found")
+    return np.concatenate(inputs), np.concatenate(targets), names
+
+
+def calibrate_threshold(confidence, agree, target):
+    """Lowest confidence threshold keeping cascade agreement with the teacher at or above ``target``.
+
+    Escalated images get the teacher's answer, so only student-answered
+    disagreements count. Thresholds fall between distinct confidence values,
+    so tied confidences are accepted or escalated together.
+    """
+    order = np.argsort(-confidence, kind="stable")
+    ranked = confidence[order]
+    disagreements = np.cumsum(~agree[order])
+    ends = np.flatnonzero(np.append(ranked[1:] != ranked[:-1], True))
+    valid = ends[1.0 - disagreements[ends] / len(confidence) >= target]
+    # Above 1.0 nothing is answered by the student
+    return float(ranked[valid[-1]]) if len(valid) else 1.0 + 1e-6
+
+
+def cascade_report(student_probabilities, teacher_probabilities, threshold, names=None):
+    confidence = student_probabilities.max(axis=1)
+    student_class = student_probabilities.argmax(axis=1)
+    teacher_class = teacher_probabilities.argmax(axis=1)
+    accepted = confidence >= threshold
+    cascade_class = np.where(accepted, student_class, teacher_class)
+    report = {
+        "images": int(len(confidence)),
+        "threshold": round(float(threshold), 6),
+        "escalation_rate": round(float(1.0 - accepted.mean()), 4),
+        "student_agreement": round(float((student_class == teacher_class).mean()), 4),
+        "cascade_agreement": round(float((cascade_class == teacher_class).mean()), 4),
+        "disagreement_count": int((cascade_class != teacher_class).sum()),
+    }
+    if names is not None:
+        cases = np.flatnonzero(cascade_class != teacher_class)
+        report["disagreements"] = [{"path": names[i], "student": int(student_class[i]), "teacher": int(teacher_class[i]),
+                                    "student_confidence": round(float(confidence[i]), 4)}
+                                   for i in cases[:MAX_REPORTED_DISAGREEMENTS]]
+    return report
+
+
+def train(args):
+    import tensorflow as tf
+    from convert_model import convert_tflite
+    from result_store import model_version
+    teacher = KerasBackend(args.teacher_model)
+    class_names = pipeline.read_labels(args.labels)
+    inputs, targets, names = collect(args.dirs, teacher)
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(names))
+    holdout = order[:max(1, int(len(order) * HOLDOUT_FRACTION))]
+    train_rows = order[len(holdout):]
+
+    tf.keras.utils.set_random_seed(args.seed)
+    core = build_student_core(len(class_names))
+    # Loss on logits / T against the teacher at T; serving drops the division, matching the teacher's sharpness
+    trainer = tf.keras.Sequential([core, tf.keras.layers.Rescaling(1.0 / args.temperature)], name="student_trainer")
+    trainer.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate),
+                    loss=tf.keras.losses.CategoricalCrossentropy(from_logits=True))
+    dataset = (tf.data.Dataset.from_tensor_slices((inputs[train_rows], soften(targets[train_rows], args.temperature)))
+               .shuffle(len(train_rows), seed=args.seed)
+               .map(lambda x, y: (tf.image.random_flip_left_right(tf.cast(x, tf.float32)), y))
+               .batch(args.batch_size).prefetch(2))
+    trainer.fit(dataset, epochs=args.epochs, verbose=2)
+
+    student = build_student(core)
+    # Calibrate on what is served: the student's probabilities at temperature 1
+    holdout_probabilities = softmax(core.predict(inputs[holdout].astype(np.float32), verbose=0))
+    agree = holdout_probabilities.argmax(axis=1) == targets[holdout].argmax(axis=1)
+    threshold = calibrate_threshold(holdout_probabilities.max(axis=1), agree, args.target_agreement)
+    os.makedirs(os.path.dirname(args.config) or ".", exist_ok=True)
+    student.save(args.student_model)
+    convert_tflite(student, args.student_tflite)
+    report = cascade_report(holdout_probabilities, targets[holdout], threshold, [names[i] for i in holdout])
+    config = {
+        "student_tflite": args.student_tflite,
+        "student_keras": args.student_model,
+        "threshold": threshold,
+        "target_agreement": args.target_agreement,
+        "temperature": args.temperature,
+        "teacher_model": args.teacher_model,
+        "teacher_version": model_version(args.teacher_model, args.labels),
+        "labels": class_names,
+        "student_parameters": int(student.count_params()),
+        "holdout": {k: v for k, v in report.items() if k != "disagreements"},
+    }
+    with open(args.config, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"wrote {args.config}: threshold {threshold:.4f}, escalation {report['escalation_rate']:.1%} "
+          f"on {len(holdout)} held-out images", file=sys.stderr)
+    return report
+
+
+class CascadeBackend:
+    """Student answers confident images; the rest are escalated to the teacher backend."""
+
+    name = "cascade"
+
+    @staticmethod
+    def import_runtime():
+        return None
+
+    def __init__(self, model_path=None, teacher=None, threshold=None):
+        self.config_path = model_path or os.environ.get(CONFIG_ENV) or DEFAULT_CONFIG_PATH
+        with open(self.config_path) as f:
+            self.config = json.load(f)
+        self.threshold = self.config["threshold"] if threshold is None else threshold
+        try:
+            self.student = TFLiteBackend(self.config["student_tflite"])
+        except (ImportError, FileNotFoundError):
+            self.student = KerasBackend(self.config["student_keras"])
+        teacher_path = self.config.get("teacher_model", pipeline.MODEL_PATH)
+        teacher = teacher or os.environ.get(TEACHER_ENV) or DEFAULT_TEACHER
+        # Other teacher backends serve their own converted copy of the teacher
+        self.teacher = create_backend(teacher, teacher_path if teacher == "keras" else None)
+        self._check_teacher(teacher_path)
+        # Cache and store keys follow the config, the student and the teacher's files, so
+        # retraining or replacing keras_model.h5 invalidates them
+        self.model_path = (self.config_path, self.student.model_path,
+                           *model_files(self.teacher.model_path or teacher_path))
+        self._lock = threading.Lock()
+        self.answered = self.escalated = 0
+
+    def _check_teacher(self, teacher_path):
+        from result_store import model_version
+        version = self.config.get("teacher_version")
+        if version and os.path.exists(teacher_path) and model_version(teacher_path, pipeline.LABELS_PATH) != version:
+            print(f"cascade: {teacher_path} changed since the student was distilled; "
+                  f"the threshold may no longer meet its agreement target", file=sys.stderr)
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        probabilities = np.array(self.student.predict(batch), dtype=np.float32)
+        escalate = probabilities.max(axis=1) < self.threshold
+        count = int(escalate.sum())
+        if count:
+            probabilities[escalate] = self.teacher.predict(batch[escalate])
+        with self._lock:
+            self.escalated += count
+            self.answered += len(batch) - count
+        CASCADE_ROUTES.inc(len(batch) - count, stage="student")
+        CASCADE_ROUTES.inc(count, stage="teacher")
+        return probabilities
+
+    def stats(self):
+        with self._lock:
+            total = self.answered + self.escalated
+            return {"threshold": self.threshold, "answered": self.answered, "escalated": self.escalated,
+                    "escalation_rate": self.escalated / total if total else 0.0}
+
+
+def evaluate(args):
+    from batch_score import decode_path, iter_image_paths
+    cascade = CascadeBackend(args.config, teacher="keras")
+    teacher, student = cascade.teacher, cascade.student
+    paths = (path for directory in args.dirs for path in iter_image_paths(directory))
+    student_out, teacher_out, names = [], [], []
+    seconds = {"teacher": 0.0, "cascade": 0.0}
+    for ok, batch, _ in pipeline.iter_batches(paths, decode_path):
+        if batch is None:
+            continue
+        batch = np.array(batch)
+        start = time.perf_counter()
+        teacher_out.append(pipeline.predict_batch(teacher, batch))
+        seconds["teacher"] += time.perf_counter() - start
+        start = time.perf_counter()
+        cascade.predict(batch)
+        seconds["cascade"] += time.perf_counter() - start
+        student_out.append(student.predict(batch))
+        names.extend(ok)
+    if not names:
+        raise SystemExit("No readable images found")
+    report = cascade_report(np.concatenate(student_out), np.concatenate(teacher_out), cascade.threshold, names)
+    report["teacher_images_per_second"] = round(len(names) / seconds["teacher"], 1)
+    report["cascade_images_per_second"] = round(len(names) / seconds["cascade"], 1)
+    report["throughput_gain"] = round(seconds["teacher"] / seconds["cascade"], 2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("train", "evaluate"):
+        command = sub.add_parser(name)
+        command.add_argument("dirs", nargs="+", help="Image directories (unlabeled; the teacher provides targets)")
+        command.add_argument("--config", default=os.environ.get(CONFIG_ENV) or DEFAULT_CONFIG_PATH)
+        command.add_argument("--labels", default=pipeline.LABELS_PATH)
+        command.add_argument("--json", help="Write the report to this file")
+    train_parser = sub.choices["train"]
+    train_parser.add_argument("--teacher-model", default=pipeline.MODEL_PATH)
+    train_parser.add_argument("--student-model", default=STUDENT_KERAS_PATH)
+    train_parser.add_argument("--student-tflite", default=STUDENT_TFLITE_PATH)
+    train_parser.add_argument("--target-agreement", type=float, default=DEFAULT_TARGET_AGREEMENT)
+    train_parser.add_argument("--temperature", type=float, default=TEMPERATURE)
+    train_parser.add_argument("--epochs", type=int, default=15)
+    train_parser.add_argument("--batch-size", type=int, default=64)
+    train_parser.add_argument("--learning-rate", type=float, default=3e-3)
+    train_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = train(args) if args.command == "train" else evaluate(args)
+    print(json.dumps({k: v for k, v in report.items() if k != "disagreements"}, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,493 @@
+"""Sharded batch scoring across machines that share a job directory.
+
+``plan`` writes the input manifest (every image under a directory, or the
+lines of a path list) as fixed-size shards plus manifest.json, which names
+the backend and pins the model version: the content digest of the labels
+and of the file(s) that backend loads. Proxy backends (pool, server,
+registry, cascade) only know their files once loaded, so for them the
+first worker to load a model pins its version in model.json. Workers
+default to the planned backend and refuse a different version. Any
+number of ``work`` processes, on any machine that mounts the job directory,
+then loop:
+
+  claim   create leases/NNNNN.lease with O_CREAT|O_EXCL; exactly one wins.
+  renew   a heartbeat thread touches the lease every ``--heartbeat`` seconds
+          and notices when it was stolen or the shard got committed.
+  steal   a lease untouched for ``--lease-timeout`` seconds belongs to a dead
+          worker: it is renamed away (atomic, one stealer wins) and reclaimed.
+  speculate  once nothing is unclaimed, idle workers run a second copy of
+          shards leased for more than ``--speculate-factor`` x the median
+          shard time (one backup per shard, leases/NNNNN.spec).
+  commit  results go to tmp/, are fsynced and hard-linked to done/NNNNN.jsonl;
+          link() fails if the file exists, so the first finished copy is the
+          only one ever recorded and later copies are discarded.
+
+``merge`` concatenates done/ in shard order into the output with an atomic
+rename, after checking that every shard is there and complete. Crashed
+workers cost at most their in-flight shard. The shared filesystem needs
+atomic O_EXCL, rename and link (local disks, NFSv3+), and clocks within a
+fraction of the lease timeout.
+
+    python distributed_score.py plan SCANS_DIR JOB_DIR [--shard-size 1000]
+    python distributed_score.py work JOB_DIR          # on every node
+    python distributed_score.py merge JOB_DIR -o results.jsonl
+    python distributed_score.py run SCANS_DIR JOB_DIR -o results.jsonl --local-workers 4
+"""
+import argparse
+import errno
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from itertools import takewhile
+
+import pipeline
+from batch_score import iter_image_paths, score
+from metrics import Counter, REGISTRY
+
+MANIFEST_FILE = "manifest.json"
+MODEL_PIN_FILE = "model.json"
+SHARDS_DIR = "shards"
+LEASES_DIR = "leases"
+DONE_DIR = "done"
+TMP_DIR = "tmp"
+DEFAULT_SHARD_SIZE = 1000
+DEFAULT_LEASE_TIMEOUT = 120.0
+DEFAULT_HEARTBEAT = 10.0
+DEFAULT_SPECULATE_FACTOR = 3.0
+# Speculation needs a few finished shards to know what "slow" means
+MIN_SHARDS_FOR_SPECULATION = 3
+POLL_INTERVAL = 2.0
+
+SHARDS = REGISTRY.register(Counter("neuroscan_distributed_shards_total", "Shard attempts by outcome.", ("outcome",)))
+
+
+def shard_name(number):
+    return f"{number:05d}"
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def iter_input(source):
+    """Image paths under a directory, or the non-empty lines of a path-list file."""
+    if os.path.isdir(source):
+        yield from iter_image_paths(source)
+        return
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield line.rstrip("\n")
+
+
+def plan(source, job_dir, shard_size=DEFAULT_SHARD_SIZE, model_path=None, labels_path=pipeline.LABELS_PATH, backend=None):
+    from backends import expected_model_path, resolve_backend_name
+    from result_store import model_version
+    backend = resolve_backend_name(backend)
+    model_path = model_path or expected_model_path(backend)
+    if os.path.exists(os.path.join(job_dir, MANIFEST_FILE)):
+        raise SystemExit(f"{job_dir} is already planned; use a new job directory for a new model or input")
+    for name in (SHARDS_DIR, LEASES_DIR, DONE_DIR, TMP_DIR):
+        os.makedirs(os.path.join(job_dir, name), exist_ok=True)
+    shards, total, chunk = [], 0, []
+
+    def flush_chunk():
+        _write_atomic(os.path.join(job_dir, SHARDS_DIR, shard_name(len(shards)) + ".txt"), "".join(p + "\n" for p in chunk))
+        shards.append(len(chunk))
+
+    for path in iter_input(source):
+        # Absolute paths so every node resolves the same files from its own working directory
+        chunk.append(os.path.abspath(path))
+        total += 1
+        if len(chunk) == shard_size:
+            flush_chunk()
+            chunk = []
+    if chunk:
+        flush_chunk()
+    manifest = {
+        "source": os.path.abspath(source),
+        "images": total,
+        "shard_size": shard_size,
+        "shards": shards,
+        "backend": backend,
+        "model_path": os.path.abspath(model_path) if model_path else None,
+        "labels_path": os.path.abspath(labels_path),
+        # None: the first worker pins it (see _pin_version)
+        "model_version": model_version(model_path, labels_path) if model_path else None,
+        "created_at": time.time(),
+    }
+    # Written last: a manifest means the shard files are complete
+    _write_atomic(os.path.join(job_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+    return manifest
+
+
+class Lease:
+    """An O_EXCL lease file kept fresh by a heartbeat thread until released."""
+
+    def __init__(self, path, done_path, worker_id, speculative=False):
+        self.path = path
+        self.done_path = done_path
+        self.token = f"{worker_id}:{uuid.uuid4().hex}"
+        self.worker_id = worker_id
+        self.speculative = speculative
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({"token": self.token, "worker": self.worker_id, "host": socket.gethostname(), "pid": os.getpid(),
+                       "started_at": time.time(), "speculative": self.speculative}, f)
+        return True
+
+    def held(self):
+        lease = _read_json(self.path)
+        return lease is not None and lease.get("token") == self.token
+
+    def start(self, interval):
+        def beat():
+            while not self._stop.wait(interval):
+                if os.path.exists(self.done_path) or not self.held():
+                    # Committed by the other copy, or stolen: stop work on this shard
+                    self.lost.set()
+                    return
+                try:
+                    os.utime(self.path)
+                except FileNotFoundError:
+                    self.lost.set()
+                    return
+        self._thread = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.held():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class ShardWorker:
+    """One node's claim / score / commit loop over a planned job directory."""
+
+    def __init__(self, job_dir, model, class_names, worker_id=None, lease_timeout=DEFAULT_LEASE_TIMEOUT,
+                 heartbeat=DEFAULT_HEARTBEAT, speculate_factor=DEFAULT_SPECULATE_FACTOR, batch_size=pipeline.BATCH_SIZE,
+                 workers=pipeline.DECODE_WORKERS):
+        self.job_dir = job_dir
+        self.manifest = _read_json(os.path.join(job_dir, MANIFEST_FILE))
+        if self.manifest is None:
+            raise SystemExit(f"No manifest in {job_dir}; run `plan` first")
+        self.model = model
+        self.class_names = class_names
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_timeout = lease_timeout
+        self.heartbeat = heartbeat
+        self.speculate_factor = speculate_factor
+        self.batch_size = batch_size
+        self.workers = workers
+        self.outcomes = {}
+
+    def _path(self, directory, number, suffix):
+        return os.path.join(self.job_dir, directory, shard_name(number) + suffix)
+
+    def _done(self, number):
+        return os.path.exists(self._path(DONE_DIR, number, ".jsonl"))
+
+    def _steal_if_stale(self, lease_path):
+        try:
+            age = time.time() - os.stat(lease_path).st_mtime
+        except FileNotFoundError:
+            return True
+        if age < self.lease_timeout:
+            return False
+        try:
+            # rename() is atomic: of several stealers exactly one moves the stale lease away
+            os.rename(lease_path, f"{lease_path}.stale-{uuid.uuid4().hex}")
+        except FileNotFoundError:
+            return True
+        self._count("stolen")
+        return True
+
+    def _median_shard_seconds(self):
+        times = []
+        for name in os.listdir(os.path.join(self.job_dir, DONE_DIR)):
+            if name.endswith(".meta.json"):
+                meta = _read_json(os.path.join(self.job_dir, DONE_DIR, name))
+                if meta:
+                    times.append(meta["seconds"])
+        return statistics.median(times) if len(times) >= MIN_SHARDS_FOR_SPECULATION else None
+
+    def claim(self):
+        """Next shard to work on as ``(number, Lease)``, or None if nothing can be claimed now."""
+        pending = [n for n in range(len(self.manifest["shards"])) if not self._done(n)]
+        # Primary leases first: unclaimed shards, then shards whose worker stopped heartbeating
+        for number in pending:
+            lease_path = self._path(LEASES_DIR, number, ".lease")
+            if os.path.exists(lease_path) and not self._steal_if_stale(lease_path):
+                continue
+            lease = Lease(lease_path, self._path(DONE_DIR, number, ".jsonl"), self.worker_id)
+            if lease.acquire():
+                return number, lease
+        median = self._median_shard_seconds() if self.speculate_factor else None
+        if median is None:
+            return None
+        now = time.time()
+        for number in pending:
+            primary = _read_json(self._path(LEASES_DIR, number, ".lease"))
+            if primary is None or primary.get("worker") == self.worker_id:
+                continue
+            if now - primary["started_at"] < self.speculate_factor * median:
+                continue
+            spec_path = self._path(LEASES_DIR, number, ".spec")
+            if os.path.exists(spec_path) and not self._steal_if_stale(spec_path):
+                continue
+            lease = Lease(spec_path, self._path(DONE_DIR, number, ".jsonl"), self.worker_id, speculative=True)
+            if lease.acquire():
+                return number, lease
+        return None
+
+    def _count(self, outcome):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        SHARDS.inc(outcome=outcome)
+
+    def process(self, number, lease):
+        """Score one shard and commit it unless another copy got there first; returns the outcome."""
+        lease.start(self.heartbeat)
+        tmp_path = os.path.join(self.job_dir, TMP_DIR, f"{shard_name(number)}.{lease.token.replace(':', '.')}.jsonl")
+        done_path = self._path(DONE_DIR, number, ".jsonl")
+        start = time.perf_counter()
+        try:
+            with open(self._path(SHARDS_DIR, number, ".txt"), encoding="utf-8") as f:
+                paths = [line.rstrip("\n") for line in f]
+            with open(tmp_path, "w", encoding="utf-8") as out:
+                # Stops feeding images once the lease is lost; in-flight batches still finish
+                scored, failed = score(takewhile(lambda _: not lease.lost.is_set(), paths), self.model,
+                                       self.class_names, out, self.batch_size, self.workers)
+                out.flush()
+                os.fsync(out.fileno())
+            if scored + failed < len(paths):
+                outcome = "duplicate" if self._done(number) else "abandoned"
+            else:
+                # A complete copy may commit even if its lease was stolen meanwhile: link() picks one winner
+                try:
+                    os.link(tmp_path, done_path)
+                except FileExistsError:
+                    outcome = "duplicate"
+                except FileNotFoundError:
+                    # merge() already cleaned tmp/: every shard, this one included, is committed
+                    outcome = "duplicate"
+                except OSError as e:
+                    if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+                        raise
+                    raise SystemExit(f"{self.job_dir} is on a filesystem without hard links; exactly-once commit needs them")
+                else:
+                    _fsync_dir(os.path.dirname(done_path))
+                    outcome = "committed"
+                    meta = {"worker": self.worker_id, "seconds": round(time.perf_counter() - start, 3),
+                            "images": len(paths), "speculative": lease.speculative, "committed_at": time.time()}
+                    _write_atomic(self._path(DONE_DIR, number, ".meta.json"), json.dumps(meta))
+        finally:
+            lease.release()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._count(outcome)
+        return outcome
+
+    def run(self, exit_when_idle=False):
+        """Work until every shard is committed (or, with ``exit_when_idle``, until nothing is claimable)."""
+        total = len(self.manifest["shards"])
+        while True:
+            claimed = self.claim()
+            if claimed is not None:
+                number, lease = claimed
+                outcome = self.process(number, lease)
+                print(f"{self.worker_id}: shard {shard_name(number)} {outcome}"
+                      f"{' (speculative)' if lease.speculative else ''}", file=sys.stderr)
+                continue
+            if sum(self._done(n) for n in range(total)) == total or exit_when_idle:
+                return self.outcomes
+            time.sleep(POLL_INTERVAL)
+
+
+def merge(job_dir, output_path):
+    """Concatenate committed shards in order into ``output_path`` (atomic replace)."""
+    manifest = _read_json(os.path.join(job_dir, MANIFEST_FILE))
+    if manifest is None:
+        raise SystemExit(f"No manifest in {job_dir}")
+    missing = [n for n in range(len(manifest["shards"])) if not os.path.exists(os.path.join(job_dir, DONE_DIR, shard_name(n) + ".jsonl"))]
+    if missing:
+        raise SystemExit(f"{len(missing)} of {len(manifest['shards'])} shards not committed yet "
+                         f"(first: {shard_name(missing[0])})")
+    tmp = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    records = 0
+    with open(tmp, "wb") as out:
+        for number, expected in enumerate(manifest["shards"]):
+            with open(os.path.join(job_dir, DONE_DIR, shard_name(number) + ".jsonl"), "rb") as f:
+                data = f.read()
+            lines = data.count(b"\n")
+            if lines != expected or (data and not data.endswith(b"\n")):
+                os.remove(tmp)
+                raise SystemExit(f"shard {shard_name(number)} has {lines} records, expected {expected}")
+            out.write(data)
+            records += lines
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, output_path)
+    _fsync_dir(os.path.dirname(os.path.abspath(output_path)))
+    # Output of crashed or outraced copies, and leases moved away by stealers
+    for directory, keep in ((TMP_DIR, lambda name: False), (LEASES_DIR, lambda name: ".stale-" not in name)):
+        for name in os.listdir(os.path.join(job_dir, directory)):
+            if not keep(name):
+                try:
+                    os.remove(os.path.join(job_dir, directory, name))
+                except FileNotFoundError:
+                    pass
+    return records
+
+
+def _pin_version(job_dir, manifest, version, worker_id):
+    """The job's model version: the planned one, else whichever a worker published first."""
+    if manifest.get("model_version"):
+        return manifest["model_version"]
+    path = os.path.join(job_dir, MODEL_PIN_FILE)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    _write_atomic(tmp, json.dumps({"model_version": version, "worker": worker_id, "pinned_at": time.time()}))
+    try:
+        # link() publishes the complete file or fails if another worker pinned first
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    return _read_json(path)["model_version"]
+
+
+def _load_worker_model(args, manifest):
+    from result_store import model_version
+    backend = args.backend or manifest.get("backend")
+    model, class_names = pipeline.load_model_and_labels(args.model, args.labels, backend)
+    model_path = getattr(model, "model_path", None)
+    version = model_version(model_path, args.labels) if model_path else None
+    if args.ignore_version:
+        return model, class_names
+    pinned = _pin_version(args.job_dir, manifest, version, args.worker_id or f"{socket.gethostname()}-{os.getpid()}")
+    if version != pinned:
+        raise SystemExit(f"{model.name} model version {version} does not match the job's {pinned} "
+                         f"({manifest.get('backend')} backend); plan a new job or pass --ignore-version")
+    return model, class_names
+
+
+def _add_worker_arguments(parser):
+    parser.add_argument("--worker-id", help="Defaults to HOSTNAME-PID")
+    parser.add_argument("--backend", help="Inference backend; defaults to the planned one")
+    parser.add_argument("--model", help="Model file for the chosen backend")
+    parser.add_argument("--labels", default=pipeline.LABELS_PATH)
+    parser.add_argument("--ignore-version", action="store_true", help="Score even if the model differs from the planned one")
+    parser.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT)
+    parser.add_argument("--heartbeat", type=float, default=DEFAULT_HEARTBEAT)
+    parser.add_argument("--speculate-factor", type=float, default=DEFAULT_SPECULATE_FACTOR,
+                        help="Back up shards running this many times the median shard time (0 disables)")
+    parser.add_argument("--batch-size", type=int, default=pipeline.BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=pipeline.DECODE_WORKERS, help="Decode threads")
+
+
+def _worker_argv(args):
+    argv = ["--labels", args.labels, "--lease-timeout", str(args.lease_timeout), "--heartbeat", str(args.heartbeat),
+            "--speculate-factor", str(args.speculate_factor), "--batch-size", str(args.batch_size), "--workers", str(args.workers)]
+    for flag, value in (("--backend", args.backend), ("--model", args.model)):
+        if value:
+            argv += [flag, value]
+    return argv + (["--ignore-version"] if args.ignore_version else [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    plan_parser = sub.add_parser("plan", help="Split the input into shards")
+    run_parser = sub.add_parser("run", help="plan (if needed), start local workers, wait and merge")
+    for command in (plan_parser, run_parser):
+        command.add_argument("source", help="Directory tree of images, or a file listing one image path per line")
+        command.add_argument("job_dir")
+        command.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    plan_parser.add_argument("--backend", help="Backend the workers run; defaults to $NEUROSCAN_BACKEND or keras")
+    plan_parser.add_argument("--model", help="Model file the workers must load (default: the backend's)")
+    plan_parser.add_argument("--labels", default=pipeline.LABELS_PATH)
+    work_parser = sub.add_parser("work", help="Claim and score shards until the job is done")
+    work_parser.add_argument("job_dir")
+    for command in (work_parser, run_parser):
+        _add_worker_arguments(command)
+    run_parser.add_argument("--local-workers", type=int, default=2, help="Worker processes standing in for nodes")
+    run_parser.add_argument("-o", "--output", required=True)
+    merge_parser = sub.add_parser("merge", help="Write the committed shards to one JSONL file")
+    merge_parser.add_argument("job_dir")
+    merge_parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "plan":
+        manifest = plan(args.source, args.job_dir, args.shard_size, args.model, args.labels, args.backend)
+        print(f"planned {manifest['images']} images in {len(manifest['shards'])} shards", file=sys.stderr)
+    elif args.command == "work":
+        manifest = _read_json(os.path.join(args.job_dir, MANIFEST_FILE))
+        if manifest is None:
+            raise SystemExit(f"No manifest in {args.job_dir}; run `plan` first")
+        model, class_names = _load_worker_model(args, manifest)
+        worker = ShardWorker(args.job_dir, model, class_names, args.worker_id, args.lease_timeout, args.heartbeat,
+                             args.speculate_factor, args.batch_size, args.workers)
+        print(json.dumps({"worker": worker.worker_id, **worker.run()}), file=sys.stderr)
+    elif args.command == "run":
+        if not os.path.exists(os.path.join(args.job_dir, MANIFEST_FILE)):
+            manifest = plan(args.source, args.job_dir, args.shard_size, args.model, args.labels, args.backend)
+            print(f"planned {manifest['images']} images in {len(manifest['shards'])} shards", file=sys.stderr)
+        start = time.perf_counter()
+        processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "work", args.job_dir,
+                                       "--worker-id", f"local-{i}", *_worker_argv(args)])
+                     for i in range(args.local_workers)]
+        failed = [p.args for p in processes if p.wait() != 0]
+        if failed:
+            print(f"{len(failed)} local workers exited with an error", file=sys.stderr)
+        records = merge(args.job_dir, args.output)
+        elapsed = time.perf_counter() - start
+        print(f"merged {records} records into {args.output} in {elapsed:.1f}s", file=sys.stderr)
+    else:
+        records = merge(args.job_dir, args.output)
+        print(f"merged {records} records into {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""On-disk index of penultimate-layer embeddings for "similar previous scans".
+
+Vectors are the 100-d output of the model's penultimate dense layer, taken
+from the same forward pass as the classification (KerasBackend /
+CompiledEngine ``predict_with_embeddings``), L2-normalized and appended as
+float16 rows to a flat file that is memory-mapped for search. Each row has a
+fixed-size record with the image digest, verdict, confidence and time.
+
+Search is an exact, chunked matrix product by default. ``partition`` trains
+a spherical k-means coarse quantizer (IVF); queries then scan only the
+``nprobe`` closest lists. Rows appended after partitioning are assigned to
+their nearest centroid as they arrive.
+
+Each model version gets its own subdirectory, since embeddings from
+different weights are not comparable.
+
+    NEUROSCAN_EMBEDDING_INDEX=embeddings   index directory ("off" disables it)
+
+Usage:
+    python embeddings.py build IMAGE_DIR [IMAGE_DIR ...]
+    python embeddings.py partition [--nlist 1024]
+    python embeddings.py query IMAGE [--k 5] [--nprobe 16]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import pipeline
+
+INDEX_ENV = "NEUROSCAN_EMBEDDING_INDEX"
+DEFAULT_INDEX_DIR = "embeddings"
+VECTORS_FILE = "vectors.f16"
+RECORDS_FILE = "records.bin"
+LISTS_FILE = "lists.i4"
+CENTROIDS_FILE = "centroids.npy"
+META_FILE = "index.json"
+# Raw digest bytes; "S32" would strip trailing NUL bytes on read
+RECORD_DTYPE = np.dtype([("digest", "V32"), ("class_index", "<i2"), ("confidence", "<f4"), ("time", "<f8")])
+SEARCH_CHUNK_ROWS = 65536
+DEFAULT_NPROBE = 16
+KMEANS_SAMPLE = 65536
+KMEANS_ITERATIONS = 12
+# Appended rows not yet in the inverted lists are scanned exhaustively; past this many the lists are rebuilt
+MAX_UNLISTED = 4096
+
+Match = namedtuple("Match", ["row", "score", "digest", "class_index", "confidence", "time"])
+
+
+def normalize_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def spherical_kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Unit-norm centroids maximizing cosine similarity to ``vectors`` (already normalized)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty lists from random points so every centroid stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Append-only float16 vector file plus records, searched through read-only memory maps."""
+
+    def __init__(self, directory, dim=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._path = lambda name: os.path.join(directory, name)
+        self._lock = threading.Lock()
+        meta = {}
+        if os.path.exists(self._path(META_FILE)):
+            with open(self._path(META_FILE)) as f:
+                meta = json.load(f)
+        self.dim = meta.get("dim", dim)
+        if dim is not None and self.dim != dim:
+            raise ValueError(f"{directory} holds {self.dim}-d vectors, not {dim}-d")
+        self.centroids = np.load(self._path(CENTROIDS_FILE)) if os.path.exists(self._path(CENTROIDS_FILE)) else None
+        self._repair()
+        self._remap()
+        self._build_lists()
+
+    def _repair(self):
+        # A crash between the two appends leaves one file longer; trim both to the rows they share
+        if self.dim is None:
+            self.count = 0
+            return
+        row_bytes = self.dim * 2
+        files = [(VECTORS_FILE, row_bytes), (RECORDS_FILE, RECORD_DTYPE.itemsize)]
+        if self.centroids is not None:
+            files.append((LISTS_FILE, 4))
+        sizes = [os.path.getsize(self._path(name)) // size if os.path.exists(self._path(name)) else 0 for name, size in files]
+        self.count = min(sizes)
+        for (name, size), rows in zip(files, sizes):
+            if rows != self.count:
+                with open(self._path(name), "r+b") as f:
+                    f.truncate(self.count * size)
+
+    def _remap(self):
+        if self.count:
+            self.vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float16, mode="r", shape=(self.count, self.dim))
+            self.records = np.memmap(self._path(RECORDS_FILE), dtype=RECORD_DTYPE, mode="r", shape=(self.count,))
+            if self.centroids is not None:
+                self.assignment = np.memmap(self._path(LISTS_FILE), dtype=np.int32, mode="r", shape=(self.count,))
+        else:
+            self.vectors = np.zeros((0, self.dim or 0), dtype=np.float16)
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+            self.assignment = np.zeros(0, dtype=np.int32)
+
+    def _build_lists(self):
+        # Inverted lists as one row-order array plus per-list offsets
+        if self.centroids is None:
+            self._listed = 0
+            return
+        assignment = np.asarray(self.assignment)
+        self._list_rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        self._list_offsets = np.searchsorted(assignment[self._list_rows], np.arange(len(self.centroids) + 1))
+        self._listed = len(assignment)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, embeddings, digests, class_indices, confidences):
+        """Add rows; ``digests`` are hex SHA-256 strings (see prediction_cache.data_digest)."""
+        vectors = normalize_rows(embeddings)
+        records = np.zeros(len(vectors), dtype=RECORD_DTYPE)
+        records["digest"] = [bytes.fromhex(digest) for digest in digests]
+        records["class_index"] = class_indices
+        records["confidence"] = confidences
+        records["time"] = time.time()
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-d embeddings, got {vectors.shape[1]}-d")
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.write(vectors.astype(np.float16).tobytes())
+            if self.centroids is not None:
+                with open(self._path(LISTS_FILE), "ab") as f:
+                    f.write((vectors @ self.centroids.T).argmax(axis=1).astype(np.int32).tobytes())
+            # Records last: a row only counts once its record is on disk
+            with open(self._path(RECORDS_FILE), "ab") as f:
+                f.write(records.tobytes())
+            self.count += len(vectors)
+            self._remap()
+            if self.centroids is not None and self.count - self._listed > MAX_UNLISTED:
+                self._build_lists()
+
+    def _write_meta(self):
+        meta = {"dim": self.dim, "nlist": None if self.centroids is None else len(self.centroids)}
+        with open(self._path(META_FILE) + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(self._path(META_FILE) + ".tmp", self._path(META_FILE))
+
+    def partition(self, nlist=None, sample=KMEANS_SAMPLE, seed=0):
+        """Train the coarse quantizer on a sample and assign every row to a list."""
+        with self._lock:
+            if not self.count:
+                raise ValueError("Cannot partition an empty index")
+            nlist = min(nlist or max(1, int(4 * np.sqrt(self.count))), self.count)
+            rng = np.random.default_rng(seed)
+            rows = np.sort(rng.choice(self.count, min(sample, self.count), replace=False))
+            centroids = spherical_kmeans(np.asarray(self.vectors[rows], dtype=np.float32), nlist, seed=seed)
+            with open(self._path(LISTS_FILE) + ".tmp", "wb") as f:
+                for start in range(0, self.count, SEARCH_CHUNK_ROWS):
+                    chunk = np.asarray(self.vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+                    f.write((chunk @ centroids.T).argmax(axis=1).astype(np.int32).tobytes())
+            os.replace(self._path(LISTS_FILE) + ".tmp", self._path(LISTS_FILE))
+            np.save(self._path(CENTROIDS_FILE), centroids)
+            self.centroids = centroids
+            self._write_meta()
+            self._remap()
+            self._build_lists()
+
+    def _candidates(self, query, nprobe):
+        closest = np.argsort(self.centroids @ query)[::-1][:nprobe]
+        rows = [self._list_rows[self._list_offsets[c]:self._list_offsets[c + 1]] for c in closest]
+        rows.append(np.arange(self._listed, self.count))
+        return np.sort(np.concatenate(rows))
+
+    def search(self, query, k=10, nprobe=None, exclude_digest=None):
+        """Top ``k`` matches by cosine similarity, best first.
+
+        ``nprobe=0`` forces an exhaustive scan; otherwise a partitioned index
+        scans ``nprobe`` lists (DEFAULT_NPROBE when None).
+        """
+        with self._lock:
+            vectors, records, count = self.vectors, self.records, self.count
+            probe = self.centroids is not None and nprobe != 0
+            candidates = self._candidates(normalize_rows(query)[0], nprobe or DEFAULT_NPROBE) if probe else None
+        if not count:
+            return []
+        query = normalize_rows(query)[0]
+        wanted = k + (exclude_digest is not None)
+        if candidates is not None:
+            rows = candidates
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+        else:
+            rows, scores = [], []
+            for start in range(0, count, SEARCH_CHUNK_ROWS):
+                chunk = np.asarray(vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32) @ query
+                # Keep only each chunk's best rows so memory does not grow with the index
+                top = np.argpartition(chunk, -wanted)[-wanted:] if len(chunk) > wanted else np.arange(len(chunk))
+                rows.append(top + start)
+                scores.append(chunk[top])
+            rows, scores = np.concatenate(rows), np.concatenate(scores)
+        order = np.argsort(scores)[::-1]
+        excluded = bytes.fromhex(exclude_digest) if exclude_digest is not None else None
+        matches = []
+        for i in order:
+            record = records[rows[i]]
+            digest = bytes(record["digest"])
+            if digest == excluded:
+                continue
+            matches.append(Match(int(rows[i]), float(scores[i]), digest.hex(), int(record["class_index"]),
+                                 float(record["confidence"]), float(record["time"])))
+            if len(matches) == k:
+                break
+        return matches
+
+    def vector_for(self, digest):
+        """Most recent stored embedding for ``digest``, or None."""
+        with self._lock:
+            vectors, records = self.vectors, self.records
+        # One vectorized pass over the mapped digests (a few ms per million rows); the last match wins
+        rows = np.flatnonzero(records["digest"] == np.void(bytes.fromhex(digest)))
+        return np.asarray(vectors[rows[-1]], dtype=np.float32) if len(rows) else None
+
+
+def open_index_from_env(version):
+    """Index for ``version`` (see result_store.model_version), or None when disabled."""
+    directory = os.environ.get(INDEX_ENV, DEFAULT_INDEX_DIR)
+    if directory.lower() in ("off", "0", "false"):
+        return None
+    try:
+        return EmbeddingIndex(os.path.join(directory, version[:16]))
+    except (OSError, ValueError) as e:
+        print(f"embedding index disabled: {e}", file=sys.stderr)
+        return None
+
+
+def main(argv=None):
+    from prediction_cache import data_digest
+    from result_store import model_version
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Score image directories and append their embeddings")
+    build.add_argument("dirs", nargs="+")
+    partition = sub.add_parser("partition", help="Train the IVF coarse quantizer")
+    partition.add_argument("--nlist", type=int)
+    query = sub.add_parser("query", help="Nearest stored scans for one image")
+    query.add_argument("image")
+    query.add_argument("--k", type=int, default=5)
+    query.add_argument("--nprobe", type=int)
+    parser.add_argument("--model", default=pipeline.MODEL_PATH)
+    parser.add_argument("--labels", default=pipeline.LABELS_PATH)
+    parser.add_argument("--index", help=f"Index directory (default: ${INDEX_ENV}/<model version>)")
+    args = parser.parse_args(argv)
+
+    version = model_version(args.model, args.labels)
+    directory = args.index or os.path.join(os.environ.get(INDEX_ENV, DEFAULT_INDEX_DIR), version[:16])
+    index = EmbeddingIndex(directory)
+    if args.command == "partition":
+        start = time.perf_counter()
+        index.partition(args.nlist)
+        print(f"{len(index.centroids)} lists over {len(index)} vectors in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        return 0
+
+    from backends import KerasBackend
+    from batch_score import iter_image_paths
+    model = KerasBackend(args.model)
+    class_names = pipeline.read_labels(args.labels)
+    if args.command == "query":
+        with open(args.image, "rb") as f:
+            data = f.read()
+        probabilities, embeddings = model.predict_with_embeddings(pipeline.preprocess_bytes(data)[None])
+        print(json.dumps({
+            "class": class_names[int(probabilities[0].argmax())],
+            "matches": [dict(m._asdict(), verdict=class_names[m.class_index]) for m in
+                        index.search(embeddings[0], args.k, args.nprobe, exclude_digest=data_digest(data))],
+        }, indent=2))
+        return 0
+
+    def decode(path, out):
+        with open(path, "rb") as f:
+            data = f.read()
+        pipeline.preprocess_bytes(data, out)
+        digests[path] = data_digest(data)
+
+    digests = {}
+    added = 0
+    paths = (path for directory in args.dirs for path in iter_image_paths(directory))
+    for ok, batch, _ in pipeline.iter_batches(paths, decode):
+        if batch is None:
+            continue
+        probabilities, embeddings = model.predict_with_embeddings(batch)
+        index.append(embeddings, [digests.pop(path) for path in ok], probabilities.argmax(axis=1), probabilities.max(axis=1))
+        added += len(ok)
+    print(f"added {added} vectors; {len(index)} in {directory}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Grad-CAM heatmaps computed off the request path and cached by image hash.
+
+``GradCamExplainer`` splits the Keras model after its last convolutional
+feature map (``out_relu`` of the MobileNetV2 base in keras_model.h5) and
+gets the class probabilities, the feature map and its gradient from one
+traced forward/backward pass. ``GradCamService`` runs it on a single
+background thread and keeps a small LRU of finished maps, so the app can
+show the class first and fill the heatmap in when it is ready. By default
+heatmaps are shown only when the serving backend has a Keras model to
+explain (Keras, or a registry whose active version is Keras), so they
+always come from the model that gave the verdict. ``NEUROSCAN_GRADCAM=0``
+disables them; ``NEUROSCAN_GRADCAM=1`` also explains TFLite, ONNX and
+proxy backends through keras_model.h5.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import pipeline
+from inference_engine import flatten_layers
+
+GRADCAM_ENV = "NEUROSCAN_GRADCAM"
+CACHE_ENTRIES = 256
+OVERLAY_ALPHA = 0.45
+
+
+def serving_keras_model(backend):
+    """The Keras model behind ``backend``'s verdicts, or None when it serves something else."""
+    registry = getattr(backend, "registry", None)
+    if registry is not None:
+        backend = registry.active.load()
+    model = getattr(backend, "model", None)
+    return model if hasattr(model, "layers") else None
+
+
+def gradcam_enabled(backend):
+    setting = os.environ.get(GRADCAM_ENV)
+    if setting is not None:
+        return setting.lower() not in ("0", "false", "no")
+    # Unset: only where no second model (and no TensorFlow import) is needed
+    return serving_keras_model(backend) is not None
+
+
+def split_at_last_feature_map(model):
+    """``(feature_layers, head_layers)`` split after the last layer with a 4D output."""
+    layers = flatten_layers(model)
+    split = max((i for i, layer in enumerate(layers) if len(layer.output_shape) == 4), default=None)
+    if split is None:
+        raise ValueError("Model has no convolutional feature map to explain")
+    return layers[:split + 1], layers[split + 1:]
+
+
+class GradCamExplainer:
+    def __init__(self, model):
+        import tensorflow as tf
+        features, head = split_at_last_feature_map(model)
+
+        def apply(layers, x):
+            for layer in layers:
+                x = layer(x, training=False)
+            return x
+
+        spec = tf.TensorSpec((1, *pipeline.IMAGE_SIZE[::-1], 3), tf.float32)
+
+        @tf.function(input_signature=[spec, tf.TensorSpec((), tf.int32)])
+        def explain(x, class_index):
+            with tf.GradientTape() as tape:
+                feature_map = apply(features, x)
+                tape.watch(feature_map)
+                probabilities = apply(head, feature_map)[0]
+                class_index = tf.cond(class_index < 0, lambda: tf.argmax(probabilities, output_type=tf.int32),
+                                      lambda: class_index)
+                score = probabilities[class_index]
+            gradients = tape.gradient(score, feature_map)
+            weights = tf.reduce_mean(gradients, axis=(1, 2), keepdims=True)
+            cam = tf.nn.relu(tf.reduce_sum(feature_map * weights, axis=-1))[0]
+            return probabilities, cam
+
+        self._explain = explain
+
+    def explain(self, data, class_index=None):
+        """``(probabilities, cam)`` for one preprocessed ``(1, 224, 224, 3)`` input; ``cam`` is in [0, 1]."""
+        probabilities, cam = self._explain(np.asarray(data, dtype=np.float32), -1 if class_index is None else int(class_index))
+        cam = cam.numpy()
+        peak = cam.max()
+        return probabilities.numpy(), cam / peak if peak > 0 else cam
+
+
+def _jet(values):
+    # Piecewise-linear approximation of the jet colormap, values in [0, 1]
+    r = np.clip(1.5 - np.abs(4 * values - 3), 0, 1)
+    g = np.clip(1.5 - np.abs(4 * values - 2), 0, 1)
+    b = np.clip(1.5 - np.abs(4 * values - 1), 0, 1)
+    return np.stack([r, g, b], axis=-1)
+
+
+def overlay(fitted, cam, alpha=OVERLAY_ALPHA):
+    """Blend ``cam`` (any size, [0, 1]) over ``fitted``, the RGB model-input image from ``pipeline.fit_image``."""
+    base = np.asarray(fitted, dtype=np.float32) / 255.0
+    heat = Image.fromarray(cam.astype(np.float32), "F").resize(pipeline.IMAGE_SIZE, Image.Resampling.BICUBIC)
+    heat = np.clip(np.asarray(heat), 0, 1)
+    # Weight the colour by intensity so cold regions keep the original scan visible
+    weight = alpha * heat[..., None]
+    blended = base * (1 - weight) + _jet(heat) * weight
+    return Image.fromarray((blended * 255).astype(np.uint8), "RGB")
+
+
+class GradCamService:
+    """Background Grad-CAM with an LRU of PNG overlays keyed by ``(image digest, model identity, class)``."""
+
+    def __init__(self, model_factory, max_entries=CACHE_ENTRIES):
+        self._model_factory = model_factory
+        self._explainer = self._explained_model = None
+        self._explainer_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gradcam")
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pending = {}
+        self.max_entries = max_entries
+
+    def _get_explainer(self):
+        with self._explainer_lock:
+            # The factory may return a different model after a registry swap
+            model = self._model_factory()
+            if model is not self._explained_model:
+                self._explainer, self._explained_model = GradCamExplainer(model), model
+            return self._explainer
+
+    def cached(self, key):
+        with self._cache_lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+            return png
+
+    def _compute(self, key, image_bytes, class_index):
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                fitted = pipeline.fit_image(image)
+            data = pipeline.normalize(np.asarray(fitted))[None]
+            _, cam = self._get_explainer().explain(data, class_index)
+            buffer = io.BytesIO()
+            overlay(fitted, cam).save(buffer, format="PNG")
+            png = buffer.getvalue()
+            with self._cache_lock:
+                self._cache[key] = png
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            return png
+        finally:
+            with self._cache_lock:
+                self._pending.pop(key, None)
+
+    def submit(self, key, image_bytes, class_index):
+        """Future of the PNG overlay; repeat requests for a key share one computation."""
+        with self._cache_lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = self._executor.submit(self._compute, key, image_bytes, class_index)
+            return future
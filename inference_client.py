@@ -0,0 +1,165 @@
+"""Client side of the local inference server (see inference_server.py).
+
+Wire format, one request/response at a time per connection:
+
+    request  = op:u8, request_id:u64, count:u32, count*224*224*3 float32 (op=PREDICT)
+    response = status:u8, request_id:u64, length:u32, payload
+               payload = count*num_classes float32 (STATUS_OK) or UTF-8 text
+
+``op=INFO`` has no payload and returns the server's JSON description.
+"""
+import itertools
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+import pipeline
+from backends import DEFAULT_BACKEND, create_backend
+
+SERVER_ENV = "NEUROSCAN_INFERENCE_SERVER"
+FALLBACK_BACKEND_ENV = "NEUROSCAN_FALLBACK_BACKEND"
+DEFAULT_TIMEOUT = 30.0
+RETRY_AFTER = 30.0
+
+OP_PREDICT = 0
+OP_INFO = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+REQUEST_HEADER = struct.Struct("!BQI")
+RESPONSE_HEADER = struct.Struct("!BQI")
+INPUT_SHAPE = (*pipeline.IMAGE_SIZE[::-1], 3)
+
+
+def parse_address(address):
+    """``unix:/path.sock`` or ``host:port`` -> (family, sockaddr)."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError("inference server closed the connection")
+        received += n
+    return buffer
+
+
+class InferenceClient:
+    """Blocking client; each thread gets its own connection."""
+
+    def __init__(self, address, timeout=DEFAULT_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._family, self._sockaddr = parse_address(address)
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+
+    def _socket(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(self._family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self._sockaddr)
+            if self._family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.sock = sock
+        return sock
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _call(self, op, count=0, payload=b""):
+        request_id = next(self._ids)
+        sock = self._socket()
+        try:
+            sock.sendall(REQUEST_HEADER.pack(op, request_id, count))
+            if payload:
+                sock.sendall(payload)
+            status, response_id, length = RESPONSE_HEADER.unpack(recv_exactly(sock, RESPONSE_HEADER.size))
+            body = recv_exactly(sock, length)
+        except OSError:
+            self.close()
+            raise
+        if response_id != request_id:
+            self.close()
+            raise ConnectionError(f"response id {response_id} does not match request {request_id}")
+        if status != STATUS_OK:
+            raise RuntimeError(f"inference server error: {body.decode('utf-8', 'replace')}")
+        return body
+
+    def info(self):
+        return json.loads(self._call(OP_INFO).decode("utf-8"))
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        body = self._call(OP_PREDICT, len(batch), memoryview(batch).cast("B"))
+        return np.frombuffer(body, dtype=np.float32).reshape(len(batch), -1)
+
+
+class ServerBackend:
+    """Backend that forwards to the inference server and falls back to in-process inference.
+
+    While the server is unreachable, requests go to a local backend
+    (``NEUROSCAN_FALLBACK_BACKEND``, default keras) created on first need;
+    the server is retried every ``retry_after`` seconds.
+    """
+
+    name = "server"
+
+    @staticmethod
+    def import_runtime():
+        return None
+
+    def __init__(self, address=None, fallback_backend=None, model_path=None, retry_after=RETRY_AFTER, timeout=DEFAULT_TIMEOUT):
+        self.address = address or os.environ.get(SERVER_ENV)
+        if not self.address:
+            raise ValueError(f"Set {SERVER_ENV} (unix:/path.sock or host:port) to use the server backend")
+        self.fallback_backend = fallback_backend or os.environ.get(FALLBACK_BACKEND_ENV) or DEFAULT_BACKEND
+        self.fallback_model_path = model_path
+        self.retry_after = retry_after
+        self.client = InferenceClient(self.address, timeout)
+        self._local = None
+        self._local_lock = threading.Lock()
+        self._down_until = 0.0
+        try:
+            self.model_path = self.client.info()["model_path"]
+        except OSError as e:
+            self._mark_down(e)
+            self.model_path = self._local_backend().model_path
+
+    def _mark_down(self, error):
+        self._down_until = time.monotonic() + self.retry_after
+        print(f"inference server {self.address} unavailable ({error}); using in-process inference", file=sys.stderr)
+
+    def _local_backend(self):
+        with self._local_lock:
+            if self._local is None:
+                self._local = create_backend(self.fallback_backend, self.fallback_model_path)
+            return self._local
+
+    @property
+    def using_server(self):
+        return time.monotonic() >= self._down_until
+
+    def predict(self, batch):
+        if self.using_server:
+            try:
+                return self.client.predict(batch)
+            except OSError as e:
+                self._mark_down(e)
+        return self._local_backend().predict(batch)
@@ -0,0 +1,99 @@
+"""Low-overhead Keras inference through pre-traced, fixed-shape tf.functions.
+
+``model.predict`` builds a data adapter, callbacks and a progress bar on every
+call, which costs more than the forward pass itself for a single image.
+CompiledEngine traces one concrete function per batch-size bucket up front
+and pads inputs to the nearest bucket, so calls never retrace. For plain
+layer chains (the Teachable Machine Sequential) the same traced pass can also
+return the penultimate layer's output, see ``predict_with_embeddings``.
+"""
+import os
+
+import numpy as np
+
+import pipeline
+
+XLA_ENV = "NEUROSCAN_XLA"
+BATCH_BUCKETS = (1, 8, pipeline.BATCH_SIZE)
+
+
+def xla_enabled():
+    return os.environ.get(XLA_ENV, "0").lower() in ("1", "true", "yes")
+
+
+def flatten_layers(model):
+    """The layers of ``model`` with nested Sequential wrappers expanded; other sub-models stay whole."""
+    import tensorflow as tf
+    flat = []
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Sequential):
+            flat.extend(flatten_layers(layer))
+        else:
+            flat.append(layer)
+    return flat
+
+
+def _apply(layers, x):
+    for layer in layers:
+        x = layer(x, training=False)
+    return x
+
+
+class CompiledEngine:
+    def __init__(self, model, batch_buckets=BATCH_BUCKETS, jit_compile=None):
+        import tensorflow as tf
+        self.model = model
+        self.jit_compile = xla_enabled() if jit_compile is None else jit_compile
+        self.batch_buckets = tuple(sorted(batch_buckets))
+        input_shape = tuple(model.input_shape[1:])
+        # Only a Sequential model is a chain whose penultimate output is well defined
+        self.embeddings = isinstance(model, tf.keras.Sequential)
+        if self.embeddings:
+            layers = flatten_layers(model)
+            def forward(x):
+                embedding = _apply(layers[:-1], x)
+                return layers[-1](embedding, training=False), embedding
+        else:
+            def forward(x):
+                return model(x, training=False)
+        function = tf.function(forward, jit_compile=self.jit_compile)
+        self._functions = {
+            size: function.get_concrete_function(tf.TensorSpec((size, *input_shape), tf.float32))
+            for size in self.batch_buckets
+        }
+        self._convert = tf.convert_to_tensor
+
+    def _bucket(self, count):
+        for size in self.batch_buckets:
+            if count <= size:
+                return size
+        return self.batch_buckets[-1]
+
+    def _run(self, batch):
+        count = len(batch)
+        size = self._bucket(count)
+        if count < size:
+            padded = np.zeros((size, *batch.shape[1:]), dtype=np.float32)
+            padded[:count] = batch
+            batch = padded
+        outputs = self._functions[size](self._convert(batch))
+        if not self.embeddings:
+            outputs = (outputs,)
+        return tuple(output.numpy()[:count] for output in outputs)
+
+    def _run_all(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        largest = self.batch_buckets[-1]
+        if len(batch) <= largest:
+            return self._run(batch)
+        chunks = [self._run(batch[i:i + largest]) for i in range(0, len(batch), largest)]
+        return tuple(np.concatenate(parts) for parts in zip(*chunks))
+
+    def predict(self, batch):
+        return self._run_all(batch)[0]
+
+    def predict_with_embeddings(self, batch):
+        """``(probabilities, embeddings)`` from one pass; embeddings are the penultimate layer's output."""
+        if not self.embeddings:
+            raise NotImplementedError("Embeddings need a Sequential model")
+        return self._run_all(batch)
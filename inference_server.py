@@ -0,0 +1,218 @@
+"""Local inference server with dynamic micro-batching.
+
+One process owns the model; Streamlit sessions (and batch tools) connect over
+a Unix socket or localhost TCP with NEUROSCAN_BACKEND=server and
+NEUROSCAN_INFERENCE_SERVER=unix:/path.sock (or host:port). Concurrent requests
+are gathered into one forward pass, capped by --max-batch-size and
+--max-wait-ms. See inference_client.py for the wire format.
+
+Usage:
+    python inference_server.py --socket /tmp/neuroscan.sock [--backend tflite] [--max-batch-size 32] [--max-wait-ms 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from backends import create_backend
+from inference_client import (INPUT_SHAPE, OP_INFO, OP_PREDICT, REQUEST_HEADER, RESPONSE_HEADER, STATUS_ERROR,
+                              STATUS_OK)
+from inference_engine import BATCH_BUCKETS
+from metrics import Counter, Histogram, REGISTRY, start_exporters_from_env
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+MAX_REQUEST_IMAGES = 256
+INPUT_BYTES_PER_IMAGE = int(np.prod(INPUT_SHAPE)) * 4
+
+BATCH_IMAGES = REGISTRY.register(Histogram("neuroscan_server_batch_images", "Images per server forward pass.",
+                                           buckets=(1, 2, 4, 8, 16, 32, 64, 128)))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram("neuroscan_server_queue_wait_seconds", "Time requests wait to join a batch."))
+SERVER_REQUESTS = REGISTRY.register(Counter("neuroscan_server_requests_total", "Requests handled by the inference server.", ("status",)))
+
+
+def padded_size(count):
+    # Pad to the same buckets as the compiled engine so TFLite/ONNX never reshape either
+    for size in BATCH_BUCKETS:
+        if count <= size:
+            return size
+    return count
+
+
+class MicroBatcher:
+    """Gathers queued requests into batches of at most ``max_batch_size`` images.
+
+    A batch is dispatched as soon as it is full or ``max_wait_ms`` after its
+    first request arrived. The forward pass runs on a single executor thread
+    while the event loop keeps accepting and queueing the next batch.
+    """
+
+    def __init__(self, backend, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self._carry = None
+
+    async def submit(self, inputs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self.queue.put((inputs, future, loop.time()))
+        return await future
+
+    async def _next_request(self, timeout=None):
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        if timeout is None:
+            return await self.queue.get()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def _gather(self):
+        loop = asyncio.get_running_loop()
+        first = await self._next_request()
+        requests, count = [first], len(first[0])
+        deadline = loop.time() + self.max_wait
+        while count < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await self._next_request(remaining)
+            except asyncio.TimeoutError:
+                break
+            if count + len(item[0]) > self.max_batch_size:
+                self._carry = item
+                break
+            requests.append(item)
+            count += len(item[0])
+        return requests, count
+
+    def _predict(self, batch, count):
+        size = padded_size(count)
+        if size > count:
+            padded = np.zeros((size, *batch.shape[1:]), dtype=np.float32)
+            padded[:count] = batch
+            batch = padded
+        return self.backend.predict(batch)[:count]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests, count = await self._gather()
+            now = loop.time()
+            for _, _, queued_at in requests:
+                QUEUE_WAIT_SECONDS.observe(now - queued_at)
+            BATCH_IMAGES.observe(count)
+            batch = requests[0][0] if len(requests) == 1 else np.concatenate([r[0] for r in requests])
+            try:
+                probabilities = await loop.run_in_executor(self._executor, self._predict, batch, count)
+            except Exception as e:
+                for _, future, _ in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            offset = 0
+            for inputs, future, _ in requests:
+                if not future.done():
+                    future.set_result(probabilities[offset:offset + len(inputs)])
+                offset += len(inputs)
+
+
+class InferenceServer:
+    def __init__(self, backend, batcher):
+        self.backend = backend
+        self.batcher = batcher
+
+    def info(self):
+        return {
+            "backend": self.backend.name,
+            "model_path": self.backend.model_path,
+            "max_batch_size": self.batcher.max_batch_size,
+            "max_wait_ms": self.batcher.max_wait * 1000,
+            "pid": os.getpid(),
+        }
+
+    async def _respond(self, writer, status, request_id, payload):
+        writer.write(RESPONSE_HEADER.pack(status, request_id, len(payload)))
+        writer.write(payload)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(REQUEST_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    return
+                op, request_id, count = REQUEST_HEADER.unpack(header)
+                if op == OP_INFO:
+                    await self._respond(writer, STATUS_OK, request_id, json.dumps(self.info()).encode("utf-8"))
+                    continue
+                if op != OP_PREDICT or not 0 < count <= MAX_REQUEST_IMAGES:
+                    SERVER_REQUESTS.inc(status="rejected")
+                    await self._respond(writer, STATUS_ERROR, request_id, f"bad request op={op} count={count}".encode())
+                    return
+                payload = await reader.readexactly(count * INPUT_BYTES_PER_IMAGE)
+                inputs = np.frombuffer(payload, dtype=np.float32).reshape(count, *INPUT_SHAPE)
+                try:
+                    probabilities = await self.batcher.submit(inputs)
+                except Exception as e:
+                    SERVER_REQUESTS.inc(status="error")
+                    await self._respond(writer, STATUS_ERROR, request_id, str(e).encode("utf-8"))
+                    continue
+                SERVER_REQUESTS.inc(status="ok")
+                await self._respond(writer, STATUS_OK, request_id, np.ascontiguousarray(probabilities, dtype=np.float32).tobytes())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    backend = create_backend(args.backend, args.model)
+    # Trace/allocate every padded batch shape before accepting traffic
+    for size in BATCH_BUCKETS:
+        backend.predict(np.zeros((size, *INPUT_SHAPE), dtype=np.float32))
+    batcher = MicroBatcher(backend, args.max_batch_size, args.max_wait_ms)
+    server = InferenceServer(backend, batcher)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        listener = await asyncio.start_unix_server(server.handle, path=args.socket)
+        where = f"unix:{args.socket}"
+    else:
+        listener = await asyncio.start_server(server.handle, host=args.host, port=args.port)
+        where = f"{args.host}:{args.port}"
+    start_exporters_from_env()
+    print(f"inference server ({backend.name}, {backend.model_path}) listening on {where}", file=sys.stderr, flush=True)
+    async with listener:
+        await asyncio.gather(listener.serve_forever(), batcher.run())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", help="Unix socket path (default: TCP on --host/--port)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--backend", help="Backend that owns the model (default: $NEUROSCAN_BACKEND or keras)")
+    parser.add_argument("--model", help="Model file for the chosen backend")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    args = parser.parse_args(argv)
+    if args.backend == "server" or (not args.backend and os.environ.get("NEUROSCAN_BACKEND") == "server"):
+        parser.error("the server needs a real backend; pass --backend keras|tflite|onnx")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
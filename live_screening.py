@@ -0,0 +1,309 @@
+"""Continuous screening of a camera or recorded video with change detection.
+
+A capture thread keeps only the newest frame in a one-frame slot, so when
+the model is slower than the camera stale frames are dropped instead of
+queued and lag stays bounded by a single inference. Each frame is reduced to
+a 32x32 grayscale thumbnail and compared with the last frame that was
+scored; the model only runs when the mean absolute difference is above
+``change_threshold`` (and at most ``max_fps`` times a second). Predictions
+are averaged over a short window that restarts on a scene cut, e.g. a new
+film placed on the lightbox.
+
+Sources: a camera index (``0``) or a video file / stream URL through OpenCV
+(``opencv-python-headless``, optional), or an animated GIF / directory of
+frames through Pillow alone. Files are read as fast as the screener takes
+them unless ``--realtime`` paces them at their recorded frame rate.
+
+Usage:
+    python live_screening.py 0
+    python live_screening.py lightbox.mp4 [--realtime] [--backend tflite]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+import pipeline
+from metrics import Counter, Histogram, REGISTRY
+
+SOURCE_ENV = "NEUROSCAN_LIVE_SOURCE"
+THUMBNAIL_SIZE = 32
+# Mean absolute thumbnail difference (0-255 levels) that counts as a new view / a new film
+CHANGE_THRESHOLD = 4.0
+CUT_THRESHOLD = 12.0
+DEFAULT_MAX_FPS = 10.0
+SMOOTHING_WINDOW = 5
+# Recent lags the stats() percentiles cover; the full distribution is in LIVE_LAG
+LAG_WINDOW = 256
+FRAME_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+PILLOW_VIDEO_EXTENSIONS = (".gif", ".webp", ".apng")
+
+LIVE_FRAMES = REGISTRY.register(Counter("neuroscan_live_frames_total", "Live-screening frames by outcome.", ("outcome",)))
+LIVE_LAG = REGISTRY.register(Histogram("neuroscan_live_lag_seconds", "Capture-to-result lag of scored live frames.",
+                                       buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)))
+
+LiveResult = namedtuple("LiveResult", ["frame", "frame_number", "class_index", "probabilities", "raw_probabilities",
+                                       "change", "cut", "lag"])
+
+
+class OpenCVSource:
+    """Frames from a camera index or anything cv2.VideoCapture opens, as RGB arrays."""
+
+    def __init__(self, spec):
+        try:
+            import cv2
+        except ImportError as e:
+            raise RuntimeError("Camera and video sources need OpenCV: pip install opencv-python-headless") from e
+        self._cv2 = cv2
+        self.is_camera = str(spec).isdigit()
+        self._capture = cv2.VideoCapture(int(spec) if self.is_camera else spec)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"Could not open video source {spec!r}")
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS) or None
+
+    def __iter__(self):
+        while True:
+            ok, frame = self._capture.read()
+            if not ok:
+                return
+            yield self._cv2.cvtColor(frame, self._cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        self._capture.release()
+
+
+class PillowSource:
+    """Frames of an animated image, or of every image in a directory in name order."""
+
+    is_camera = False
+
+    def __init__(self, path, fps=None):
+        self.path = path
+        self.fps = fps
+        if fps is None and os.path.isfile(path):
+            with Image.open(path) as image:
+                duration = image.info.get("duration")
+            self.fps = 1000.0 / duration if duration else None
+
+    def __iter__(self):
+        if os.path.isdir(self.path):
+            for name in sorted(os.listdir(self.path)):
+                if name.lower().endswith(FRAME_EXTENSIONS):
+                    with Image.open(os.path.join(self.path, name)) as image:
+                        yield np.asarray(image.convert("RGB"))
+            return
+        with Image.open(self.path) as image:
+            for frame in ImageSequence.Iterator(image):
+                yield np.asarray(frame.convert("RGB"))
+
+    def close(self):
+        pass
+
+
+def open_source(spec, fps=None):
+    spec = str(spec)
+    if os.path.isdir(spec) or spec.lower().endswith(PILLOW_VIDEO_EXTENSIONS):
+        return PillowSource(spec, fps)
+    return OpenCVSource(spec)
+
+
+class FrameSlot:
+    """Single-frame handoff; ``put`` replaces an untaken frame (counted as dropped) unless ``wait``."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item, wait=False):
+        with self._condition:
+            if wait:
+                self._condition.wait_for(lambda: self._item is None or self.closed)
+            if self._item is not None:
+                self.dropped += 1
+                LIVE_FRAMES.inc(outcome="dropped")
+            self._item = item
+            self._condition.notify_all()
+
+    def take(self):
+        """Newest frame, blocking until one arrives; None once closed and drained."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._item is not None or self.closed)
+            item, self._item = self._item, None
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+def thumbnail(frame, size=THUMBNAIL_SIZE):
+    """``size`` x ``size`` float32 grayscale block means of an RGB (or gray) frame."""
+    height, width = frame.shape[:2]
+    # Subsample first so the cost does not grow with the camera resolution
+    step = max(1, min(height, width) // (size * 4))
+    small = frame[::step, ::step]
+    gray = small.mean(axis=2, dtype=np.float32) if small.ndim == 3 else small.astype(np.float32)
+    bh, bw = gray.shape[0] // size, gray.shape[1] // size
+    if not bh or not bw:
+        return np.asarray(Image.fromarray(gray).resize((size, size), Image.Resampling.BILINEAR))
+    return gray[:bh * size, :bw * size].reshape(size, bh, size, bw).mean(axis=(1, 3))
+
+
+class PredictionSmoother:
+    def __init__(self, window=SMOOTHING_WINDOW):
+        self._history = deque(maxlen=window)
+
+    def add(self, probabilities):
+        self._history.append(np.asarray(probabilities, dtype=np.float32))
+        return np.mean(self._history, axis=0)
+
+    def reset(self):
+        self._history.clear()
+
+
+class LiveScreener:
+    """Runs the model on changed frames of ``source``; iterate ``results()`` for scored frames."""
+
+    def __init__(self, model, source, change_threshold=CHANGE_THRESHOLD, cut_threshold=CUT_THRESHOLD,
+                 max_fps=DEFAULT_MAX_FPS, window=SMOOTHING_WINDOW, realtime=None):
+        self.model = model
+        self.source = source
+        self.change_threshold = change_threshold
+        self.cut_threshold = cut_threshold
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        # Cameras are live anyway; files are paced only on request
+        self.realtime = source.is_camera if realtime is None else realtime
+        self.smoother = PredictionSmoother(window)
+        self._slot = FrameSlot()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._capture, name="live-capture", daemon=True)
+        self.captured = self.unchanged = self.throttled = self.processed = 0
+        self._lags = deque(maxlen=LAG_WINDOW)
+        self.max_lag = 0.0
+        self._started = None
+
+    def _capture(self):
+        interval = 1.0 / self.source.fps if self.source.fps and self.realtime and not self.source.is_camera else 0.0
+        next_time = time.perf_counter()
+        try:
+            for number, frame in enumerate(self.source):
+                if self._stop.is_set():
+                    break
+                if interval:
+                    next_time += interval
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+                self.captured += 1
+                # Without pacing a file would race ahead, so wait for the screener instead of dropping
+                self._slot.put((number, time.perf_counter(), frame), wait=not self.realtime)
+        finally:
+            self._slot.close()
+
+    def results(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        reference, last_run = None, 0.0
+        while True:
+            item = self._slot.take()
+            if item is None:
+                return
+            number, captured_at, frame = item
+            thumb = thumbnail(frame)
+            change = float(np.abs(thumb - reference).mean()) if reference is not None else float("inf")
+            if change < self.change_threshold:
+                self.unchanged += 1
+                LIVE_FRAMES.inc(outcome="unchanged")
+                continue
+            if time.perf_counter() - last_run < self.min_interval:
+                self.throttled += 1
+                LIVE_FRAMES.inc(outcome="throttled")
+                continue
+            last_run = time.perf_counter()
+            cut = change >= self.cut_threshold
+            if cut:
+                self.smoother.reset()
+            reference = thumb
+            raw = self.model.predict(pipeline.preprocess_image(Image.fromarray(frame)))[0]
+            smoothed = self.smoother.add(raw)
+            lag = time.perf_counter() - captured_at
+            self.processed += 1
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            LIVE_FRAMES.inc(outcome="processed")
+            LIVE_LAG.observe(lag)
+            yield LiveResult(frame, number, int(np.argmax(smoothed)), smoothed, raw, change, cut, lag)
+
+    def close(self):
+        self._stop.set()
+        self._slot.close()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        lags = np.asarray(self._lags) * 1000
+        return {
+            "captured": self.captured,
+            "processed": self.processed,
+            "skipped_unchanged": self.unchanged,
+            "skipped_throttled": self.throttled,
+            "dropped_stale": self._slot.dropped,
+            "elapsed_seconds": round(elapsed, 2),
+            "processed_fps": round(self.processed / elapsed, 2) if elapsed else 0.0,
+            "captured_fps": round(self.captured / elapsed, 2) if elapsed else 0.0,
+            "lag_p50_ms": round(float(np.percentile(lags, 50)), 1) if len(lags) else None,
+            "lag_p95_ms": round(float(np.percentile(lags, 95)), 1) if len(lags) else None,
+            "lag_max_ms": round(self.max_lag * 1000, 1) if len(lags) else None,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Camera index, video file/URL, animated GIF or frame directory")
+    parser.add_argument("--realtime", action="store_true", help="Pace file sources at their recorded frame rate")
+    parser.add_argument("--fps", type=float, help="Frame rate of frame directories")
+    parser.add_argument("--max-fps", type=float, default=DEFAULT_MAX_FPS, help="Upper bound on inferences per second")
+    parser.add_argument("--change-threshold", type=float, default=CHANGE_THRESHOLD)
+    parser.add_argument("--window", type=int, default=SMOOTHING_WINDOW)
+    parser.add_argument("--backend", help="Inference backend; defaults to $NEUROSCAN_BACKEND or keras")
+    parser.add_argument("--labels", default=pipeline.LABELS_PATH)
+    args = parser.parse_args(argv)
+
+    model, class_names = pipeline.load_model_and_labels(labels_path=args.labels, backend=args.backend)
+    source = open_source(args.source, args.fps)
+    with LiveScreener(model, source, args.change_threshold, max_fps=args.max_fps, window=args.window,
+                      realtime=args.realtime or None) as screener:
+        try:
+            for result in screener.results():
+                print(json.dumps({
+                    "frame": result.frame_number,
+                    "class": class_names[result.class_index],
+                    "confidence": round(float(result.probabilities[result.class_index]), 4),
+                    "change": round(result.change, 2) if np.isfinite(result.change) else None,
+                    "cut": result.cut,
+                    "lag_ms": round(result.lag * 1000, 1),
+                }))
+        except KeyboardInterrupt:
+            pass
+        print(json.dumps(screener.stats(), indent=2), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
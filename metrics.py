@@ -0,0 +1,247 @@
+"""Low-overhead in-process metrics with Prometheus text export.
+
+Hot-path code records per-request stage timings with ``RequestTrace``; each
+finished trace feeds the histograms below and a short ring buffer of recent
+requests for the in-app debug panel. Export is opt-in:
+
+    NEUROSCAN_METRICS_PORT=9464      serve /metrics over HTTP on that port
+    NEUROSCAN_METRICS_FILE=path.prom rewrite a textfile-collector file periodically
+"""
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT_ENV = "NEUROSCAN_METRICS_PORT"
+METRICS_FILE_ENV = "NEUROSCAN_METRICS_FILE"
+METRICS_FILE_INTERVAL = 15.0
+RECENT_REQUESTS = 50
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+
+def process_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self._function is not None:
+            self.set(self._function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': le})} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.register(Histogram("neuroscan_stage_seconds", "Time spent per request stage.", ("stage",)))
+REQUEST_SECONDS = REGISTRY.register(Histogram("neuroscan_request_seconds", "End-to-end analysis time per request.", ("mode",)))
+INPUT_BYTES = REGISTRY.register(Histogram("neuroscan_input_bytes", "Size of uploaded/captured images.", buckets=BYTES_BUCKETS))
+CACHE_LOOKUPS = REGISTRY.register(Counter("neuroscan_prediction_cache_lookups_total", "Prediction cache lookups.", ("result",)))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge("neuroscan_model_load_seconds", "Duration of each model startup phase.", ("phase",)))
+PROCESS_RSS = REGISTRY.register(Gauge("neuroscan_process_resident_memory_bytes", "Resident set size of this process.", function=process_rss_bytes))
+
+_recent = deque(maxlen=RECENT_REQUESTS)
+
+
+class RequestTrace:
+    """Per-request stage timer; call ``finish()`` once to publish it."""
+
+    def __init__(self, mode, input_bytes=None):
+        self.mode = mode
+        self.input_bytes = input_bytes
+        self.cache_hit = None
+        self.stages = {}
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self):
+        total = time.perf_counter() - self._start
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=name)
+        REQUEST_SECONDS.observe(total, mode=self.mode)
+        if self.input_bytes is not None:
+            INPUT_BYTES.observe(self.input_bytes)
+        if self.cache_hit is not None:
+            CACHE_LOOKUPS.inc(result="hit" if self.cache_hit else "miss")
+        _recent.append({
+            "time": time.strftime("%H:%M:%S", time.localtime(self.started_at)),
+            "mode": self.mode,
+            "cache_hit": self.cache_hit,
+            "input_kb": round(self.input_bytes / 1024, 1) if self.input_bytes is not None else None,
+            **{f"{name}_ms": round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+            "total_ms": round(total * 1000, 2),
+        })
+        return total
+
+
+def recent_requests():
+    return list(_recent)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_exporter(port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def write_textfile(path):
+    # Write-then-rename so a scraper never reads a half-written file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp, path)
+
+
+def start_textfile_writer(path, interval=METRICS_FILE_INTERVAL):
+    def loop():
+        while True:
+            write_textfile(path)
+            time.sleep(interval)
+    threading.Thread(target=loop, name="metrics-textfile", daemon=True).start()
+
+
+def start_exporters_from_env():
+    started = []
+    port = os.environ.get(METRICS_PORT_ENV)
+    if port:
+        start_http_exporter(int(port))
+        started.append(f"http:{port}")
+    path = os.environ.get(METRICS_FILE_ENV)
+    if path:
+        start_textfile_writer(path)
+        started.append(f"file:{path}")
+    return started
@@ -0,0 +1,337 @@
+"""Versioned model registry with label binding, hot swap and shadow traffic.
+
+registry.json binds every model file to its label file, backend and
+preprocessing constants under a version id, and names the active version
+(plus an optional shadow candidate):
+
+    {"active": "v1", "shadow": {"version": "v2", "fraction": 0.1},
+     "models": {"v1": {"model": "keras_model.h5", "labels": "labels.txt", ...}}}
+
+Serve it with ``NEUROSCAN_BACKEND=registry``. Outputs of every version are
+reordered by class name onto the serving labels (labels.txt), so versions
+with different class orders or counts stay interchangeable. Versions load
+lazily; activating one loads and warms it before an atomic swap, so
+in-flight requests finish on the version they started with, and versions
+no longer active or shadowed are released once those requests finish.
+Cache and store keys follow the active version's model and label files,
+switching with the swap itself. Shadow requests wait in a short queue and
+are dropped (counted) when it is full. Running
+processes pick up edits to registry.json within ``NEUROSCAN_REGISTRY_POLL``
+seconds:
+
+    python model_registry.py list
+    python model_registry.py activate VERSION
+    python model_registry.py shadow VERSION --fraction 0.1   (or: shadow off)
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import pipeline
+from metrics import Counter, Histogram, REGISTRY
+
+REGISTRY_PATH_ENV = "NEUROSCAN_MODEL_REGISTRY"
+POLL_ENV = "NEUROSCAN_REGISTRY_POLL"
+DEFAULT_REGISTRY_PATH = "registry.json"
+DEFAULT_POLL_SECONDS = 5.0
+SHADOW_WINDOW = 1000
+# Mirrored batches queued or running on the shadow model; more are dropped rather than queued
+SHADOW_QUEUE = 2
+DEFAULT_PREPROCESSING = {
+    "image_size": list(pipeline.IMAGE_SIZE),
+    "normalize_scale": pipeline.NORMALIZE_SCALE,
+    "normalize_offset": pipeline.NORMALIZE_OFFSET,
+}
+
+SWAPS = REGISTRY.register(Counter("neuroscan_registry_swaps_total", "Active model version changes.", ("version",)))
+SHADOW_PREDICTIONS = REGISTRY.register(Counter("neuroscan_shadow_predictions_total", "Images scored by the shadow model.", ("agreement",)))
+SHADOW_DROPPED = REGISTRY.register(Counter("neuroscan_shadow_dropped_total", "Mirrored batches dropped because the shadow queue was full."))
+SHADOW_SECONDS = REGISTRY.register(Histogram("neuroscan_shadow_seconds", "Forward-pass time of active vs shadow model.", ("role",)))
+
+
+class RegistryError(ValueError):
+    pass
+
+
+class ModelVersion:
+    """One registry entry; the backend is created on first use."""
+
+    def __init__(self, version_id, spec, base_dir="."):
+        self.version_id = version_id
+        self.model_path = os.path.join(base_dir, spec["model"])
+        self.labels_path = os.path.join(base_dir, spec["labels"])
+        self.backend_name = spec.get("backend")
+        self.preprocessing = {**DEFAULT_PREPROCESSING, **spec.get("preprocessing", {})}
+        self.positive_label = spec.get("positive_label")
+        self.class_names = pipeline.read_labels(self.labels_path)
+        if self.positive_label is not None and self.positive_label not in self.class_names:
+            raise RegistryError(f"{version_id}: positive label {self.positive_label!r} is not in {self.labels_path}")
+        if tuple(self.preprocessing["image_size"]) != tuple(pipeline.IMAGE_SIZE):
+            raise RegistryError(f"{version_id}: input size {self.preprocessing['image_size']} is not supported "
+                                f"by the shared preprocessing ({pipeline.IMAGE_SIZE})")
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._backend is not None
+
+    def load(self):
+        with self._lock:
+            if self._backend is None:
+                from backends import DEFAULT_BACKEND, create_backend
+                # Never fall back to $NEUROSCAN_BACKEND here: that is "registry" itself
+                backend = create_backend(self.backend_name or DEFAULT_BACKEND, self.model_path)
+                outputs = backend.predict(np.zeros((1, *pipeline.IMAGE_SIZE[::-1], 3), dtype=np.float32)).shape[-1]
+                if outputs != len(self.class_names):
+                    raise RegistryError(f"{self.version_id}: model has {outputs} outputs but "
+                                        f"{self.labels_path} lists {len(self.class_names)} classes")
+                self._backend = backend
+        return self._backend
+
+    def _adapt_input(self, batch):
+        # Inputs arrive normalized with the pipeline constants; re-map affinely if this model expects others
+        scale, offset = self.preprocessing["normalize_scale"], self.preprocessing["normalize_offset"]
+        if scale == pipeline.NORMALIZE_SCALE and offset == pipeline.NORMALIZE_OFFSET:
+            return batch
+        return (np.asarray(batch, dtype=np.float32) + pipeline.NORMALIZE_OFFSET) * (pipeline.NORMALIZE_SCALE / scale) - offset
+
+    def predict(self, batch):
+        return self.load().predict(self._adapt_input(batch))
+
+    def is_positive(self, index):
+        return self.positive_label is not None and self.class_names[index] == self.positive_label
+
+
+def label_mapping(source, target):
+    """Index array taking ``source``-ordered probabilities onto ``target`` order (-1 = absent)."""
+    return np.array([source.index(name) if name in source else -1 for name in target])
+
+
+def reorder(probabilities, mapping):
+    out = np.zeros((len(probabilities), len(mapping)), dtype=np.float32)
+    present = mapping >= 0
+    out[:, present] = probabilities[:, mapping[present]]
+    return out
+
+
+def read_registry(path):
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if config.get("active") not in config.get("models", {}):
+        raise RegistryError(f"{path}: active version {config.get('active')!r} is not registered")
+    return config
+
+
+def write_registry(path, config):
+    # Write-then-rename so watchers never read a half-written file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+class ShadowStats:
+    def __init__(self, window=SHADOW_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+
+    def add(self, agree, active_seconds, shadow_seconds):
+        with self._lock:
+            self._samples.append((agree, active_seconds, shadow_seconds))
+
+    def summary(self):
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return {"samples": 0}
+        agree, active, shadow = (np.asarray(column, dtype=np.float64) for column in zip(*samples))
+        return {
+            "samples": len(samples),
+            "agreement": round(float(agree.mean()), 4),
+            "active_p50_ms": round(float(np.percentile(active, 50)) * 1000, 2),
+            "active_p95_ms": round(float(np.percentile(active, 95)) * 1000, 2),
+            "shadow_p50_ms": round(float(np.percentile(shadow, 50)) * 1000, 2),
+            "shadow_p95_ms": round(float(np.percentile(shadow, 95)) * 1000, 2),
+        }
+
+
+class ModelRegistry:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(REGISTRY_PATH_ENV) or DEFAULT_REGISTRY_PATH
+        self.base_dir = os.path.dirname(os.path.abspath(self.path))
+        self._versions = {}
+        self._swap_lock = threading.Lock()
+        self._mtime = None
+        self.active = None
+        self.shadow = None
+        self.shadow_fraction = 0.0
+        self.refresh()
+
+    def version(self, version_id):
+        if version_id not in self._versions:
+            spec = self._config["models"].get(version_id)
+            if spec is None:
+                raise RegistryError(f"Unknown model version {version_id!r}")
+            self._versions[version_id] = ModelVersion(version_id, spec, self.base_dir)
+        return self._versions[version_id]
+
+    def refresh(self):
+        """Re-read registry.json; load and warm a newly active version, then swap it in."""
+        with self._swap_lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            config = read_registry(self.path)
+            self._config = config
+            # Specs may have changed; drop unloaded entries so they are re-read
+            self._versions = {k: v for k, v in self._versions.items() if v.loaded}
+            active = self.version(config["active"])
+            if self.active is not None and active is not self.active:
+                active.load()
+            shadow_config = config.get("shadow") or {}
+            shadow = self.version(shadow_config["version"]) if shadow_config.get("version") else None
+            if shadow is not None:
+                shadow.load()
+            swapped = self.active is not None and (active is not self.active or shadow is not self.shadow)
+            if active is not self.active:
+                SWAPS.inc(version=active.version_id)
+            # Plain attribute assignment: readers see either the old or the new version, never a mix
+            self.active = active
+            self.shadow, self.shadow_fraction = shadow, float(shadow_config.get("fraction", 0.0)) if shadow else 0.0
+            self._mtime = mtime
+            if swapped:
+                # In-flight requests still hold the versions they started with; those are freed when they finish
+                self._versions = {k: v for k, v in self._versions.items() if v is active or v is shadow}
+                gc.collect()
+            return True
+
+    def activate(self, version_id):
+        config = read_registry(self.path)
+        self.version(version_id)
+        config["active"] = version_id
+        write_registry(self.path, config)
+        self.refresh()
+
+    def start_watcher(self, interval=None):
+        interval = float(os.environ.get(POLL_ENV, DEFAULT_POLL_SECONDS)) if interval is None else interval
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # Keep serving the current version; a bad edit must not take the app down
+                    print(f"model registry: ignoring {self.path}: {e}", file=sys.stderr)
+        threading.Thread(target=loop, name="model-registry-watch", daemon=True).start()
+
+
+class RegistryBackend:
+    """Serves the registry's active version, mirroring a sample of traffic to the shadow version."""
+
+    name = "registry"
+
+    @staticmethod
+    def import_runtime():
+        return None
+
+    def __init__(self, model_path=None, labels_path=pipeline.LABELS_PATH, watch=True):
+        # model_path, if given, is the registry file
+        self.registry = ModelRegistry(model_path)
+        self.class_names = pipeline.read_labels(labels_path)
+        self.shadow_stats = ShadowStats()
+        self.shadow_dropped = 0
+        self._mappings = {}
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._shadow_slots = threading.BoundedSemaphore(SHADOW_QUEUE)
+        self.registry.active.load()
+        if watch:
+            self.registry.start_watcher()
+
+    @property
+    def model_path(self):
+        # Read from the active version, so keys switch with the swap rather than with the registry.json edit
+        version = self.registry.active
+        return (version.model_path, version.labels_path)
+
+    def _mapping(self, version):
+        mapping = self._mappings.get(version.version_id)
+        if mapping is None:
+            mapping = self._mappings[version.version_id] = label_mapping(version.class_names, self.class_names)
+        return mapping
+
+    def predict(self, batch):
+        version, shadow = self.registry.active, self.registry.shadow
+        start = time.perf_counter()
+        probabilities = reorder(version.predict(batch), self._mapping(version))
+        seconds = time.perf_counter() - start
+        if shadow is not None and shadow is not version and random.random() < self.registry.shadow_fraction:
+            if self._shadow_slots.acquire(blocking=False):
+                batch = np.array(batch, dtype=np.float32)
+                self._shadow_executor.submit(self._run_shadow, shadow, batch, probabilities, seconds / len(batch))
+            else:
+                self.shadow_dropped += 1
+                SHADOW_DROPPED.inc()
+        return probabilities
+
+    def _run_shadow(self, shadow, batch, reference, active_seconds):
+        try:
+            start = time.perf_counter()
+            probabilities = reorder(shadow.predict(batch), self._mapping(shadow))
+            shadow_seconds = (time.perf_counter() - start) / len(batch)
+        except Exception as e:
+            print(f"shadow model {shadow.version_id} failed: {e}", file=sys.stderr)
+            return
+        finally:
+            self._shadow_slots.release()
+        SHADOW_SECONDS.observe(active_seconds, role="active")
+        SHADOW_SECONDS.observe(shadow_seconds, role="shadow")
+        for agree in reference.argmax(axis=1) == probabilities.argmax(axis=1):
+            SHADOW_PREDICTIONS.inc(agreement="agree" if agree else "disagree")
+            self.shadow_stats.add(bool(agree), active_seconds, shadow_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--registry", default=os.environ.get(REGISTRY_PATH_ENV) or DEFAULT_REGISTRY_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list")
+    activate = sub.add_parser("activate")
+    activate.add_argument("version")
+    shadow = sub.add_parser("shadow")
+    shadow.add_argument("version", help="Candidate version, or 'off'")
+    shadow.add_argument("--fraction", type=float, default=0.1, help="Share of requests mirrored to the candidate")
+    args = parser.parse_args(argv)
+
+    config = read_registry(args.registry)
+    if args.command == "list":
+        shadow_config = config.get("shadow") or {}
+        for version_id, spec in config["models"].items():
+            role = "active" if version_id == config["active"] else "shadow" if version_id == shadow_config.get("version") else ""
+            print(f"{version_id:28} {role:7} {spec['model']} + {spec['labels']}")
+        return 0
+    version_id = args.version
+    if version_id != "off" and version_id not in config["models"]:
+        raise SystemExit(f"Unknown model version {version_id!r}")
+    if args.command == "activate":
+        config["active"] = version_id
+    else:
+        config["shadow"] = None if version_id == "off" else {"version": version_id, "fraction": args.fraction}
+    write_registry(args.registry, config)
+    print(f"updated {args.registry}; running servers pick it up within their poll interval", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Cheap pre-inference check that turns away obvious non-MRI images before the CNN.
+
+Works on the already preprocessed 224x224 input, subsampled to 28x28:
+colour saturation (MRIs are grayscale), brightness statistics, dark
+background fraction, border/centre contrast and histogram entropy. A hard
+colour rule needs no training; a tiny logistic regression over the same
+features is used once trained from the CNN's own decisions:
+
+    python mri_gate.py train IMAGE_DIR [IMAGE_DIR ...] [--max-false-reject 0.005]
+    python mri_gate.py evaluate IMAGE_DIR [IMAGE_DIR ...]
+
+``evaluate`` reports the false-reject rate (gate rejects, CNN says MRI) and
+how many CNN ``Not MRI Scan`` decisions the gate catches. The app reads
+
+    NEUROSCAN_MRI_GATE=off|shadow|enforce   shadow (default) logs without skipping
+    NEUROSCAN_MRI_GATE_MODEL=mri_gate.json  trained weights, if present
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import pipeline
+from metrics import Counter, Histogram, REGISTRY
+
+MODE_ENV = "NEUROSCAN_MRI_GATE"
+MODEL_ENV = "NEUROSCAN_MRI_GATE_MODEL"
+GATE_MODES = ("off", "shadow", "enforce")
+DEFAULT_MODE = "shadow"
+DEFAULT_MODEL_PATH = "mri_gate.json"
+NOT_MRI_LABEL = "Not MRI Scan"
+STRIDE = 8
+# Per-pixel channel spread (in the [-1, 1] input scale) that counts as coloured
+SATURATION_THRESHOLD = 0.15
+# Share of coloured pixels above which an image is rejected without the classifier
+COLOUR_REJECT_FRACTION = 0.25
+DEFAULT_MAX_FALSE_REJECT = 0.005
+FEATURE_NAMES = ("saturation_mean", "saturation_fraction", "gray_mean", "gray_std", "dark_fraction",
+                 "bright_fraction", "border_mean", "center_mean", "entropy")
+
+GATE_DECISIONS = REGISTRY.register(Counter("neuroscan_mri_gate_decisions_total", "Pre-inference gate decisions.", ("mode", "decision")))
+GATE_OUTCOMES = REGISTRY.register(Counter("neuroscan_mri_gate_outcomes_total", "Gate decision vs the CNN's decision on the same image.", ("gate", "cnn")))
+GATE_SECONDS = REGISTRY.register(Histogram("neuroscan_mri_gate_seconds", "Time spent in the pre-inference gate.",
+                                           buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005)))
+
+GateDecision = namedtuple("GateDecision", ["reject", "score", "reason"])
+
+
+def gate_features(image):
+    """Feature vector for one preprocessed ``(224, 224, 3)`` (or ``(1, ...)``) image."""
+    small = np.asarray(image, dtype=np.float32).reshape(-1, *np.shape(image)[-3:])[0, ::STRIDE, ::STRIDE]
+    saturation = small.max(axis=2) - small.min(axis=2)
+    gray = small.mean(axis=2)
+    size = gray.shape[0]
+    border = np.concatenate([gray[:3].ravel(), gray[-3:].ravel(), gray[3:-3, :3].ravel(), gray[3:-3, -3:].ravel()])
+    quarter = size // 4
+    counts = np.bincount(np.clip(((gray + 1) * 8).astype(np.int32), 0, 15).ravel(), minlength=16)
+    p = counts[counts > 0] / gray.size
+    return np.array([
+        saturation.mean(),
+        (saturation > SATURATION_THRESHOLD).mean(),
+        gray.mean(),
+        gray.std(),
+        (gray < -0.8).mean(),
+        (gray > 0.6).mean(),
+        border.mean(),
+        gray[quarter:-quarter, quarter:-quarter].mean(),
+        -(p * np.log2(p)).sum(),
+    ], dtype=np.float32)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class MriGate:
+    """Colour rule plus an optional logistic regression; ``check`` takes well under a millisecond."""
+
+    def __init__(self, mode=None, model_path=None):
+        self.mode = (mode or os.environ.get(MODE_ENV) or DEFAULT_MODE).lower()
+        if self.mode not in GATE_MODES:
+            raise ValueError(f"Unknown gate mode {self.mode!r}; expected one of {', '.join(GATE_MODES)}")
+        self.model_path = model_path or os.environ.get(MODEL_ENV) or DEFAULT_MODEL_PATH
+        self.weights = None
+        if os.path.exists(self.model_path):
+            with open(self.model_path) as f:
+                params = json.load(f)
+            self.mean = np.asarray(params["mean"], dtype=np.float32)
+            self.scale = np.asarray(params["scale"], dtype=np.float32)
+            self.weights = np.asarray(params["weights"], dtype=np.float32)
+            self.bias = float(params["bias"])
+            self.threshold = float(params["threshold"])
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def enforcing(self):
+        return self.mode == "enforce"
+
+    def decide(self, features):
+        if features[1] > COLOUR_REJECT_FRACTION:
+            return GateDecision(True, float(features[1]), "colour")
+        if self.weights is not None:
+            score = float(_sigmoid((features - self.mean) / self.scale @ self.weights + self.bias))
+            return GateDecision(score >= self.threshold, score, "classifier")
+        return GateDecision(False, 0.0, None)
+
+    def check(self, image):
+        start = time.perf_counter()
+        decision = self.decide(gate_features(image))
+        GATE_SECONDS.observe(time.perf_counter() - start)
+        GATE_DECISIONS.inc(mode=self.mode, decision="reject" if decision.reject else "pass")
+        return decision
+
+    def record_outcome(self, decision, cnn_class_name):
+        """Compare a gate decision with the CNN's class for the same image (shadow-mode bookkeeping)."""
+        cnn = "not_mri" if NOT_MRI_LABEL in cnn_class_name else "mri"
+        GATE_OUTCOMES.inc(gate="reject" if decision.reject else "pass", cnn=cnn)
+        if decision.reject and cnn == "mri":
+            print(f"mri gate: would have rejected an image the CNN classed as {cnn_class_name!r} "
+                  f"({decision.reason}, score {decision.score:.3f})", file=sys.stderr)
+
+
+def not_mri_index(class_names):
+    """Index of the ``Not MRI Scan`` class, or None for label sets without it."""
+    for i, name in enumerate(class_names):
+        if NOT_MRI_LABEL in name:
+            return i
+    return None
+
+
+def rejection_probabilities(decision, class_names):
+    """Stand-in probability vector for a rejected image: ``score`` on Not MRI, the rest spread evenly."""
+    index = not_mri_index(class_names)
+    confidence = min(max(decision.score, 0.5), 1.0)
+    probabilities = np.full(len(class_names), (1.0 - confidence) / max(len(class_names) - 1, 1), dtype=np.float32)
+    probabilities[index] = confidence
+    return probabilities
+
+
+def collect(directories, backend=None, labels_path=pipeline.LABELS_PATH):
+    """Gate features, CNN decisions (1 = Not MRI) and feature times for every image under ``directories``."""
+    from batch_score import decode_path, iter_image_paths
+    model, class_names = pipeline.load_model_and_labels(labels_path=labels_path, backend=backend)
+    index = not_mri_index(class_names)
+    if index is None:
+        raise SystemExit(f"{labels_path} has no {NOT_MRI_LABEL!r} class")
+    paths = (path for directory in directories for path in iter_image_paths(directory))
+    features, labels, seconds = [], [], []
+    for _, batch, _ in pipeline.iter_batches(paths, decode_path):
+        if batch is None:
+            continue
+        for image in batch:
+            start = time.perf_counter()
+            features.append(gate_features(image))
+            seconds.append(time.perf_counter() - start)
+        labels.extend(pipeline.predict_batch(model, batch).argmax(axis=1) == index)
+    if not features:
+        raise SystemExit("No readable images found")
+    return np.stack(features), np.asarray(labels, dtype=np.float32), np.asarray(seconds)
+
+
+def fit_logistic(x, y, epochs=2000, learning_rate=0.5, l2=1e-3):
+    mean, scale = x.mean(axis=0), x.std(axis=0) + 1e-6
+    z = (x - mean) / scale
+    weights, bias = np.zeros(x.shape[1]), 0.0
+    for _ in range(epochs):
+        error = _sigmoid(z @ weights + bias) - y
+        weights -= learning_rate * (z.T @ error / len(y) + l2 * weights)
+        bias -= learning_rate * error.mean()
+    return mean, scale, weights, bias
+
+
+def calibrate_threshold(scores, y, max_false_reject):
+    """Lowest threshold whose false-reject rate on CNN-MRI images stays within ``max_false_reject``."""
+    mri_scores = np.sort(scores[y == 0])
+    if not len(mri_scores):
+        return 0.5
+    allowed = int(max_false_reject * len(mri_scores))
+    # Only scores strictly above the (allowed + 1)-th highest MRI score are rejected
+    return float(np.nextafter(mri_scores[-(allowed + 1)], np.inf))
+
+
+def evaluate(gate, x, y, seconds):
+    rejects = np.array([gate.decide(row).reject for row in x])
+    mri, not_mri = y == 0, y == 1
+    return {
+        "images": int(len(y)),
+        "cnn_not_mri": int(not_mri.sum()),
+        "false_reject_rate": round(float(rejects[mri].mean()), 5) if mri.any() else None,
+        "not_mri_caught": round(float(rejects[not_mri].mean()), 5) if not_mri.any() else None,
+        "feature_p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 4),
+        "feature_p99_ms": round(float(np.percentile(seconds, 99)) * 1000, 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("train", "evaluate"):
+        command = sub.add_parser(name)
+        command.add_argument("dirs", nargs="+", help="Image directories (MRI and non-MRI mixed)")
+        command.add_argument("--backend", help="Backend for the reference CNN decisions")
+        command.add_argument("--labels", default=pipeline.LABELS_PATH)
+        command.add_argument("--gate-model", default=DEFAULT_MODEL_PATH)
+    sub.choices["train"].add_argument("--max-false-reject", type=float, default=DEFAULT_MAX_FALSE_REJECT)
+    args = parser.parse_args(argv)
+
+    x, y, seconds = collect(args.dirs, args.backend, args.labels)
+    if args.command == "train":
+        mean, scale, weights, bias = fit_logistic(x, y)
+        # Images the colour rule already rejects do not count against the classifier's budget
+        rest = x[:, 1] <= COLOUR_REJECT_FRACTION
+        scores = _sigmoid((x[rest] - mean) / scale @ weights + bias)
+        threshold = calibrate_threshold(scores, y[rest], args.max_false_reject)
+        with open(args.gate_model, "w") as f:
+            json.dump({"features": FEATURE_NAMES, "mean": mean.tolist(), "scale": scale.tolist(),
+                       "weights": weights.tolist(), "bias": bias, "threshold": threshold}, f, indent=2)
+        print(f"wrote {args.gate_model} (threshold {threshold:.4f})", file=sys.stderr)
+
+    # Training numbers are in-sample; run evaluate on a held-out directory for the real rate
+    print(json.dumps(evaluate(MriGate("shadow", args.gate_model), x, y, seconds), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,10 @@
 import streamlit as st
-from PIL import Image, ImageOps
+from PIL import Image
 import numpy as np
 import time
 
-# استيراد tensorflow بطريقة تجنبنا التحميل الكامل للمكتبة الضخمة
-import tensorflow as tf
+from model_registry import ModelRegistry
+from pipeline import preprocess_image
 
 # ---------------------------------------------------------
 # 1. إعدادات الصفحة
@@ -52,15 +52,14 @@ translations = {
 # ---------------------------------------------------------
 @st.cache_resource
 def load_tm_model():
-    # تحميل الموديل مع تعطيل التجميع لحل مشكلة 'groups'
-    return tf.keras.models.load_model('keras_model.h5', compile=False)
+    # الإصدار النشط من registry.json: ملف النموذج مربوط بملف التسميات الخاص به
+    model = ModelRegistry().active
+    model.load()
+    return model
 
 def predict(img, model):
-    size = (224, 224)
-    image = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
-    img_array = np.asarray(image).astype(np.float32)
-    normalized_image = (img_array / 127.5) - 1.0
-    data = np.expand_dims(normalized_image, axis=0)
+    # نفس المعالجة المسبقة المستخدمة في app.py (قص وتحجيم 224x224 ثم التطبيع إلى [-1, 1])
+    data = preprocess_image(img)
     return model.predict(data)
 
 # ---------------------------------------------------------
@@ -87,7 +86,8 @@ if img_file:
             idx = np.argmax(res)
             
             st.markdown("---")
-            if idx == 1:
+            # الفئة الإيجابية تُحدد بالاسم من التسميات المرتبطة بالنموذج وليس برقم ثابت
+            if model.is_positive(idx):
                 st.error(t['pos_result'])
             else:
                 st.success(t['neg_result'])
@@ -0,0 +1,213 @@
+"""Image preprocessing and batched inference shared by the app and batch tools."""
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+MODEL_PATH = "keras_model.h5"
+LABELS_PATH = "labels.txt"
+# Default fallback (should not be used if labels.txt exists)
+DEFAULT_CLASS_NAMES = ["Yes Have a Tumor in Brain Scan", "No Tumor in Brain Scan", "Not MRI Scan"]
+IMAGE_SIZE = (224, 224)
+# Teachable Machine / MobileNet normalization: uint8 [0, 255] -> float32 [-1, 1]
+NORMALIZE_SCALE = 127.5
+NORMALIZE_OFFSET = 1.0
+# Inputs above this are rejected from the header, before any pixel is decoded
+MAX_INPUT_PIXELS = int(os.environ.get("NEUROSCAN_MAX_INPUT_PIXELS", 64_000_000))
+# Limit on what is actually decoded, i.e. after JPEG draft downscaling; resource profiles lower it
+MAX_DECODE_PIXELS = int(os.environ.get("NEUROSCAN_MAX_DECODE_PIXELS", MAX_INPUT_PIXELS))
+# JPEGs are DCT-downscaled to about this multiple of the target size before resampling
+DRAFT_OVERSAMPLE = 2
+REDUCING_GAP = 3.0
+BATCH_SIZE = 32
+DECODE_WORKERS = min(8, os.cpu_count() or 1)
+PREFETCH_BATCHES = 2
+
+
+def read_labels(path=LABELS_PATH):
+    class_names = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.strip().split(" ", 1)
+                if len(parts) > 1:
+                    class_names.append(parts[1].strip())
+    return class_names or list(DEFAULT_CLASS_NAMES)
+
+
+def load_model(path=MODEL_PATH):
+    # TensorFlow is imported here so tools that never touch the model stay light
+    import tensorflow.keras
+    return tensorflow.keras.models.load_model(path, compile=False)
+
+
+def load_model_and_labels(model_path=None, labels_path=LABELS_PATH, backend=None, **backend_kwargs):
+    """Return ``(backend, class_names)``; see backends.create_backend for selection."""
+    from backends import create_backend
+    return create_backend(backend, model_path, **backend_kwargs), read_labels(labels_path)
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def _fit_box(size, target=IMAGE_SIZE):
+    # Centered crop with the target aspect ratio, as ImageOps.fit computes it
+    width, height = size
+    target_ratio = target[0] / target[1]
+    if width / height > target_ratio:
+        crop_width = height * target_ratio
+        left = (width - crop_width) / 2
+        return (left, 0, left + crop_width, height)
+    crop_height = width / target_ratio
+    top = (height - crop_height) / 2
+    return (0, top, width, top + crop_height)
+
+
+def draft_image(image, target=IMAGE_SIZE):
+    """Set up the smallest decode of ``image`` that still covers ``target``; returns the size it will decode to.
+
+    Nothing is decoded yet. JPEGs use draft mode so libjpeg decodes at a
+    reduced scale close to the target; other formats decode at full size.
+    Raises ImageTooLargeError above MAX_INPUT_PIXELS (header size) or
+    MAX_DECODE_PIXELS (decoded size). Calling it again is harmless.
+    """
+    width, height = image.size
+    if width * height > MAX_INPUT_PIXELS:
+        raise ImageTooLargeError(f"Image is {width}x{height}; the limit is {MAX_INPUT_PIXELS:,} pixels")
+    left, top, right, bottom = _fit_box(image.size, target)
+    scale = DRAFT_OVERSAMPLE * max(target[0] / (right - left), target[1] / (bottom - top))
+    if scale < 1:
+        # No-op for formats other than JPEG or images that are already loaded
+        image.draft("RGB", (int(width * scale) + 1, int(height * scale) + 1))
+    width, height = image.size
+    if width * height > MAX_DECODE_PIXELS:
+        raise ImageTooLargeError(f"Image decodes to {width}x{height}; the limit is {MAX_DECODE_PIXELS:,} pixels")
+    return width, height
+
+
+def decoded_pixels(image_bytes):
+    """Pixels ``preprocess_bytes`` would decode for ``image_bytes``, read from the header (0 if unreadable)."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            width, height = draft_image(image)
+    except Exception:
+        # Decoding reports the error; there is nothing to budget for
+        return 0
+    return width * height
+
+
+def fit_image(image, target=IMAGE_SIZE):
+    """Center-crop and LANCZOS-resize ``image`` to ``target`` as RGB, decoding as little as possible.
+
+    See ``draft_image`` for the size limits and JPEG draft decoding. The
+    resize uses ``reducing_gap`` so large frames are box-reduced before the
+    LANCZOS pass.
+    """
+    draft_image(image, target)
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    image = image.resize(target, Image.Resampling.LANCZOS, box=_fit_box(image.size, target), reducing_gap=REDUCING_GAP)
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def normalize(image_array, out=None):
+    """Map uint8 pixels to [-1, 1] float32, writing into ``out`` when given."""
+    out = np.multiply(image_array, np.float32(1 / NORMALIZE_SCALE), out=out, dtype=np.float32)
+    out -= np.float32(NORMALIZE_OFFSET)
+    return out
+
+
+def preprocess_image(image, out=None):
+    """Return the model input for ``image``: shape (1, 224, 224, 3), or written into ``out`` (224, 224, 3)."""
+    image_array = np.asarray(fit_image(image))
+    if out is not None:
+        return normalize(image_array, out)
+    data = np.empty((1, *IMAGE_SIZE[::-1], 3), dtype=np.float32)
+    normalize(image_array, data[0])
+    return data
+
+
+def preprocess_bytes(image_bytes, out=None):
+    """Decode encoded image bytes into a single (224, 224, 3) input array."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        if out is None:
+            return preprocess_image(image)[0]
+        return preprocess_image(image, out)
+
+
+def iter_batches(items, decode, batch_size=BATCH_SIZE, workers=DECODE_WORKERS, prefetch=PREFETCH_BATCHES,
+                 buffers=None):
+    """Decode ``items`` in a thread pool and yield ``(ok_items, batch, failed)`` chunks.
+
+    ``decode(item, out)`` must write one preprocessed (224, 224, 3) array into
+    ``out``. ``items`` may be any (lazy) iterable; at most ``prefetch + 1``
+    batches are in flight at once and they are decoded straight into a small
+    ring of preallocated batch buffers, so memory stays flat however many
+    items there are. ``batch`` is a float32 array for ``ok_items`` (or None if
+    every item in the chunk failed) and is only valid until the next chunk is
+    requested. ``failed`` is a list of ``(item, error)``.
+
+    ``buffers`` optionally supplies the ring (at least ``prefetch + 2`` float32
+    arrays of ``batch_size`` images, e.g. worker-pool slots). Chunk ``i`` is
+    then ``buffers[i % len(buffers)][:len(ok_items)]`` and is not overwritten
+    until ``len(buffers) - prefetch - 1`` further chunks have been requested.
+    """
+    items = iter(items)
+    max_pending = batch_size * (prefetch + 1)
+    if buffers is None:
+        # One buffer per in-flight batch plus the one the caller is holding
+        buffers = np.empty((prefetch + 2, batch_size, *IMAGE_SIZE[::-1], 3), dtype=np.float32)
+    elif len(buffers) < prefetch + 2:
+        raise ValueError(f"need at least {prefetch + 2} buffers, got {len(buffers)}")
+    num_buffers = len(buffers)
+    pending = deque()
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def fill():
+            nonlocal submitted
+            while len(pending) < max_pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                out = buffers[(submitted // batch_size) % num_buffers][submitted % batch_size]
+                pending.append((item, pool.submit(decode, item, out)))
+                submitted += 1
+
+        fill()
+        chunk = 0
+        while pending:
+            buffer = buffers[chunk % num_buffers]
+            ok_items, ok_slots, failed = [], [], []
+            for slot in range(min(batch_size, len(pending))):
+                item, future = pending.popleft()
+                try:
+                    future.result()
+                    ok_items.append(item)
+                    ok_slots.append(slot)
+                except Exception as e:
+                    failed.append((item, e))
+            fill()
+            if not ok_items:
+                batch = None
+            else:
+                if failed:
+                    # Compact in place so the batch is always the front of its buffer
+                    buffer[:len(ok_slots)] = buffer[ok_slots]
+                batch = buffer[:len(ok_items)]
+            yield ok_items, batch, failed
+            chunk += 1
+
+
+def predict_batch(model, batch, batch_size=BATCH_SIZE):
+    """Run one forward pass, zero-padding ``batch`` up to a fixed size so shapes never change."""
+    count = len(batch)
+    if count < batch_size:
+        padded = np.zeros((batch_size,) + batch.shape[1:], dtype=np.float32)
+        padded[:count] = batch
+        batch = padded
+    return model.predict(batch)[:count]
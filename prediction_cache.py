@@ -0,0 +1,106 @@
+"""Process-wide LRU cache of predictions keyed by image content and model identity."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# Rough per-entry bookkeeping cost (key string, dicts, OrderedDict node).
+ENTRY_OVERHEAD_BYTES = 512
+
+CachedPrediction = namedtuple("CachedPrediction", ["probabilities", "timings", "nbytes"])
+
+
+def file_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return f"{path}:missing"
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def model_files(model_path):
+    """A backend's ``model_path`` as a tuple; composite backends give one path per file their outputs depend on."""
+    return (model_path,) if isinstance(model_path, (str, os.PathLike)) else tuple(model_path)
+
+
+def model_identity(model_path, labels_path):
+    """Short digest that changes whenever the model or labels file changes on disk."""
+    digest = hashlib.sha256()
+    for path in model_files(model_path):
+        digest.update(file_fingerprint(path).encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(file_fingerprint(labels_path).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def data_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(digest, identity):
+    """Key for raw bytes with ``data_digest`` ``digest`` under a model identity."""
+    return f"{digest}:{identity}"
+
+
+class PredictionCache:
+    """Thread-safe LRU bounded both by entry count and by approximate bytes held."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, probabilities, timings=None):
+        probabilities = probabilities.copy()
+        probabilities.setflags(write=False)
+        timings = dict(timings or {})
+        nbytes = probabilities.nbytes + len(key) + ENTRY_OVERHEAD_BYTES
+        entry = CachedPrediction(probabilities, timings, nbytes)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = entry
+            self._bytes += nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,154 @@
+"""Build post-training quantized TFLite variants and report accuracy vs latency.
+
+Usage:
+    python quantize_model.py --calibration-dir CALIB_DIR [--eval-dir EVAL_DIR] [--variants float16 int8]
+
+The calibration and evaluation images go through pipeline.preprocess_image,
+exactly like the app. The report compares every variant with the float32
+Keras model: per-class agreement over the labels.txt classes, batch-1
+latency, batch throughput and file size. Serve a variant by setting
+NEUROSCAN_MODEL_VARIANT=float16|int8.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import pipeline
+from backends import CONVERTED_MODEL_DIR, MODEL_VARIANTS, TFLiteBackend, converted_model_path
+from batch_score import iter_image_paths
+
+REPORT_NAME = "quantization_report.json"
+
+
+def load_images(directory, limit):
+    arrays = []
+    for path in iter_image_paths(directory):
+        if len(arrays) >= limit:
+            break
+        try:
+            with Image.open(path) as image:
+                arrays.append(pipeline.preprocess_image(image)[0])
+        except Exception as e:
+            print(f"warning: skipping {path}: {e}", file=sys.stderr)
+    if not arrays:
+        raise SystemExit(f"No readable images under {directory}")
+    return np.stack(arrays)
+
+
+def quantize(model, variant, calibration):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        def representative_dataset():
+            for sample in calibration:
+                yield [sample[np.newaxis]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    else:
+        raise ValueError(f"Unknown variant {variant!r}")
+    return converter.convert()
+
+
+def measure(predict, data, repeat):
+    predict(data[:1])
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        predict(data[i % len(data):i % len(data) + 1])
+        samples.append(time.perf_counter() - start)
+    batch = data[:pipeline.BATCH_SIZE]
+    start = time.perf_counter()
+    predict(batch)
+    throughput = len(batch) / (time.perf_counter() - start)
+    samples = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "throughput_ips": round(throughput, 1),
+    }
+
+
+def agreement_report(reference, probs, class_names):
+    ref_idx, idx = reference.argmax(1), probs.argmax(1)
+    per_class = {}
+    for c, name in enumerate(class_names):
+        mask = ref_idx == c
+        per_class[name] = {
+            "count": int(mask.sum()),
+            "agreement": round(float((idx[mask] == c).mean()), 4) if mask.any() else None,
+        }
+    return {
+        "top1_agreement": round(float((ref_idx == idx).mean()), 4),
+        "max_abs_diff": round(float(np.abs(reference - probs).max()), 5),
+        "per_class": per_class,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calibration-dir", required=True, help="Representative images for INT8 calibration")
+    parser.add_argument("--eval-dir", help="Images for the agreement report (default: calibration dir)")
+    parser.add_argument("--calibration-size", type=int, default=200)
+    parser.add_argument("--eval-size", type=int, default=500)
+    parser.add_argument("--variants", nargs="+", choices=MODEL_VARIANTS, default=list(MODEL_VARIANTS))
+    parser.add_argument("--model", default=pipeline.MODEL_PATH)
+    parser.add_argument("--labels", default=pipeline.LABELS_PATH)
+    parser.add_argument("--out-dir", default=CONVERTED_MODEL_DIR)
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    class_names = pipeline.read_labels(args.labels)
+    calibration = load_images(args.calibration_dir, args.calibration_size)
+    evaluation = load_images(args.eval_dir or args.calibration_dir, args.eval_size)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    model = pipeline.load_model(args.model)
+    reference = np.concatenate([np.asarray(model(evaluation[i:i + 32], training=False)) for i in range(0, len(evaluation), 32)])
+    report = {
+        "model": args.model,
+        "calibration_images": len(calibration),
+        "eval_images": len(evaluation),
+        "float32": {"size_mb": round(os.path.getsize(args.model) / 1e6, 3),
+                    **measure(lambda x: np.asarray(model(x, training=False)), evaluation, args.repeat)},
+    }
+
+    for variant in args.variants:
+        out_path = converted_model_path("tflite", args.model, args.out_dir, suffix=f"_{variant}")
+        with open(out_path, "wb") as f:
+            f.write(quantize(model, variant, calibration))
+        backend = TFLiteBackend(out_path)
+        probs = np.concatenate([backend.predict(evaluation[i:i + 32]) for i in range(0, len(evaluation), 32)])
+        report[variant] = {
+            "path": out_path,
+            "size_mb": round(os.path.getsize(out_path) / 1e6, 3),
+            **measure(backend.predict, evaluation, args.repeat),
+            **agreement_report(reference, probs, class_names),
+        }
+
+    report_path = os.path.join(args.out_dir, REPORT_NAME)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'variant':8} {'size MB':>8} {'p50 ms':>7} {'p99 ms':>7} {'img/s':>7} {'agree':>6}")
+    for name in ["float32", *args.variants]:
+        row = report[name]
+        print(f"{name:8} {row['size_mb']:8.2f} {row['p50_ms']:7.2f} {row['p99_ms']:7.2f} {row['throughput_ips']:7.1f} {row.get('top1_agreement', 1.0):6.3f}")
+        for label, stats in row.get("per_class", {}).items():
+            if stats["agreement"] is not None:
+                print(f"    {label}: {stats['agreement']:.3f} over {stats['count']}")
+    print(f"report written to {report_path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
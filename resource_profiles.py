@@ -0,0 +1,285 @@
+"""Deployment resource profiles and RSS-aware admission control.
+
+A profile sizes the process for its box when the model loads:
+
+  tiny       1-2 cores / <= 2 GB (Render starter-style instances)
+  standard   a few cores, default TF thread pools capped to the cores
+  many-core  16+ cores, split between a few concurrent inferences
+
+Each sets TensorFlow's intra/inter-op pools (TFLite and ONNX get
+``num_threads``), caps glibc malloc arenas and lowers its mmap/trim
+thresholds so large decode buffers go back to the OS instead of growing
+the heap, lowers pipeline.MAX_DECODE_PIXELS, and configures the
+``AdmissionController``: at most ``max_concurrent`` images are decoded and
+inferred at once, within a budget of decoded pixels, and new requests
+queue while resident memory is above the soft limit and are shed (raise
+``Overloaded``) above the hard limit, when the queue is full or after
+``queue_timeout`` seconds. The RSS limits are headroom above the RSS
+measured once the model is loaded and warmed (the baseline), never above
+``MEMORY_CEILING`` of the memory limit. Before the baseline is known only
+the ceiling applies.
+
+    NEUROSCAN_RESOURCE_PROFILE=auto     tiny, standard, many-core, auto or off
+    NEUROSCAN_MEMORY_LIMIT_MB=...       memory limit the ceiling applies to
+                                        (default: cgroup limit, else physical RAM)
+
+Explicit OMP_NUM_THREADS / TF_NUM_*_THREADS and NEUROSCAN_MAX_DECODE_PIXELS
+settings take precedence over the profile.
+"""
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import pipeline
+from metrics import Counter, Gauge, Histogram, REGISTRY, process_rss_bytes
+
+PROFILE_ENV = "NEUROSCAN_RESOURCE_PROFILE"
+MEMORY_LIMIT_ENV = "NEUROSCAN_MEMORY_LIMIT_MB"
+DEFAULT_PROFILE = "auto"
+PROFILE_NAMES = ("tiny", "standard", "many-core")
+# How often a queued request re-reads RSS; memory falls without anyone notifying
+RSS_POLL_INTERVAL = 0.1
+# Share of the memory limit RSS may reach whatever the headroom, short of the OOM killer
+MEMORY_CEILING = 0.95
+# glibc mallopt parameters
+M_TRIM_THRESHOLD = -1
+M_MMAP_THRESHOLD = -3
+M_ARENA_MAX = -8
+
+ADMISSIONS = REGISTRY.register(Counter("neuroscan_admissions_total", "Admission control decisions.", ("outcome",)))
+ADMISSION_WAIT = REGISTRY.register(Histogram("neuroscan_admission_wait_seconds", "Time requests spent queued for admission."))
+IN_FLIGHT = REGISTRY.register(Gauge("neuroscan_inferences_in_flight", "Admitted requests currently decoding or running."))
+
+ResourceProfile = namedtuple("ResourceProfile", [
+    "name", "intra_op_threads", "inter_op_threads", "max_concurrent", "pixel_budget", "max_decode_pixels",
+    "malloc_arena_max", "mmap_threshold", "trim_threshold", "max_queue", "queue_timeout", "rss_soft_headroom",
+    "rss_hard_headroom",
+])
+
+
+class Overloaded(RuntimeError):
+    """Request shed by admission control; safe to retry later."""
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memory_limit_bytes():
+    """Memory the process may use: NEUROSCAN_MEMORY_LIMIT_MB, the cgroup limit, or physical RAM."""
+    if os.environ.get(MEMORY_LIMIT_ENV):
+        return int(float(os.environ[MEMORY_LIMIT_ENV]) * 1024 * 1024)
+    physical = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # "max" (v2) or a huge sentinel (v1) mean unlimited
+        if value.isdigit() and int(value) < physical:
+            return int(value)
+    return physical
+
+
+def build_profile(name, cpus=None):
+    cpus = cpus or available_cpus()
+    if name == "tiny":
+        return ResourceProfile(name, 1, 1, 1, 16_000_000, 16_000_000, 1, 1 << 20, 8 << 20, 16, 10.0, 64 << 20, 160 << 20)
+    if name == "standard":
+        return ResourceProfile(name, min(cpus, 4), 1, 2, 64_000_000, 64_000_000, 2, 4 << 20, 32 << 20, 16, 20.0,
+                               256 << 20, 512 << 20)
+    if name == "many-core":
+        concurrent = max(2, cpus // 8)
+        # glibc picks the mmap threshold dynamically when it is left alone
+        return ResourceProfile(name, max(1, cpus // concurrent), 2, concurrent, 64_000_000 * concurrent, 64_000_000,
+                               4, None, None, 16 * concurrent, 30.0, (256 << 20) * concurrent, (512 << 20) * concurrent)
+    raise ValueError(f"Unknown resource profile {name!r}; expected one of {', '.join(PROFILE_NAMES)}, auto or off")
+
+
+def auto_profile_name(cpus=None, memory=None):
+    cpus = cpus or available_cpus()
+    memory = memory or memory_limit_bytes()
+    if cpus <= 2 or memory <= 2 << 30:
+        return "tiny"
+    return "many-core" if cpus >= 16 else "standard"
+
+
+def profile_from_env():
+    """The configured profile, or None when ``NEUROSCAN_RESOURCE_PROFILE=off``."""
+    name = os.environ.get(PROFILE_ENV, DEFAULT_PROFILE).lower()
+    if name in ("off", "0", "false", "none"):
+        return None
+    return build_profile(auto_profile_name() if name == "auto" else name)
+
+
+def _libc():
+    path = ctypes.util.find_library("c")
+    try:
+        libc = ctypes.CDLL(path)
+        return libc if hasattr(libc, "mallopt") else None
+    except (OSError, TypeError):
+        return None
+
+
+def configure_allocator(profile):
+    """Apply the profile's glibc malloc limits; False where mallopt is unavailable (musl, macOS, jemalloc)."""
+    libc = _libc()
+    if libc is None:
+        return False
+    ok = bool(libc.mallopt(M_ARENA_MAX, profile.malloc_arena_max))
+    if profile.mmap_threshold is not None:
+        ok = bool(libc.mallopt(M_MMAP_THRESHOLD, profile.mmap_threshold)) and ok
+    if profile.trim_threshold is not None:
+        ok = bool(libc.mallopt(M_TRIM_THRESHOLD, profile.trim_threshold)) and ok
+    return ok
+
+
+def release_free_memory():
+    """Return freed heap pages to the OS (glibc malloc_trim); no-op elsewhere."""
+    libc = _libc()
+    if libc is not None and hasattr(libc, "malloc_trim"):
+        libc.malloc_trim(0)
+
+
+def apply_profile(profile, backend_name):
+    """Configure threads, allocator and input limits before the model loads; returns backend kwargs."""
+    os.environ.setdefault("OMP_NUM_THREADS", str(profile.intra_op_threads))
+    os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(profile.intra_op_threads))
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", str(profile.inter_op_threads))
+    if "NEUROSCAN_MAX_DECODE_PIXELS" not in os.environ:
+        # Caps the size after JPEG draft downscaling, so large photos still fit
+        pipeline.MAX_DECODE_PIXELS = profile.max_decode_pixels
+    configure_allocator(profile)
+    if backend_name == "keras":
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(int(os.environ["TF_NUM_INTRAOP_THREADS"]))
+            tf.config.threading.set_inter_op_parallelism_threads(int(os.environ["TF_NUM_INTEROP_THREADS"]))
+        except RuntimeError as e:
+            # TensorFlow only takes thread settings before its runtime starts
+            print(f"resource profile: thread pools not applied: {e}", file=sys.stderr)
+        return {}
+    if backend_name in ("tflite", "onnx"):
+        return {"num_threads": int(os.environ["TF_NUM_INTRAOP_THREADS"])}
+    # Proxy backends size their own processes
+    return {}
+
+
+class AdmissionController:
+    """Bounds concurrent decode + inference work by count, decoded pixels and process RSS."""
+
+    def __init__(self, profile, memory_limit=None, rss=process_rss_bytes, baseline=None):
+        """``baseline`` returns the RSS after model load in bytes, or None while the model is loading."""
+        self.profile = profile
+        self.ceiling = int((memory_limit or memory_limit_bytes()) * MEMORY_CEILING)
+        self._baseline = baseline or (lambda: None)
+        self._rss = rss
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.pixels_in_flight = 0
+        self.waiting = 0
+        self.admitted = self.queued = self.shed = 0
+        self.shed_reasons = {}
+
+    @property
+    def soft_limit(self):
+        baseline = self._baseline()
+        return self.ceiling if baseline is None else min(baseline + self.profile.rss_soft_headroom, self.ceiling)
+
+    @property
+    def hard_limit(self):
+        baseline = self._baseline()
+        return self.ceiling if baseline is None else min(baseline + self.profile.rss_hard_headroom, self.ceiling)
+
+    def _fits(self, pixels, rss):
+        if self.in_flight == 0:
+            # An idle process always admits one request, or an oversized one could never run
+            return True
+        return (self.in_flight < self.profile.max_concurrent and rss < self.soft_limit
+                and self.pixels_in_flight + pixels <= self.profile.pixel_budget)
+
+    def _shed(self, reason):
+        self.shed += 1
+        self.shed_reasons[reason] = self.shed_reasons.get(reason, 0) + 1
+        ADMISSIONS.inc(outcome=f"shed_{reason}")
+        raise Overloaded(f"Server busy ({reason.replace('_', ' ')}); please retry in a moment")
+
+    def admit(self, pixels=0):
+        """Wait for a slot for one request decoding ``pixels`` source pixels; raises Overloaded when shed.
+
+        Returns an ``AdmissionSlot``; use it as a context manager to release it.
+        """
+        start = time.perf_counter()
+        with self._condition:
+            rss = self._rss()
+            if rss >= self.hard_limit:
+                if self.in_flight:
+                    self._shed("memory")
+                # Nothing of ours is running, so the excess is baseline (model, caches): serve one at a time
+                release_free_memory()
+            if not self._fits(pixels, rss):
+                if self.waiting >= self.profile.max_queue:
+                    self._shed("queue_full")
+                self.waiting += 1
+                self.queued += 1
+                ADMISSIONS.inc(outcome="queued")
+                try:
+                    deadline = start + self.profile.queue_timeout
+                    while not self._fits(pixels, self._rss()):
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            self._shed("timeout")
+                        self._condition.wait(min(remaining, RSS_POLL_INTERVAL))
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.pixels_in_flight += pixels
+            self.admitted += 1
+            IN_FLIGHT.set(self.in_flight)
+        ADMISSIONS.inc(outcome="admitted")
+        ADMISSION_WAIT.observe(time.perf_counter() - start)
+        return AdmissionSlot(self, pixels)
+
+    def _release(self, pixels):
+        with self._condition:
+            self.in_flight -= 1
+            self.pixels_in_flight -= pixels
+            idle = self.in_flight == 0
+            IN_FLIGHT.set(self.in_flight)
+            self._condition.notify_all()
+        if idle and self._rss() >= self.soft_limit:
+            release_free_memory()
+
+    def stats(self):
+        with self._condition:
+            return {"profile": self.profile.name, "in_flight": self.in_flight, "waiting": self.waiting,
+                    "admitted": self.admitted, "queued": self.queued, "shed": self.shed,
+                    "shed_reasons": dict(self.shed_reasons),
+                    "rss_mb": round(self._rss() / 1e6), "soft_limit_mb": round(self.soft_limit / 1e6),
+                    "hard_limit_mb": round(self.hard_limit / 1e6)}
+
+
+class AdmissionSlot:
+    def __init__(self, controller, pixels):
+        self._controller = controller
+        self._pixels = pixels
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._controller._release(self._pixels)
+
+
+def admission_from_env(baseline=None):
+    """Admission control for the configured profile, or None when profiles are off."""
+    profile = profile_from_env()
+    return AdmissionController(profile, baseline=baseline) if profile is not None else None
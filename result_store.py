@@ -0,0 +1,215 @@
+"""Persistent prediction store with exact and near-duplicate lookup.
+
+Results survive restarts in a SQLite (WAL) file keyed by the SHA-256 of the
+uploaded bytes and by a 64-bit perceptual hash (DCT pHash) of the
+preprocessed 224x224 image, both scoped to a model version so entries made
+with an older model or labels file never match. Near duplicates (camera
+captures of the same film) are found by Hamming distance over an in-memory
+array of hashes per model version.
+
+    NEUROSCAN_RESULT_STORE=path.sqlite3   store location ("off" disables it)
+    NEUROSCAN_PHASH_MAX_DISTANCE=4        near-duplicate threshold in bits (0 = exact only)
+"""
+import functools
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from metrics import Counter, REGISTRY
+from prediction_cache import file_fingerprint, model_files
+
+STORE_PATH_ENV = "NEUROSCAN_RESULT_STORE"
+MAX_DISTANCE_ENV = "NEUROSCAN_PHASH_MAX_DISTANCE"
+DEFAULT_STORE_PATH = "results.sqlite3"
+DEFAULT_MAX_DISTANCE = 4
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+STORE_LOOKUPS = REGISTRY.register(Counter("neuroscan_result_store_lookups_total", "Persistent result store lookups.", ("result",)))
+
+StoredResult = namedtuple("StoredResult", ["probabilities", "distance"])
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+_BIT_WEIGHTS = (1 << np.arange(HASH_SIZE * HASH_SIZE - 1, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+
+def perceptual_hash(image):
+    """64-bit DCT hash of a preprocessed ``(224, 224, 3)`` (or batched ``(1, ...)``) image."""
+    gray = np.asarray(image, dtype=np.float32).reshape(-1, *np.shape(image)[-3:])[0].mean(axis=2)
+    height, width = gray.shape
+    # 224 = 32 * 7, so an exact block mean gives the 32x32 thumbnail
+    small = gray[:height - height % DCT_SIZE, :width - width % DCT_SIZE]
+    small = small.reshape(DCT_SIZE, height // DCT_SIZE, DCT_SIZE, width // DCT_SIZE).mean(axis=(1, 3))
+    low = (_DCT @ small @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])
+    return int((bits.astype(np.uint64) * _BIT_WEIGHTS).sum())
+
+
+def hamming_distances(hashes, value):
+    """Bit distance from ``value`` to each entry of a uint64 array."""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@functools.lru_cache(maxsize=16)
+def _model_version(fingerprints, model_paths, labels_path):
+    digest = hashlib.sha256()
+    for path in (*model_paths, labels_path):
+        digest.update(_file_sha256(path).encode("ascii") if os.path.exists(path) else b"missing")
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def model_version(model_path, labels_path):
+    """Content digest of the model and labels files (stable across restarts and redeploys)."""
+    paths = model_files(model_path)
+    fingerprints = tuple(file_fingerprint(path) for path in (*paths, labels_path))
+    return _model_version(fingerprints, paths, labels_path)
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class _HashIndex:
+    """In-memory perceptual hashes of one model version, in a capacity-doubling array."""
+
+    def __init__(self, rows):
+        self.size = len(rows)
+        self.hashes = np.empty(max(self.size, 16), dtype=np.uint64)
+        self.hashes[:self.size] = [phash & 0xFFFFFFFFFFFFFFFF for _, phash, _ in rows]
+        self.probabilities = [np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows]
+        # digest -> position, so INSERT OR REPLACE updates its entry instead of adding a second one
+        self.positions = {digest: i for i, (digest, _, _) in enumerate(rows)}
+
+    def put(self, digest, phash, probabilities):
+        position = self.positions.get(digest)
+        if position is None:
+            if self.size == len(self.hashes):
+                self.hashes = np.concatenate([self.hashes, np.empty(len(self.hashes), dtype=np.uint64)])
+            position = self.positions[digest] = self.size
+            self.size += 1
+            self.probabilities.append(probabilities)
+        else:
+            self.probabilities[position] = probabilities
+        self.hashes[position] = phash
+
+    def active(self):
+        return self.hashes[:self.size]
+
+
+class ResultStore:
+    """Thread-safe SQLite-backed store; one instance per process."""
+
+    def __init__(self, path=None, max_distance=None):
+        self.path = path or os.environ.get(STORE_PATH_ENV) or DEFAULT_STORE_PATH
+        if max_distance is None:
+            max_distance = int(os.environ.get(MAX_DISTANCE_ENV, DEFAULT_MAX_DISTANCE))
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " sha256 TEXT NOT NULL, model TEXT NOT NULL, phash INTEGER NOT NULL,"
+            " probabilities BLOB NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (sha256, model))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_model ON results (model)")
+        # model version -> _HashIndex
+        self._hash_index = {}
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _index(self, model):
+        index = self._hash_index.get(model)
+        if index is None:
+            rows = self._conn.execute("SELECT sha256, phash, probabilities FROM results WHERE model = ?", (model,)).fetchall()
+            index = self._hash_index[model] = _HashIndex(rows)
+        return index
+
+    def get(self, digest, model):
+        """Exact match on the raw-bytes digest; call before decoding the image."""
+        with self._lock:
+            row = self._conn.execute("SELECT probabilities FROM results WHERE sha256 = ? AND model = ?",
+                                     (digest, model)).fetchone()
+            if row is None:
+                return None
+            self.exact_hits += 1
+        STORE_LOOKUPS.inc(result="exact")
+        return StoredResult(np.frombuffer(row[0], dtype=np.float32), 0)
+
+    def get_near(self, phash, model):
+        """Closest stored image within ``max_distance`` bits, or None (counted as a miss)."""
+        with self._lock:
+            if self.max_distance > 0:
+                index = self._index(model)
+                if index.size:
+                    distances = hamming_distances(index.active(), phash)
+                    best = int(np.argmin(distances))
+                    if distances[best] <= self.max_distance:
+                        self.near_hits += 1
+                        STORE_LOOKUPS.inc(result="near")
+                        return StoredResult(index.probabilities[best], int(distances[best]))
+            self.misses += 1
+        STORE_LOOKUPS.inc(result="miss")
+        return None
+
+    def put(self, digest, model, phash, probabilities):
+        probabilities = np.ascontiguousarray(probabilities, dtype=np.float32)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                               (digest, model, _to_signed(phash), probabilities.tobytes(), time.time()))
+            if model in self._hash_index:
+                self._hash_index[model].put(digest, phash, probabilities)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self):
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "entries": len(self),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.near_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_store_from_env():
+    """The configured store, or None when ``NEUROSCAN_RESULT_STORE=off``."""
+    if os.environ.get(STORE_PATH_ENV, "").lower() in ("off", "0", "false"):
+        return None
+    try:
+        return ResultStore()
+    except (sqlite3.Error, OSError) as e:
+        print(f"result store disabled: {e}", file=sys.stderr)
+        return None
@@ -0,0 +1,99 @@
+"""Background model loading and warm-up so the UI can render before TensorFlow is ready.
+
+The resource profile (resource_profiles.py) is applied between importing the
+runtime and loading the model, while thread pool sizes can still be set.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import pipeline
+from backends import backend_class, expected_model_path, resolve_backend_name
+from metrics import MODEL_LOAD_SECONDS, process_rss_bytes
+from resource_profiles import apply_profile, profile_from_env
+
+BACKGROUND_LOAD_ENV = "NEUROSCAN_BACKGROUND_LOAD"
+WARMUP_BATCH_SIZES = (1, pipeline.BATCH_SIZE)
+
+
+def background_load_enabled():
+    return os.environ.get(BACKGROUND_LOAD_ENV, "1").lower() not in ("0", "false", "no")
+
+
+class ModelLoader:
+    """Imports the backend runtime, loads the model and runs warm-up passes in a thread.
+
+    Every phase is timed into ``timings`` (seconds). ``result()`` blocks until
+    the model is ready and returns ``(model, class_names)``, re-raising any
+    load error in the caller.
+    """
+
+    def __init__(self, labels_path=pipeline.LABELS_PATH, warmup_batch_sizes=WARMUP_BATCH_SIZES, background=True):
+        self.labels_path = labels_path
+        # Known before loading so stored results can be served meanwhile
+        self._expected_model_path = expected_model_path()
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.profile = None
+        # Resident memory once loaded and warmed: the baseline admission control adds headroom to
+        self.rss_after_load = None
+        self.timings = {}
+        self._created = time.perf_counter()
+        self._ready = threading.Event()
+        self._result = None
+        self._error = None
+        if background:
+            threading.Thread(target=self._run, name="model-loader", daemon=True).start()
+        else:
+            self._run()
+
+    @contextmanager
+    def _phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def _run(self):
+        try:
+            name = resolve_backend_name()
+            with self._phase("import_runtime"):
+                backend_class(name).import_runtime()
+            self.profile = profile_from_env()
+            backend_kwargs = apply_profile(self.profile, name) if self.profile else {}
+            with self._phase("load_model"):
+                model, class_names = pipeline.load_model_and_labels(labels_path=self.labels_path, backend=name, **backend_kwargs)
+            with self._phase("warmup"):
+                for batch_size in self.warmup_batch_sizes:
+                    model.predict(np.zeros((batch_size, *pipeline.IMAGE_SIZE, 3), dtype=np.float32))
+            self.rss_after_load = process_rss_bytes()
+            self._result = (model, class_names)
+            self.timings["total"] = time.perf_counter() - self._created
+            for phase, seconds in self.timings.items():
+                MODEL_LOAD_SECONDS.set(seconds, phase=phase)
+            profile = f" [{self.profile.name} profile]" if self.profile else ""
+            print("model ready: " + ", ".join(f"{k}={v:.2f}s" for k, v in self.timings.items()) + profile, file=sys.stderr)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._ready.set()
+
+    @property
+    def model_path(self):
+        # Read through to the backend once loaded: a registry backend's path follows its active version
+        return self._result[0].model_path if self._result is not None else self._expected_model_path
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def result(self, timeout=None):
+        if not self._ready.wait(timeout):
+            raise TimeoutError("Model is still loading")
+        if self._error is not None:
+            raise self._error
+        return self._result
@@ -0,0 +1,77 @@
+"""End-to-end check of distributed_score.py: a worker killed mid-job costs nothing and duplicates nothing."""
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("tensorflow")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGES = 48
+SHARD_SIZE = 4
+
+
+def make_fixture(directory):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(IMAGES):
+        path = os.path.join(directory, f"scan_{i:03d}.png")
+        Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+    # Undecodable files still get exactly one (error) record
+    corrupt = os.path.join(directory, "corrupt.png")
+    with open(corrupt, "wb") as f:
+        f.write(b"not a png")
+    return paths + [corrupt]
+
+
+def kill_worker_holding_lease(job_dir, worker_id, timeout):
+    """SIGKILL ``worker_id`` while it holds a shard lease; returns the pid, or None if it never held one."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for lease_path in glob.glob(os.path.join(job_dir, "leases", "*.lease")):
+            try:
+                with open(lease_path) as f:
+                    lease = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if lease.get("worker") == worker_id:
+                os.kill(lease["pid"], signal.SIGKILL)
+                return lease["pid"]
+        time.sleep(0.01)
+    return None
+
+
+def test_killed_worker_leaves_one_record_per_path(tmp_path):
+    source = tmp_path / "scans"
+    source.mkdir()
+    expected = {os.path.abspath(path) for path in make_fixture(str(source))}
+    job_dir, output = str(tmp_path / "job"), str(tmp_path / "results.jsonl")
+    run = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "distributed_score.py"), "run", str(source), job_dir, "-o", output,
+         "--backend", "keras", "--local-workers", "2", "--shard-size", str(SHARD_SIZE),
+         "--lease-timeout", "3", "--heartbeat", "0.5"],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        killed = kill_worker_holding_lease(job_dir, "local-0", timeout=300)
+        log, _ = run.communicate(timeout=600)
+    finally:
+        if run.poll() is None:
+            run.kill()
+    assert killed is not None, "worker local-0 never claimed a shard"
+    assert run.returncode == 0, log
+    assert "1 local workers exited with an error" in log
+
+    with open(output) as f:
+        records = [json.loads(line) for line in f]
+    paths = [record["path"] for record in records]
+    assert len(paths) == len(set(paths)), "a path was recorded more than once"
+    assert set(paths) == expected
+    assert sum("error" in record for record in records) == 1
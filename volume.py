@@ -0,0 +1,252 @@
+"""Slice-wise screening of 3D MRI volumes (NIfTI-1 or raw) without loading them whole.
+
+The voxel data is memory-mapped; axial slices are windowed to 8 bits,
+pushed through the same preprocess_image normalization as single images and
+scored in batches with pipeline.iter_batches, so memory stays bounded by the
+batch ring however large the volume is. Gzipped NIfTI is decompressed to a
+temporary file in chunks first.
+
+Usage:
+    python volume.py scan.nii.gz [--top 5] [--backend tflite]
+    python volume.py scan.raw --shape 256 256 180 --dtype int16
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+import pipeline
+from mri_gate import NOT_MRI_LABEL
+
+TUMOR_LABEL = "Yes Have a Tumor in Brain Scan"
+VOLUME_EXTENSIONS = (".nii", ".nii.gz", ".raw")
+NIFTI_HEADER_SIZE = 348
+NIFTI_DTYPES = {
+    2: np.uint8, 4: np.int16, 8: np.int32, 16: np.float32, 64: np.float64,
+    256: np.int8, 512: np.uint16, 768: np.uint32, 1024: np.int64, 1280: np.uint64,
+}
+# Window from these percentiles of a strided voxel sample
+WINDOW_PERCENTILES = (0.5, 99.5)
+WINDOW_SAMPLE_SLICES = 32
+# Slices whose windowed content covers less than this fraction are skipped
+MIN_FOREGROUND_FRACTION = 0.02
+FOREGROUND_LEVEL = 32
+TOP_K = 3
+# Top-k mean tumour probability at or above which the volume is called a tumour
+TUMOR_THRESHOLD = 0.5
+COPY_CHUNK_BYTES = 4 * 1024 * 1024
+
+Volume = namedtuple("Volume", ["data", "spacing", "scale", "path"])
+VolumeResult = namedtuple("VolumeResult", [
+    "class_index", "volume_probabilities", "slice_indices", "slice_probabilities",
+    "top_slices", "skipped", "failed", "total_slices", "seconds", "tumor_score",
+])
+
+
+class VolumeFormatError(ValueError):
+    pass
+
+
+class EmptySliceError(ValueError):
+    pass
+
+
+def read_nifti_header(path):
+    """``(shape, dtype, spacing, vox_offset, slope, intercept, data_path)`` from a NIfTI-1 header."""
+    with open(path, "rb") as f:
+        header = f.read(NIFTI_HEADER_SIZE)
+    if len(header) < NIFTI_HEADER_SIZE:
+        raise VolumeFormatError(f"{path} is too short for a NIfTI-1 header")
+    for endian in "<>":
+        if struct.unpack(endian + "i", header[:4])[0] == NIFTI_HEADER_SIZE:
+            break
+    else:
+        raise VolumeFormatError(f"{path} is not a NIfTI-1 file")
+    if header[344:347] not in (b"n+1", b"ni1"):
+        raise VolumeFormatError(f"{path} has an unknown NIfTI magic {header[344:348]!r}")
+    dim = struct.unpack(endian + "8h", header[40:56])
+    datatype, = struct.unpack(endian + "h", header[70:72])
+    pixdim = struct.unpack(endian + "8f", header[76:108])
+    vox_offset, slope, intercept = struct.unpack(endian + "3f", header[108:120])
+    if datatype not in NIFTI_DTYPES:
+        raise VolumeFormatError(f"Unsupported NIfTI datatype {datatype}")
+    if dim[0] < 3:
+        raise VolumeFormatError(f"Expected a 3D volume, got {dim[0]} dimensions")
+    shape = tuple(max(d, 1) for d in dim[1:dim[0] + 1])
+    dtype = np.dtype(NIFTI_DTYPES[datatype]).newbyteorder(endian)
+    if header[344:347] == b"ni1":
+        # Header/image pair: voxels live in the matching .img file from offset 0
+        path = os.path.splitext(path)[0] + ".img"
+    return shape, dtype, tuple(pixdim[1:4]), int(vox_offset), slope, intercept, path
+
+
+def decompress_to(path, directory):
+    """Stream-decompress ``path`` (.gz) into ``directory`` and return the new file's path."""
+    target = os.path.join(directory, os.path.basename(path)[:-3])
+    with gzip.open(path, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+    return target
+
+
+def open_volume(path, shape=None, dtype=None, offset=0):
+    """Memory-map a ``.nii`` file, or a ``.raw`` file given ``shape`` (x, y, z) and ``dtype``.
+
+    Gzipped files must be decompressed first (see ``decompress_to``). Extra
+    dimensions beyond the third (e.g. time) are reduced to their first index.
+    """
+    if path.endswith(".raw"):
+        if shape is None or dtype is None:
+            raise VolumeFormatError("Raw volumes need an explicit shape and dtype")
+        data = np.memmap(path, dtype=np.dtype(dtype), mode="r", offset=offset, shape=tuple(shape), order="F")
+        return Volume(data, (1.0, 1.0, 1.0), None, path)
+    shape, dtype, spacing, vox_offset, slope, intercept, data_path = read_nifti_header(path)
+    expected = int(np.prod(shape)) * dtype.itemsize + vox_offset
+    if os.path.getsize(data_path) < expected:
+        raise VolumeFormatError(f"{data_path} is truncated: {os.path.getsize(data_path)} < {expected} bytes")
+    data = np.memmap(data_path, dtype=dtype, mode="r", offset=vox_offset, shape=shape, order="F")
+    if data.ndim > 3:
+        data = data[(slice(None),) * 3 + (0,) * (data.ndim - 3)]
+    scale = (slope, intercept) if slope not in (0.0, 1.0) or intercept != 0.0 else None
+    return Volume(data, spacing, scale, path)
+
+
+def auto_window(volume):
+    """``(low, high)`` intensity window from a strided sample of at most WINDOW_SAMPLE_SLICES slices."""
+    depth = volume.data.shape[2]
+    step = max(1, depth // WINDOW_SAMPLE_SLICES)
+    sample = np.concatenate([np.asarray(volume.data[::4, ::4, k], dtype=np.float32).ravel() for k in range(0, depth, step)])
+    sample = sample[np.isfinite(sample)]
+    if not sample.size:
+        return 0.0, 1.0
+    low, high = np.percentile(sample, WINDOW_PERCENTILES)
+    return float(low), float(high if high > low else low + 1)
+
+
+def window_slice(volume, index, window):
+    """Axial slice ``index`` as an 8-bit image in display orientation (anterior up)."""
+    low, high = window
+    voxels = np.asarray(volume.data[:, :, index], dtype=np.float32)
+    # The slope/intercept rescale is linear, so the window is applied to stored values
+    scaled = np.clip((voxels - low) * (255.0 / (high - low)), 0, 255)
+    return np.ascontiguousarray(np.flipud(scaled.T)).astype(np.uint8)
+
+
+def slice_image(volume, index, window):
+    return Image.fromarray(window_slice(volume, index, window), "L")
+
+
+def has_foreground(pixels):
+    return (pixels > FOREGROUND_LEVEL).mean() >= MIN_FOREGROUND_FRACTION
+
+
+def score_volume(volume, model, class_names, window=None, top=5, batch_size=pipeline.BATCH_SIZE,
+                 workers=pipeline.DECODE_WORKERS, progress=None):
+    """Score every non-empty axial slice and aggregate to a volume-level verdict.
+
+    Tumour presence is decided from the tumour column alone: the mean of its
+    ``TOP_K`` highest slices (``tumor_score``) against ``TUMOR_THRESHOLD``, so
+    a tumour visible on a few slices is not diluted by the rest of the brain.
+    ``volume_probabilities`` are then averaged over one set of slices: those
+    top-k slices for a tumour, otherwise every scored slice. ``skipped`` lists
+    empty slices, ``failed`` ``(index, error)`` for slices that could not be
+    decoded. ``progress(done, total)`` is called after every batch.
+    """
+    window = window or auto_window(volume)
+    depth = volume.data.shape[2]
+    skipped, failures = [], []
+
+    def decode(index, out):
+        pixels = window_slice(volume, index, window)
+        if not has_foreground(pixels):
+            raise EmptySliceError("empty slice")
+        pipeline.preprocess_image(Image.fromarray(pixels, "L"), out)
+
+    start = time.perf_counter()
+    indices, chunks, done = [], [], 0
+    for ok, batch, failed in pipeline.iter_batches(range(depth), decode, batch_size, workers):
+        if batch is not None:
+            chunks.append(pipeline.predict_batch(model, batch, batch_size))
+            indices.extend(ok)
+        for index, error in failed:
+            if isinstance(error, EmptySliceError):
+                skipped.append(index)
+            else:
+                failures.append((index, f"{type(error).__name__}: {error}"))
+        done += len(ok) + len(failed)
+        if progress is not None:
+            progress(done, depth)
+    seconds = time.perf_counter() - start
+
+    probabilities = np.concatenate(chunks) if chunks else np.zeros((0, len(class_names)), dtype=np.float32)
+    k = min(TOP_K, len(probabilities))
+    tumor = next((i for i, name in enumerate(class_names) if TUMOR_LABEL in name), None)
+    not_mri = next((i for i, name in enumerate(class_names) if NOT_MRI_LABEL in name), None)
+    order = np.argsort(probabilities[:, tumor])[::-1] if tumor is not None and k else np.arange(len(probabilities))
+    tumor_score = float(probabilities[order[:k], tumor].mean()) if tumor is not None and k else None
+    if not k:
+        class_index, volume_probabilities = None, np.zeros(len(class_names), dtype=np.float32)
+    elif not_mri is not None and (probabilities.argmax(axis=1) == not_mri).mean() > 0.5:
+        # Mostly non-brain content (e.g. a mis-oriented or non-MRI volume)
+        class_index, volume_probabilities = not_mri, probabilities.mean(axis=0)
+    elif tumor_score is not None and tumor_score >= TUMOR_THRESHOLD:
+        class_index, volume_probabilities = tumor, probabilities[order[:k]].mean(axis=0)
+    else:
+        volume_probabilities = probabilities.mean(axis=0)
+        others = [i for i in range(len(class_names)) if i != tumor]
+        class_index = others[int(np.argmax(volume_probabilities[others]))]
+    top_slices = [(indices[i], float(probabilities[i, tumor])) for i in order[:top]] if tumor is not None else []
+    return VolumeResult(class_index, volume_probabilities, indices, probabilities, top_slices,
+                        sorted(skipped), sorted(failures), depth, seconds, tumor_score)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help=".nii, .nii.gz or .raw volume")
+    parser.add_argument("--shape", type=int, nargs=3, help="x y z for raw volumes")
+    parser.add_argument("--dtype", help="numpy dtype for raw volumes, e.g. int16")
+    parser.add_argument("--offset", type=int, default=0, help="Header bytes to skip in raw volumes")
+    parser.add_argument("--window", type=float, nargs=2, help="Intensity window low high (default: auto)")
+    parser.add_argument("--top", type=int, default=5, help="Most suspicious slices to report")
+    parser.add_argument("--backend", help="Inference backend; defaults to $NEUROSCAN_BACKEND or keras")
+    parser.add_argument("--labels", default=pipeline.LABELS_PATH)
+    parser.add_argument("--batch-size", type=int, default=pipeline.BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    model, class_names = pipeline.load_model_and_labels(labels_path=args.labels, backend=args.backend)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = decompress_to(args.path, tmp) if args.path.endswith(".gz") else args.path
+        volume = open_volume(path, args.shape, args.dtype, args.offset)
+        window = args.window
+        if window and volume.scale:
+            # Windows are given in scaled units; slices are windowed on stored values
+            slope, intercept = volume.scale
+            window = sorted((w - intercept) / slope for w in window)
+        result = score_volume(volume, model, class_names, window, args.top, args.batch_size)
+        del volume
+    scored = len(result.slice_indices)
+    print(json.dumps({
+        "path": args.path,
+        "class": class_names[result.class_index] if result.class_index is not None else None,
+        "volume_probabilities": {n: round(float(p), 6) for n, p in zip(class_names, result.volume_probabilities)},
+        "top_slices": [{"slice": i, "tumor_probability": round(p, 6)} for i, p in result.top_slices],
+        "slices": result.total_slices,
+        "scored": scored,
+        "tumor_score": round(result.tumor_score, 6) if result.tumor_score is not None else None,
+        "skipped": len(result.skipped),
+        "failed": [{"slice": i, "error": error} for i, error in result.failed],
+    }, indent=2))
+    print(f"{scored} slices in {result.seconds:.2f}s ({scored / result.seconds if result.seconds else 0:.1f} slices/s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
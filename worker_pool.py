@@ -0,0 +1,349 @@
+"""Multi-process inference with shared-memory input buffers.
+
+One TensorFlow process stops scaling well past a few cores for a model this
+small, so the pool runs N worker processes, each with its own backend and a
+small intra-op thread budget. Preprocessed tensors travel through a ring of
+shared-memory slots: the parent copies a batch into a slot (or, with
+``reserve``, the caller decodes straight into it), workers read it in place,
+and only the request id, slot index and the tiny probability array cross the
+process queues.
+
+Use it as ``NEUROSCAN_BACKEND=pool`` (app, batch_score.py, inference_server.py)
+with ``NEUROSCAN_POOL_WORKERS``, ``NEUROSCAN_POOL_THREADS`` and
+``NEUROSCAN_POOL_BACKEND`` (the backend each worker runs, default keras).
+``predict`` gives up after ``NEUROSCAN_POOL_TIMEOUT`` seconds (default 120);
+a request that times out marks its workers as hung, so the pool is torn down
+and PoolBackend starts a fresh one on the next call.
+"""
+import atexit
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import pipeline
+
+WORKERS_ENV = "NEUROSCAN_POOL_WORKERS"
+THREADS_ENV = "NEUROSCAN_POOL_THREADS"
+WORKER_BACKEND_ENV = "NEUROSCAN_POOL_BACKEND"
+TIMEOUT_ENV = "NEUROSCAN_POOL_TIMEOUT"
+DEFAULT_TIMEOUT = 120.0
+SLOTS_PER_WORKER = 2
+STARTUP_TIMEOUT = 600.0
+INPUT_SHAPE = (*pipeline.IMAGE_SIZE[::-1], 3)
+
+
+def default_workers():
+    return int(os.environ.get(WORKERS_ENV) or os.cpu_count() or 1)
+
+
+def default_threads(workers):
+    return int(os.environ.get(THREADS_ENV) or max(1, (os.cpu_count() or 1) // workers))
+
+
+def _configure_threads(backend_name, threads):
+    # Must happen before the runtime creates its thread pools
+    for var in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    if backend_name == "keras":
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+        return {}
+    return {"num_threads": threads}
+
+
+def _worker_main(worker_id, backend_name, model_path, threads, shm_name, slot_shape, tasks, results):
+    from backends import create_backend
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        slots = np.ndarray(slot_shape, dtype=np.float32, buffer=shm.buf)
+        try:
+            kwargs = _configure_threads(backend_name, threads)
+            backend = create_backend(backend_name, model_path, **kwargs)
+            backend.predict(np.zeros((1, *INPUT_SHAPE), np.float32))
+        except Exception as e:
+            results.put(("ready", worker_id, f"{type(e).__name__}: {e}", None))
+            return
+        results.put(("ready", worker_id, None, backend.model_path))
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            request_id, slot, count = task
+            try:
+                results.put(("ok", request_id, np.asarray(backend.predict(slots[slot, :count]), dtype=np.float32)))
+            except Exception as e:
+                results.put(("error", request_id, f"{type(e).__name__}: {e}"))
+    finally:
+        del slots
+        shm.close()
+
+
+class WorkerPool:
+    """``num_workers`` inference processes fed through a ring of shared-memory slots.
+
+    Each slot holds up to ``slot_size`` images. The default ring has two slots
+    per worker plus enough for ``reserve`` to hold a pipeline.iter_batches
+    decode ring. ``predict`` is thread-safe; concurrent callers keep every
+    worker busy.
+    """
+
+    def __init__(self, num_workers=None, backend=None, model_path=None, threads_per_worker=None,
+                 slot_size=pipeline.BATCH_SIZE, num_slots=None):
+        from backends import DEFAULT_BACKEND, VARIANT_ENV
+        self.num_workers = num_workers or default_workers()
+        # Quantized variants only exist as TFLite files
+        default = "tflite" if os.environ.get(VARIANT_ENV) else DEFAULT_BACKEND
+        self.backend_name = backend or os.environ.get(WORKER_BACKEND_ENV) or default
+        self.model_path = model_path
+        if self.backend_name == "pool":
+            raise ValueError("Pool workers need a concrete backend (keras, tflite, onnx)")
+        self.threads_per_worker = threads_per_worker or default_threads(self.num_workers)
+        self.slot_size = slot_size
+        num_slots = num_slots or self.num_workers * SLOTS_PER_WORKER + pipeline.PREFETCH_BATCHES + 1
+        self.num_slots = num_slots
+        self.timeout = float(os.environ.get(TIMEOUT_ENV, DEFAULT_TIMEOUT))
+        slot_shape = (num_slots, slot_size, *INPUT_SHAPE)
+
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slot_shape)) * 4)
+        self._slots = np.ndarray(slot_shape, dtype=np.float32, buffer=self._shm.buf)
+        self._free = queue.Queue()
+        for slot in range(num_slots):
+            self._free.put(slot)
+        self._ids = itertools.count()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._closed = False
+        self._error = None
+
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._processes = [
+            context.Process(target=_worker_main, name=f"inference-worker-{i}", daemon=True,
+                            args=(i, self.backend_name, model_path, self.threads_per_worker,
+                                  self._shm.name, slot_shape, self._tasks, self._results))
+            for i in range(self.num_workers)
+        ]
+        for process in self._processes:
+            process.start()
+        atexit.register(self.close)
+        self._wait_ready()
+        self._collector = threading.Thread(target=self._collect, name="worker-pool-results", daemon=True)
+        self._collector.start()
+
+    def _wait_ready(self):
+        errors = []
+        for _ in range(self.num_workers):
+            try:
+                _, worker_id, error, self.model_path = self._results.get(timeout=STARTUP_TIMEOUT)
+            except queue.Empty:
+                errors.append("timed out waiting for workers")
+                break
+            if error:
+                errors.append(f"worker {worker_id}: {error}")
+        if errors:
+            self.close()
+            raise RuntimeError("Worker pool failed to start: " + "; ".join(errors))
+
+    def _collect(self):
+        while not self._closed:
+            try:
+                status, request_id, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if not self._closed and not all(p.is_alive() for p in self._processes):
+                    self._fail_all(RuntimeError("An inference worker exited unexpectedly"))
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            with self._pending_lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is None:
+                continue
+            future, slot = entry
+            if slot is not None:
+                self._free.put(slot)
+            if status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def _fail_all(self, error):
+        # Under the lock, so _submit either sees the error or registers a future this drains
+        with self._pending_lock:
+            self._error = self._error or error
+            pending, self._pending = self._pending, {}
+        for future, slot in pending.values():
+            if slot is not None:
+                self._free.put(slot)
+            future.set_exception(error)
+
+    def _abandon(self, error):
+        # A hung worker may still read its slot (and ignore SIGTERM); kill them all before the slots go back
+        for process in self._processes:
+            if process.is_alive():
+                process.kill()
+        self._fail_all(error)
+
+    def _take(self, timeout):
+        if self._error is not None:
+            raise self._error
+        try:
+            return self._free.get(timeout=self.timeout if timeout is None else max(0.0, timeout))
+        except queue.Empty:
+            raise TimeoutError("No free worker-pool slot; every slot is busy") from None
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Take a free slot, waiting at most ``timeout`` seconds (default ``self.timeout``).
+
+        Yields a ``PoolSlot``; fill ``slot.array[:count]`` and call
+        ``slot.submit(count)`` inside the ``with`` block. The slot goes back to
+        the ring when its result arrives, or on exit if it was never submitted.
+        """
+        slot = PoolSlot(self, self._take(timeout))
+        try:
+            yield slot
+        finally:
+            if slot.future is None:
+                self._free.put(slot.index)
+
+    @contextmanager
+    def reserve(self, count, timeout=None):
+        """Hold ``count`` slots for the whole ``with`` block, e.g. as the decode ring of pipeline.iter_batches.
+
+        Yields a list of ``PoolSlot``. Reserved slots can be filled and
+        submitted again and again without any copy; they go back to the ring
+        on exit, once their last request has finished.
+        """
+        if count > self.num_slots:
+            raise ValueError(f"cannot reserve {count} of {self.num_slots} slots")
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        slots = []
+        try:
+            for _ in range(count):
+                slots.append(PoolSlot(self, self._take(deadline - time.monotonic()), reserved=True))
+            yield slots
+        finally:
+            futures = [slot.future for slot in slots if slot.future is not None]
+            if wait(futures, timeout=self.timeout).not_done:
+                self._abandon(TimeoutError("Worker pool request timed out; the pool has been shut down"))
+            for slot in slots:
+                self._free.put(slot.index)
+
+    def _submit(self, slot, count, release=True):
+        future = Future()
+        request_id = next(self._ids)
+        with self._pending_lock:
+            if self._error is not None:
+                raise self._error
+            self._pending[request_id] = (future, slot if release else None)
+        self._tasks.put((request_id, slot, count))
+        return future
+
+    def submit(self, batch, timeout=None):
+        """Copy ``batch`` (at most ``slot_size`` images) into shared memory; return a Future of its probabilities."""
+        if len(batch) > self.slot_size:
+            raise ValueError(f"batch of {len(batch)} exceeds the slot size {self.slot_size}")
+        with self.slot(timeout) as slot:
+            slot.array[:len(batch)] = batch
+            return slot.submit(len(batch))
+
+    def result(self, future, timeout=None):
+        """Wait for ``future``; a request that outlives ``timeout`` means a hung worker, so the pool is abandoned."""
+        try:
+            return future.result(self.timeout if timeout is None else max(0.0, timeout))
+        except FutureTimeout:
+            error = TimeoutError("Worker pool request timed out; the pool has been shut down")
+            self._abandon(error)
+            raise error from None
+
+    def predict(self, batch, timeout=None):
+        """Split ``batch`` across the workers and return the concatenated probabilities.
+
+        Raises TimeoutError when a free slot or the results take longer than
+        ``timeout`` seconds (default ``NEUROSCAN_POOL_TIMEOUT``).
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        batch = np.asarray(batch, dtype=np.float32)
+        chunk = min(self.slot_size, max(1, math.ceil(len(batch) / self.num_workers)))
+        futures = [self.submit(batch[i:i + chunk], deadline - time.monotonic()) for i in range(0, len(batch), chunk)]
+        return np.concatenate([self.result(future, deadline - time.monotonic()) for future in futures])
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for process in self._processes:
+            if process.is_alive():
+                self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._fail_all(RuntimeError("Worker pool closed"))
+        del self._slots
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class PoolSlot:
+    def __init__(self, pool, index, reserved=False):
+        self.pool = pool
+        self.index = index
+        self.array = pool._slots[index]
+        self.reserved = reserved
+        self.future = None
+
+    def submit(self, count):
+        """Run the first ``count`` images in ``array``; a reserved slot must not be refilled before the result is in."""
+        self.future = self.pool._submit(self.index, count, release=not self.reserved)
+        return self.future
+
+
+class PoolBackend:
+    """Backend adapter so ``NEUROSCAN_BACKEND=pool`` works wherever create_backend is used."""
+
+    name = "pool"
+
+    @staticmethod
+    def import_runtime():
+        return multiprocessing
+
+    def __init__(self, model_path=None, num_workers=None, backend=None, threads_per_worker=None):
+        self._args = (num_workers, backend, model_path, threads_per_worker)
+        self._lock = threading.Lock()
+        self.pool = WorkerPool(*self._args)
+        self.model_path = self.pool.model_path
+        print(f"worker pool: {self.pool.num_workers} x {self.pool.backend_name} "
+              f"({self.pool.threads_per_worker} threads each)", file=sys.stderr)
+
+    def predict(self, batch):
+        with self._lock:
+            if self.pool.failed:
+                # A dead or hung worker took the old pool down; start over rather than fail forever
+                print(f"worker pool: restarting after {self.pool._error}", file=sys.stderr)
+                self.pool.close()
+                self.pool = WorkerPool(*self._args)
+            pool = self.pool
+        return pool.predict(batch)